@@ -0,0 +1,155 @@
+import shutil
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from message_store import MessageStore
+
+
+class BackupManager:
+    """Snapshot-plus-delta backups for a MessageStore.
+
+    Each backup set is a directory under ``backup_dir`` holding one full
+    ``snapshot`` of the store followed by numbered ``segment_NNNN`` files.
+    For stores with ``incremental_backups`` (the journal) a segment holds
+    only the journal bytes appended since the previous snapshot/segment, so
+    nothing is copied twice. Stores without it only get snapshots.
+
+    Work is scheduled by thresholds instead of per message: a segment is
+    cut once ``segment_bytes`` have accumulated or ``segment_interval``
+    seconds have passed with new data, and a fresh snapshot is taken every
+    ``snapshot_interval`` seconds or whenever the journal was compacted.
+    """
+
+    def __init__(self, store: MessageStore, backup_dir, snapshot_interval: float = 3600,
+                 segment_interval: float = 300, segment_bytes: int = 1024 * 1024,
+                 keep_snapshots: int = 5, check_interval: float = 5.0):
+        self.store = store
+        self.backup_dir = Path(backup_dir)
+        self.snapshot_interval = snapshot_interval
+        self.segment_interval = segment_interval
+        self.segment_bytes = segment_bytes
+        self.keep_snapshots = keep_snapshots
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+
+        self._current: Optional[Path] = None
+        self._generation = None
+        self._offset = 0
+        self._segments = 0
+        self._last_snapshot = 0.0
+        self._last_segment = 0.0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background scheduling thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.maybe_backup()
+            except Exception as e:
+                print(f"❌ Backup failed: {e}")
+
+    def list_backups(self) -> List[Path]:
+        """Backup set directories, oldest first."""
+        if not self.backup_dir.exists():
+            return []
+        return sorted(p for p in self.backup_dir.iterdir()
+                      if p.is_dir() and (p / self._snapshot_name()).exists())
+
+    def _snapshot_name(self) -> str:
+        return f"snapshot{self.store.path.suffix}"
+
+    def snapshot(self) -> Path:
+        """Take a full snapshot and start a new backup set."""
+        with self.lock:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            backup_set = self.backup_dir / timestamp
+            backup_set.mkdir(parents=True, exist_ok=True)
+            snapshot_path = backup_set / self._snapshot_name()
+            if self.store.incremental_backups:
+                self._generation, self._offset = self.store.snapshot_to(snapshot_path)
+            else:
+                self.store.backup_to(snapshot_path)
+            self._current = backup_set
+            self._segments = 0
+            self._last_snapshot = self._last_segment = time.time()
+            self._prune()
+            return backup_set
+
+    def write_segment(self) -> Optional[Path]:
+        """Save journal bytes appended since the last snapshot/segment.
+
+        Falls back to a new snapshot if the journal has been rewritten
+        since the current set was started.
+        """
+        if not self.store.incremental_backups or self._current is None:
+            return self.snapshot()
+        with self.lock:
+            generation, delta = self.store.read_from(self._offset)
+            if generation == self._generation:
+                self._last_segment = time.time()
+                if not delta:
+                    return None
+                self._segments += 1
+                segment_path = self._current / f"segment_{self._segments:04d}{self.store.path.suffix}"
+                with open(segment_path, 'wb') as f:
+                    f.write(delta)
+                self._offset += len(delta)
+                return segment_path
+        return self.snapshot()
+
+    def _pending_bytes(self) -> int:
+        """Journal bytes not yet covered by the current backup set, -1 if it was rewritten."""
+        if getattr(self.store, 'generation', None) != self._generation:
+            return -1
+        try:
+            return self.store.path.stat().st_size - self._offset
+        except FileNotFoundError:
+            return 0
+
+    def maybe_backup(self):
+        """Cut a snapshot or segment if a time or byte threshold has been reached."""
+        now = time.time()
+        if self._current is None or now - self._last_snapshot >= self.snapshot_interval:
+            if self.store.path.exists():
+                self.snapshot()
+            return
+        if not self.store.incremental_backups:
+            return
+        pending = self._pending_bytes()
+        if pending < 0:
+            self.snapshot()
+        elif pending >= self.segment_bytes or (pending and now - self._last_segment >= self.segment_interval):
+            self.write_segment()
+
+    def restore_latest(self) -> Optional[Path]:
+        """Replay the newest snapshot plus its segments into the store."""
+        backups = self.list_backups()
+        if not backups:
+            return None
+        latest = backups[-1]
+        snapshot_path = latest / self._snapshot_name()
+        if self.store.incremental_backups:
+            segments = sorted(latest.glob(f"segment_*{self.store.path.suffix}"))
+            self.store.restore_from_files([snapshot_path] + segments)
+        else:
+            self.store.restore_from(snapshot_path)
+        with self.lock:
+            # Start a clean set on the next check rather than appending to the restored one
+            self._current = None
+        return latest
+
+    def _prune(self):
+        for old_set in self.list_backups()[:-self.keep_snapshots]:
+            shutil.rmtree(old_set, ignore_errors=True)
@@ -0,0 +1,83 @@
+"""CPU cost vs bytes saved for per-transfer compression.
+
+Usage: python benchmarks/bench_compression.py
+Office-style documents are generated (text report, CSV, HTML, JSON, and a
+docx-like zip of XML); media comes from the sample files in data/files.
+For each file the table shows what sniffing picks, then the size after
+zlib and lzma and the CPU seconds per MiB to compress and decompress it,
+chunk by chunk as file_transfer.py does.
+"""
+import io
+import json
+import random
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from compression import choose_codec, compress, decompress, entropy, SAMPLE_SIZE
+from file_transfer import MANIFEST_CHUNK_SIZE
+
+WORDS = ("the quarterly report shows revenue growth across all regions while operating "
+         "costs remained flat budget forecast meeting agenda action items customer "
+         "project milestone review approved pending deadline team update").split()
+
+
+def office_documents(size):
+    rng = random.Random(42)
+    text = ' '.join(rng.choice(WORDS) for _ in range(size // 6)).encode()[:size]
+    rows = ['date,region,product,units,revenue']
+    for _ in range(size // 40):
+        rows.append(f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02},{rng.choice(['north', 'south', 'east', 'west'])},"
+                    f"SKU-{rng.randint(1000, 9999)},{rng.randint(1, 500)},{rng.uniform(10, 9000):.2f}")
+    csv = '\n'.join(rows).encode()[:size]
+    html = ''.join(f"<tr><td class=\"cell\">{rng.choice(WORDS)}</td><td>{rng.randint(0, 10 ** 6)}</td></tr>\n"
+                   for _ in range(size // 40)).encode()[:size]
+    records = json.dumps([{'id': i, 'owner': rng.choice(WORDS), 'status': rng.choice(['open', 'closed']),
+                           'score': rng.random()} for i in range(size // 60)]).encode()[:size]
+    docx = io.BytesIO()
+    with zipfile.ZipFile(docx, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('word/document.xml', b'<w:p><w:r><w:t>' + text + b'</w:t></w:r></w:p>')
+    return [('report.txt', text), ('sales.csv', csv), ('table.html', html),
+            ('records.json', records), ('report.docx', docx.getvalue())]
+
+
+def media_files():
+    return [(path.name, path.read_bytes()) for path in sorted((ROOT / 'data' / 'files').iterdir())
+            if path.is_file()]
+
+
+def chunks(data):
+    return [data[i:i + MANIFEST_CHUNK_SIZE] for i in range(0, len(data), MANIFEST_CHUNK_SIZE)]
+
+
+def measure(codec, data):
+    start = time.process_time()
+    packed = [compress(codec, chunk) for chunk in chunks(data)]
+    compress_cpu = time.process_time() - start
+    start = time.process_time()
+    for raw, chunk in zip(chunks(data), packed):
+        decompress(codec, chunk, len(raw))
+    decompress_cpu = time.process_time() - start
+    return sum(map(len, packed)), compress_cpu, decompress_cpu
+
+
+def main():
+    files = [('office', name, data) for name, data in office_documents(4 * 1024 * 1024)]
+    files += [('media', name, data) for name, data in media_files()]
+    print(f"{'kind':<7} {'file':<40} {'size':>9} {'bits/B':>6} {'sniff':>5} "
+          f"{'zlib':>9} {'ms/MiB':>7} {'lzma':>9} {'ms/MiB':>7} {'unz ms':>7}")
+    for kind, name, data in files:
+        mib = len(data) / (1024 * 1024)
+        picked = choose_codec(data[:SAMPLE_SIZE], len(data)) or '-'
+        zsize, zcpu, zdecomp = measure('zlib', data)
+        lsize, lcpu, _ = measure('lzma', data)
+        print(f"{kind:<7} {name[:40]:<40} {len(data):>9} {entropy(data[:SAMPLE_SIZE]):>6.2f} {picked:>5} "
+              f"{zsize:>9} {zcpu * 1000 / mib:>7.1f} {lsize:>9} {lcpu * 1000 / mib:>7.1f} {zdecomp * 1000 / mib:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Loopback throughput and peak memory of file transfers.
+
+Usage: python benchmarks/bench_file_transfer.py [size_mb]
+Compares the old base64-in-JSON transfer with the streaming protocol in
+file_transfer.py. The old format cannot exceed the 8-digit length header
+(~71 MiB of file data), so it is skipped for larger sizes. Peak memory is Python allocations seen by tracemalloc
+across sender and receiver.
+"""
+import base64
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_transfer import recv_exact, recv_json_frame, send_file_stream, receive_file_stream
+
+
+def legacy_send(sock, filepath):
+    with open(filepath, 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode('utf-8')
+    body = json.dumps({'type': 'file', 'filename': os.path.basename(filepath), 'content': encoded}).encode('utf-8')
+    sock.sendall(f"{len(body):08}".encode('utf-8') + body)
+
+
+def legacy_receive(sock, files_dir):
+    length = int(recv_exact(sock, 8).decode('utf-8'))
+    message = json.loads(recv_exact(sock, length).decode('utf-8'))
+    with open(Path(files_dir) / message['filename'], 'wb') as f:
+        f.write(base64.b64decode(message['content']))
+
+
+def stream_receive(sock, files_dir):
+    receive_file_stream(sock, recv_json_frame(sock), files_dir)
+
+
+def run(send, receive, filepath, out_dir):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        conn, _ = listener.accept()
+        with conn:
+            receive(conn, out_dir)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    receiver = threading.Thread(target=serve)
+    receiver.start()
+    with socket.create_connection(listener.getsockname()) as sock:
+        send(sock, filepath)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    listener.close()
+    return elapsed, peak
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = Path(tmp) / 'payload.bin'
+        with open(filepath, 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        out_dir = Path(tmp) / 'received'
+        out_dir.mkdir()
+        print(f"{size_mb} MiB over loopback")
+        print(f"{'protocol':>10} {'MiB/s':>9} {'peak MiB':>10}")
+        protocols = [('stream', lambda s, p: send_file_stream(s, p, {}), stream_receive)]
+        if size_mb * 2**20 * 4 / 3 < 10**8:
+            protocols.insert(0, ('base64', legacy_send, legacy_receive))
+        for name, send, receive in protocols:
+            elapsed, peak = run(send, receive, filepath, out_dir)
+            print(f"{name:>10} {size_mb / elapsed:>9.1f} {peak / 2**20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
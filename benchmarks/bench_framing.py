@@ -0,0 +1,68 @@
+"""Encode/decode cost per frame: legacy 8-digit JSON frames vs binary frames.
+
+Usage: python benchmarks/bench_framing.py
+Legacy frames JSON-encode everything and base64 file bytes inside the
+JSON; binary frames (framing.py) carry a struct header, compact metadata
+and the raw payload. Decoding goes through framing.split_frame, as the
+server does, for both formats. Compression is off so only framing is
+measured.
+"""
+import base64
+import json
+import os
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from framing import encode_legacy, encode_message, split_frame
+
+
+def cases():
+    yield 'short text', {'type': 'text', 'username': 'alice', 'content': 'See you at the standup in 5?'}
+    yield '4 KiB text', {'type': 'text', 'username': 'alice', 'content': 'lorem ipsum dolor ' * 228}
+    data = os.urandom(64 * 1024)
+    yield '64 KiB file', {'type': 'file', 'username': 'alice', 'filename': 'photo.jpg', 'data': data}
+
+
+def legacy_form(message):
+    """The legacy wire form: file bytes are base64 inside the JSON."""
+    if 'data' in message:
+        message = dict(message)
+        message['content'] = base64.b64encode(message.pop('data')).decode('ascii')
+    return message
+
+
+def legacy_decode(frame):
+    message, _ = split_frame(frame)
+    if message.get('type') == 'file':
+        message['data'] = base64.b64decode(message['content'])
+    return message
+
+
+def per_call(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'frame':<12} {'format':<7} {'bytes':>7} {'encode us':>10} {'decode us':>10}")
+    for name, message in cases():
+        number = 20000 if 'data' not in message else 500
+        legacy = legacy_form(message)
+        legacy_frame = encode_legacy(legacy)
+        binary_frame = encode_message(message, compress=False)
+        assert legacy_decode(legacy_frame)['type'] == split_frame(binary_frame)[0]['type']
+        rows = (
+            ('legacy', legacy_frame,
+             lambda: encode_legacy(legacy_form(message)), lambda: legacy_decode(legacy_frame)),
+            ('binary', binary_frame,
+             lambda: encode_message(message, compress=False), lambda: split_frame(binary_frame)),
+        )
+        for fmt, frame, encode, decode in rows:
+            print(f"{name:<12} {fmt:<7} {len(frame):>7} {per_call(encode, number):>10.2f} "
+                  f"{per_call(decode, number):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
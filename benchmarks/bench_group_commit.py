@@ -0,0 +1,56 @@
+"""Messages/sec from concurrent save_message callers per durability mode.
+
+Usage: python benchmarks/bench_group_commit.py [messages_per_sender]
+Runs 1, 8 and 64 concurrent senders against a journal in a temp directory.
+"""
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from message_handler import MessageHandler
+
+SENDERS = (1, 8, 64)
+MODES = ('always', 'group', 'fsync')
+
+
+def run(mode, senders, per_sender):
+    with tempfile.TemporaryDirectory() as tmp:
+        handler = MessageHandler(tmp, durability=mode, flush_interval_ms=10)
+        barrier = threading.Barrier(senders + 1)
+
+        def sender(n):
+            barrier.wait()
+            for i in range(per_sender):
+                handler.save_message({
+                    'sender_ip': f"10.0.0.{n}",
+                    'username': f"user{n}",
+                    'content': f"message {i}"
+                })
+
+        threads = [threading.Thread(target=sender, args=(n,)) for n in range(senders)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        # Count the time until everything is on disk, not just queued
+        handler.close()
+        elapsed = time.perf_counter() - start
+        return senders * per_sender / elapsed
+
+
+def main():
+    per_sender = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"{'senders':>8} " + " ".join(f"{mode + ' msg/s':>14}" for mode in MODES))
+    for senders in SENDERS:
+        rates = [run(mode, senders, per_sender) for mode in MODES]
+        print(f"{senders:>8} " + " ".join(f"{rate:>14.0f}" for rate in rates))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Resident memory of Message objects, slotted vs. the old __dict__ layout.
+
+Usage: python benchmarks/bench_message_memory.py [count]
+Defaults to 1M messages spread over 50 peers.
+"""
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from message_handler import Message
+
+
+class DictMessage:
+    """The previous Message layout: per-instance __dict__, string timestamp and id."""
+
+    def __init__(self, sender_ip, sender_username, content, msg_type="text"):
+        self.sender_ip = sender_ip
+        self.sender_username = sender_username
+        self.content = content
+        self.type = msg_type
+        self.timestamp = datetime.now().isoformat()
+        self.read = False
+        self.id = f"{int(datetime.now().timestamp() * 1000)}_{sender_ip}"
+
+    @staticmethod
+    def from_dict(data):
+        msg = DictMessage(data['sender_ip'], data['sender_username'], data['content'], data.get('type', 'text'))
+        msg.timestamp = data['timestamp']
+        msg.read = data.get('read', False)
+        msg.id = data.get('id', msg.id)
+        return msg
+
+
+def records(count, peers=50):
+    start = datetime(2025, 1, 1)
+    for i in range(count):
+        ts = start + timedelta(milliseconds=i * 1500)
+        # Build fresh strings per record, as json.load would
+        ip = ''.join(['10.0.0.', str(i % peers)])
+        yield {
+            'id': f"{int(ts.timestamp() * 1000)}_{ip}",
+            'sender_ip': ip,
+            'sender_username': ''.join(['user', str(i % peers)]),
+            'content': f"message {i}",
+            'type': ''.join(['te', 'xt']),
+            'timestamp': ts.isoformat(),
+            'read': False
+        }
+
+
+def measure(cls, count):
+    tracemalloc.start()
+    messages = [cls.from_dict(data) for data in records(count)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del messages
+    return current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    before = measure(DictMessage, count)
+    after = measure(Message, count)
+    print(f"{count} messages")
+    print(f"  __dict__ Message: {before / 2**20:8.1f} MiB ({before / count:6.1f} B/msg)")
+    print(f"  slotted Message:  {after / 2**20:8.1f} MiB ({after / count:6.1f} B/msg)")
+    print(f"  saved:            {(before - after) / 2**20:8.1f} MiB ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Compare the legacy JSON file store with SQLiteMessageStore.
+
+Usage: python benchmarks/bench_message_store.py [sizes...]
+Defaults to 10k, 100k and 1M messages. Runs in a temporary directory.
+"""
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from message_store import JSONFileStore, SQLiteMessageStore
+
+
+def make_records(count, peers=50):
+    start = datetime(2025, 1, 1)
+    return [
+        {
+            'id': f"{i}_10.0.0.{i % peers}",
+            'sender_ip': f"10.0.0.{i % peers}",
+            'sender_username': f"user{i % peers}",
+            'content': f"message number {i}",
+            'type': 'text',
+            'timestamp': (start + timedelta(seconds=i)).isoformat(),
+            'read': False
+        }
+        for i in range(count)
+    ]
+
+
+def timed(fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(store, records):
+    cutoff = datetime.fromisoformat(records[len(records) // 10]['timestamp'])
+    store.append_many(records)
+    new = dict(records[-1], id='new', timestamp=datetime.now().isoformat())
+    return {
+        'append': timed(lambda: store.append(new), repeat=3),
+        'peer_last_50': timed(lambda: store.query_peer('10.0.0.7', 50), repeat=3),
+        'delete_before': timed(lambda: store.delete(before_date=cutoff)),
+    }
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    print(f"{'messages':>10} {'store':>8} {'append ms':>12} {'peer_last_50 ms':>16} {'delete_before ms':>17}")
+    for size in sizes:
+        records = make_records(size)
+        with tempfile.TemporaryDirectory() as tmp:
+            stores = {
+                'json': JSONFileStore(Path(tmp) / 'messages.json'),
+                'sqlite': SQLiteMessageStore(Path(tmp) / 'messages.db'),
+            }
+            for name, store in stores.items():
+                result = bench(store, [dict(r) for r in records])
+                store.close()
+                print(f"{size:>10} {name:>8} {result['append']:>12.2f} "
+                      f"{result['peer_last_50']:>16.2f} {result['delete_before']:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Throughput of resumable file transfers over N parallel loopback connections.
+
+Usage: python benchmarks/bench_parallel_streams.py [size_mb] [window_kb]
+Each run sends the whole file with file_transfer.send_file_resumable,
+splitting the chunks across N connections. The manifest is built once up
+front, so the timings cover the transfer plus the receiver's verification.
+``window_kb`` caps SO_SNDBUF/SO_RCVBUF on every connection to imitate the
+per-connection window limits that parallel streams are meant to get around
+on a real LAN; loopback itself has no such limit.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_transfer import (build_manifest, recv_json_frame, send_file_resumable,
+                           receive_file_resumable, receive_file_chunks)
+
+
+def limit_window(sock, window):
+    if window:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, window)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, window)
+
+
+def serve(listener, files_dir, window):
+    def handle(conn):
+        with conn:
+            header = recv_json_frame(conn)
+            if header['type'] == 'file_manifest':
+                receive_file_resumable(conn, header, files_dir)
+            else:
+                receive_file_chunks(conn, header)
+
+    while True:
+        try:
+            conn, _ = listener.accept()
+        except OSError:
+            return
+        limit_window(conn, window)
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    window = int(sys.argv[2]) * 1024 if len(sys.argv) > 2 else 0
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = Path(tmp) / 'payload.bin'
+        with open(filepath, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(block)
+        files_dir = Path(tmp) / 'received'
+        manifest = build_manifest(filepath)
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        limit_window(listener, window)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(64)
+        threading.Thread(target=serve, args=(listener, files_dir, window), daemon=True).start()
+
+        def connect():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            limit_window(sock, window)
+            sock.connect(listener.getsockname())
+            return sock
+
+        print(f"{size_mb} MiB over loopback, window {'default' if not window else f'{window // 1024} KiB'}")
+        print(f"{'streams':>8} {'seconds':>9} {'MiB/s':>9}")
+        for streams in (1, 2, 4, 8, 16):
+            shutil.rmtree(files_dir, ignore_errors=True)
+            start = time.perf_counter()
+            with connect() as sock:
+                send_file_resumable(sock, filepath, {}, manifest, streams=streams, connect=connect)
+            elapsed = time.perf_counter() - start
+            print(f"{streams:>8} {elapsed:>9.3f} {size_mb / elapsed:>9.1f}")
+        listener.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Search latency of SearchIndex at scale.
+
+Usage: python benchmarks/bench_search.py [count]
+Indexes synthetic chat lines (defaults to 1M) and times typical queries.
+First checks that peer and date filters still find old matches of a word
+too common to score in full (more than MAX_CANDIDATES postings).
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from search_index import SearchIndex
+
+COMMON = ("ok", "thanks", "yes", "no", "the", "meeting", "lunch", "file", "sent", "call", "today", "later")
+TOPICS = [f"project{i}" for i in range(2000)] + [f"ticket{i}" for i in range(20000)]
+
+
+def build(count, seed=1):
+    rng = random.Random(seed)
+    index = SearchIndex()
+    start = time.perf_counter()
+    for i in range(count):
+        words = rng.choices(COMMON, k=rng.randint(2, 6)) + rng.choices(TOPICS, k=rng.randint(0, 2))
+        index.add(f"{i}", " ".join(words), f"10.0.0.{i % 50}", 1_700_000_000_000_000 + i * 1_000_000)
+    return index, time.perf_counter() - start
+
+
+def check_filters():
+    index = SearchIndex()
+    old = SearchIndex.MAX_CANDIDATES // 2
+    count = SearchIndex.MAX_CANDIDATES * 5
+    for i in range(count):
+        index.add(f"{i}", "hello world", "A" if i < old else "B", i)
+    checks = [
+        ("peer filter", index.search("hello", peer="A", limit=count), old),
+        ("until filter", index.search("hello", until_us=old, limit=count), old),
+        ("since filter", index.search("hello", since_us=count - 100, limit=count), 100),
+        ("peer and since", index.search("hello", peer="A", since_us=old - 10, limit=count), 10),
+    ]
+    for label, hits, expected in checks:
+        assert len(hits) == expected, f"{label}: expected {expected} hits, got {len(hits)}"
+    print("filtered queries on a common word find old matches: ok")
+
+
+def timed(index, query, repeat=20, **filters):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        hits = index.search(query, **filters)
+    return (time.perf_counter() - start) / repeat * 1000, len(hits)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    check_filters()
+    index, build_time = build(count)
+    print(f"indexed {count} messages in {build_time:.1f}s ({count / build_time:.0f} msg/s)")
+    # The first prefix query folds newly seen terms into the sorted term list
+    start = time.perf_counter()
+    index.search("warm")
+    print(f"first query (term merge): {(time.perf_counter() - start) * 1000:.1f} ms")
+    queries = [
+        ("rare term", "ticket1234", {}),
+        ("rare prefix", "ticket123", {}),
+        ("topic + common", "project42 lunch", {}),
+        ("topic, one peer", "project42", {'peer': '10.0.0.7'}),
+        ("topic, date range", "project42", {'since_us': 1_700_000_000_000_000 + count // 2 * 1_000_000}),
+        ("common term", "meeting", {}),
+        ("common, one peer", "meeting", {'peer': '10.0.0.7'}),
+        ("common, recent", "meeting", {'since_us': 1_700_000_000_000_000 + (count - 1000) * 1_000_000}),
+        ("short prefix", "t", {}),
+        ("wide prefix", "ti", {}),
+    ]
+    print(f"{'query':>20} {'ms':>9} {'hits':>5}")
+    for label, query, filters in queries:
+        ms, hits = timed(index, query, **filters)
+        print(f"{label:>20} {ms:>9.3f} {hits:>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""CPU cost per GiB of streaming a file over loopback.
+
+Usage: python benchmarks/bench_sendfile.py [size_mb]
+"before" copies through Python buffers (read + sendall, recv + write);
+"after" is file_transfer.py: socket.sendfile on the sender and recv_into
+a reusable buffer on the receiver. CPU time is per thread (thread_time),
+so sender and receiver costs are reported separately. On loopback the
+kernel's TCP work is charged to whichever side happens to run it.
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from file_transfer import CHUNK_SIZE, recv_json_frame, send_json_frame, send_file_stream, receive_file_stream
+
+
+def copy_send(sock, filepath):
+    size = os.path.getsize(filepath)
+    send_json_frame(sock, {'type': 'file_stream', 'filename': os.path.basename(filepath), 'size': size})
+    with open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+
+
+def copy_receive(sock, files_dir):
+    header = recv_json_frame(sock)
+    remaining = header['size']
+    with open(Path(files_dir) / header['filename'], 'wb') as f:
+        while remaining:
+            chunk = sock.recv(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise EOFError
+            f.write(chunk)
+            remaining -= len(chunk)
+
+
+def zero_copy_send(sock, filepath):
+    send_file_stream(sock, filepath, {})
+
+
+def zero_copy_receive(sock, files_dir):
+    receive_file_stream(sock, recv_json_frame(sock), files_dir)
+
+
+def run(send, receive, filepath, out_dir):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    receiver_cpu = []
+
+    def serve():
+        conn, _ = listener.accept()
+        start = time.thread_time()
+        with conn:
+            receive(conn, out_dir)
+        receiver_cpu.append(time.thread_time() - start)
+
+    receiver = threading.Thread(target=serve)
+    receiver.start()
+    wall_start = time.perf_counter()
+    with socket.create_connection(listener.getsockname()) as sock:
+        cpu_start = time.thread_time()
+        send(sock, filepath)
+        sender_cpu = time.thread_time() - cpu_start
+    receiver.join()
+    listener.close()
+    return sender_cpu, receiver_cpu[0], time.perf_counter() - wall_start
+
+
+def main():
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        filepath = Path(tmp) / 'payload.bin'
+        with open(filepath, 'wb') as f:
+            block = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(block)
+        out_dir = Path(tmp) / 'received'
+        out_dir.mkdir()
+        gib = size_mb / 1024
+        print(f"{size_mb} MiB over loopback")
+        print(f"{'path':>8} {'send CPU s/GiB':>15} {'recv CPU s/GiB':>15} {'MiB/s':>9}")
+        for name, send, receive in (('before', copy_send, copy_receive),
+                                    ('after', zero_copy_send, zero_copy_receive)):
+            sender_cpu, receiver_cpu, wall = run(send, receive, filepath, out_dir)
+            print(f"{name:>8} {sender_cpu / gib:>15.3f} {receiver_cpu / gib:>15.3f} {size_mb / wall:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Load test for the LANMessenger TCP servers: accept rate and delivery latency.
+
+Usage: python benchmarks/bench_server_load.py [connections] [messages_per_connection] [rate]
+For each server mode, client threads open all connections at once (the
+accept rate is connections / time until the server accepted the last),
+then send length-prefixed chat frames stamped with their send time round
+robin over the open connections, paced to ``rate`` frames/s in total
+(0 sends as fast as possible, which measures queueing, not latency).
+Delivery latency is measured when the frame reaches the server's handler;
+peak thread count is sampled too.
+"""
+import json
+import resource
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from frame_server import SelectorFrameServer, ThreadedFrameServer
+
+CLIENT_THREADS = 16
+
+
+def frame(obj):
+    body = json.dumps(obj).encode('utf-8')
+    return f"{len(body):08}".encode('utf-8') + body
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(server_class, connections, messages, rate):
+    accepted = []
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+    expected = connections * messages
+
+    def accept(addr):
+        accepted.append(time.perf_counter())
+        return True
+
+    def on_frame(addr, message):
+        latency = time.perf_counter() - message['sent_at']
+        with lock:
+            latencies.append(latency)
+            if len(latencies) == expected:
+                done.set()
+
+    server = server_class(0, on_frame, lambda *args: None, accept=accept, host='127.0.0.1', backlog=1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    peak_threads = threading.active_count()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(CLIENT_THREADS) as pool:
+        socks = list(pool.map(lambda _: socket.create_connection(server.address), range(connections)))
+    while len(accepted) < connections:
+        time.sleep(0.001)
+    accept_rate = connections / (accepted[-1] - start)
+    peak_threads = max(peak_threads, threading.active_count())
+
+    interval = CLIENT_THREADS / rate if rate else 0
+
+    def sender(offset):
+        next_send = time.perf_counter()
+        for i in range(messages):
+            for sock in socks[offset::CLIENT_THREADS]:
+                if interval:
+                    next_send += interval
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                sock.sendall(frame({'type': 'text', 'content': f'message {i}', 'sent_at': time.perf_counter()}))
+
+    senders = [threading.Thread(target=sender, args=(i,)) for i in range(CLIENT_THREADS)]
+    send_start = time.perf_counter()
+    for thread in senders:
+        thread.start()
+    while not done.wait(0.05):
+        peak_threads = max(peak_threads, threading.active_count())
+    throughput = expected / (time.perf_counter() - send_start)
+    for thread in senders:
+        thread.join()
+    for sock in socks:
+        sock.close()
+    server.stop()
+    return accept_rate, throughput, percentile(latencies, 50), percentile(latencies, 99), peak_threads
+
+
+def main():
+    connections = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rate = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 4 * connections + 256)), hard))
+    print(f"{connections} connections x {messages} messages over loopback, "
+          f"{'unpaced' if not rate else f'{rate} frames/s offered'}")
+    print(f"{'server':>10} {'accepts/s':>10} {'frames/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'threads':>8}")
+    for name, server_class in (('threads', ThreadedFrameServer), ('selectors', SelectorFrameServer)):
+        accepts, throughput, p50, p99, threads = run(server_class, connections, messages, rate)
+        print(f"{name:>10} {accepts:>10.0f} {throughput:>9.0f} {p50 * 1000:>8.2f} {p99 * 1000:>8.2f} {threads:>8}")
+
+
+if __name__ == '__main__':
+    main()
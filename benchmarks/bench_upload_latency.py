@@ -0,0 +1,174 @@
+"""Chat latency on a LANServer while a large file upload is in flight.
+
+Usage: python benchmarks/bench_upload_latency.py [--check] [upload_mb] [chat_interval_ms]
+For each strategy a LANServer runs in its own process. Two chat clients
+exchange stamped text messages every ``chat_interval_ms``; latency is the
+time from one client sending until the other receives the broadcast. It is
+measured first on an idle server, then while a third client (in another
+process) uploads a random file of ``upload_mb`` MB. ``inline`` and
+``offloaded`` send it the old way, as one JSON message with base64
+content, decoded and written on the event loop or on the upload pool;
+``chunked`` streams it as binary frames between file_start and file_end.
+With ``--check`` only ``chunked`` runs, and the script exits non-zero if
+the p99 chat latency during the upload is over CHECK_P99_MS.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import websockets
+
+# The single-message upload needs the whole base64 file in one websocket message
+LEGACY_MAX_SIZE = 320 * 1024 * 1024
+# Chat p99 allowed during a chunked upload in --check mode (measured around 6 ms for 200 MB)
+CHECK_P99_MS = 50
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve(port, inline, ready):
+    os.chdir(tempfile.mkdtemp())  # LANServer keeps its data/ folder in the working directory
+    from server import LANServer
+
+    class InlineServer(LANServer):
+        async def run_blocking(self, func, *args):
+            return func(*args)
+
+    async def main():
+        server = (InlineServer if inline else LANServer)(username='bench')
+        server.loop = asyncio.get_running_loop()
+        async with websockets.serve(server.handle_websocket, '127.0.0.1', port,
+                                    compression=None, max_size=LEGACY_MAX_SIZE):
+            ready.set()
+            await asyncio.Future()
+
+    asyncio.run(main())
+
+
+def upload(port, size_mb, chunked):
+    from websockets.sync.client import connect
+    from server import FILE_CHUNK_HEADER, FILE_CHUNK_SIZE
+    data = os.urandom(size_mb * 1024 * 1024)
+    with connect(f"ws://127.0.0.1:{port}", compression=None, max_size=None) as ws:
+        if chunked:
+            upload_id = uuid.uuid4()
+            ws.send(json.dumps({'type': 'file_start', 'upload_id': upload_id.hex,
+                                'fileName': 'big.bin', 'size': len(data)}))
+            for offset in range(0, len(data), FILE_CHUNK_SIZE):
+                ws.send(FILE_CHUNK_HEADER.pack(upload_id.bytes, offset) + data[offset:offset + FILE_CHUNK_SIZE])
+            ws.send(json.dumps({'type': 'file_end', 'upload_id': upload_id.hex,
+                                'sha256': hashlib.sha256(data).hexdigest()}))
+        else:
+            content = base64.b64encode(data).decode('ascii')
+            ws.send(json.dumps({'type': 'file', 'fileName': 'big.bin', 'content': content}))
+        time.sleep(1.0)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def chat(port, interval, until):
+    """Send stamped chat lines until ``until(state)`` is true; return their delivery latencies."""
+    url = f"ws://127.0.0.1:{port}"
+    sender = await websockets.connect(url, compression=None, max_size=None)
+    receiver = await websockets.connect(url, compression=None, max_size=None)
+    latencies = []
+    state = {'file': False}
+
+    async def receive():
+        async for raw in receiver:
+            message = json.loads(raw)
+            if message.get('type') == 'file':
+                state['file'] = True
+            elif message.get('type') == 'text':
+                latencies.append(time.perf_counter() - float(message['content']))
+
+    async def discard():
+        async for _ in sender:
+            pass
+
+    reader = asyncio.create_task(receive())
+    drain = asyncio.create_task(discard())
+    await asyncio.sleep(0.5)  # Let the peer-list updates settle
+    while not until(state):
+        await sender.send(json.dumps({'type': 'text', 'content': repr(time.perf_counter())}))
+        await asyncio.sleep(interval)
+    await asyncio.sleep(0.5)
+    reader.cancel()
+    drain.cancel()
+    await sender.close()
+    await receiver.close()
+    return latencies
+
+
+def report(label, latencies):
+    if not latencies:
+        print(f"  {label:<14}     0 msgs")
+        return
+    print(f"  {label:<14} {len(latencies):>5} msgs  median {percentile(latencies, 50) * 1000:8.1f} ms"
+          f"  p99 {percentile(latencies, 99) * 1000:8.1f} ms  max {max(latencies) * 1000:8.1f} ms")
+
+
+def measure(name, inline, chunked, size_mb, interval):
+    """Run one strategy; returns the chat latencies measured during the upload."""
+    port = free_port()
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=serve, args=(port, inline, ready), daemon=True)
+    server.start()
+    ready.wait()
+    print(f"{name}: {size_mb} MB upload")
+    deadline = time.perf_counter() + 2.0
+    report('idle', asyncio.run(chat(port, interval, lambda state: time.perf_counter() > deadline)))
+    uploader = multiprocessing.Process(target=upload, args=(port, size_mb, chunked))
+    uploader.start()
+    started = time.perf_counter()
+    latencies = asyncio.run(chat(port, interval, lambda state: state['file']))
+    report('during upload', latencies)
+    print(f"  upload broadcast after {time.perf_counter() - started:.1f} s")
+    uploader.join()
+    server.terminate()
+    server.join()
+    return latencies
+
+
+def main():
+    args = sys.argv[1:]
+    check = '--check' in args
+    if check:
+        args.remove('--check')
+    size_mb = int(args[0]) if len(args) > 0 else 200
+    interval = (int(args[1]) if len(args) > 1 else 20) / 1000
+    if check:
+        latencies = measure('chunked', False, True, size_mb, interval)
+        if not latencies:
+            print("❌ upload finished before any chat message was measured; use a larger upload_mb")
+            sys.exit(1)
+        p99_ms = percentile(latencies, 99) * 1000
+        if p99_ms > CHECK_P99_MS:
+            print(f"❌ chat p99 {p99_ms:.1f} ms during upload is over {CHECK_P99_MS} ms")
+            sys.exit(1)
+        print(f"chat p99 during upload under {CHECK_P99_MS} ms: ok")
+        return
+    for name, inline, chunked in (('inline', True, False), ('offloaded', False, False), ('chunked', False, True)):
+        measure(name, inline, chunked, size_mb, interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Fan-out latency of LANServer chat broadcasts to many browser clients.
+
+Usage: python benchmarks/bench_ws_broadcast.py [rounds] [client_counts...]
+For each client count, that many websocket clients connect to a LANServer
+served the way start_server serves it (permessage-deflate on, which is the
+websockets default). Each round broadcasts one chat message and measures
+the time until the last client has received it. ``sequential`` is the old
+approach (json.dumps and an awaited send per client); ``fan_out``
+serializes once and queues the frame on every client without awaiting any
+of them.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import websockets
+
+from connection_registry import ConnectionRegistry
+
+MESSAGE = {
+    'type': 'text',
+    'content': 'Is anyone around for lunch at 12:30? The usual place downstairs.',
+    'username': 'User@42',
+    'sender': '192.168.1.42',
+    'timestamp': '12:01:02',
+    'id': 123456,
+}
+
+
+async def sequential(server, message):
+    for peer_info, websocket in server.connections.items():
+        try:
+            await websocket.send(json.dumps(message))
+        except Exception as e:
+            print(f"❌ Error broadcasting to {peer_info}: {e}")
+
+
+async def fan_out(server, message):
+    await server.broadcast_message(message, None)
+
+
+async def run(server, clients, rounds, strategy):
+    server.connections = ConnectionRegistry()
+
+    async def handler(websocket):
+        server.connections.add(websocket.remote_address[0], server.client_id_for(websocket), websocket)
+        await websocket.wait_closed()
+
+    async with websockets.serve(handler, '127.0.0.1', 0, compression="deflate") as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        connections = [await websockets.connect(f"ws://127.0.0.1:{port}", compression="deflate")
+                       for _ in range(clients)]
+        while len(server.connections) < clients:
+            await asyncio.sleep(0.01)
+        latencies = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            await asyncio.gather(strategy(server, MESSAGE), *(c.recv() for c in connections))
+            latencies.append(time.perf_counter() - start)
+        for c in connections:
+            await c.close()
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1]
+
+
+async def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    counts = [int(n) for n in sys.argv[2:]] or [10, 100, 1000]
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)  # LANServer keeps its data/ folder in the working directory
+        from server import LANServer
+        server = LANServer(username='bench')
+        print(f"{'clients':>8} {'strategy':>11} {'median ms':>10} {'max ms':>8}")
+        for clients in counts:
+            for name, strategy in (('sequential', sequential), ('fan_out', fan_out)):
+                median, worst = await run(server, clients, rounds, strategy)
+                print(f"{clients:>8} {name:>11} {median * 1000:>10.2f} {worst * 1000:>8.2f}")
+        server.message_handler.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+
+
+class BlobStore:
+    """Content-addressed storage for received files.
+
+    File bytes are stored once under ``<root>/<sha[:2]>/<sha>`` and every
+    user-visible filename is a hard link to its blob (or a copy where the
+    filesystem cannot link). ``refs.json`` records which blob each visible
+    name points at, so a blob is removed once nothing references it.
+    Blobs are made read-only so editing a visible file in place cannot
+    silently corrupt other names that share it.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.refs_file = self.root / "refs.json"
+        self.lock = threading.RLock()
+        self.refs = self._load_refs()
+
+    def _load_refs(self):
+        try:
+            with open(self.refs_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"⚠️ Could not read blob references, starting empty: {e}")
+            return {}
+
+    def _save_refs(self):
+        tmp_path = self.refs_file.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.refs, f)
+        os.replace(tmp_path, self.refs_file)
+
+    @staticmethod
+    def _check_digest(sha256):
+        sha256 = str(sha256).lower()
+        if len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256):
+            raise ValueError(f"Invalid sha256 digest: {sha256!r}")
+        return sha256
+
+    def path_for(self, sha256):
+        sha256 = self._check_digest(sha256)
+        return self.root / sha256[:2] / sha256
+
+    def has(self, sha256):
+        try:
+            return self.path_for(sha256).is_file()
+        except ValueError:
+            return False
+
+    def put_bytes(self, data):
+        """Store ``data`` unless an identical blob exists; return its digest."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if not self.has(sha256):
+                blob_path = self.path_for(sha256)
+                blob_path.parent.mkdir(exist_ok=True)
+                tmp_path = blob_path.with_name(blob_path.name + '.tmp')
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                self._seal(tmp_path, blob_path)
+        return sha256
+
+    def put_file(self, src_path, sha256):
+        """Move an already-verified file into the store as blob ``sha256``.
+
+        If the blob exists already the source is simply removed.
+        """
+        with self.lock:
+            if self.has(sha256):
+                Path(src_path).unlink(missing_ok=True)
+            else:
+                blob_path = self.path_for(sha256)
+                blob_path.parent.mkdir(exist_ok=True)
+                self._seal(src_path, blob_path)
+        return sha256
+
+    @staticmethod
+    def _seal(src_path, blob_path):
+        os.chmod(src_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(src_path, blob_path)
+
+    def link(self, sha256, dest_path):
+        """Point the visible name ``dest_path`` at blob ``sha256``, replacing what was there."""
+        dest_path = Path(dest_path)
+        tmp_path = dest_path.with_name(f".{dest_path.name}.link")
+        with self.lock:
+            blob_path = self.path_for(sha256)
+            if dest_path.exists() and os.path.samefile(dest_path, blob_path):
+                # Same file received again under the same name: already linked.
+                # Hard links share one mtime; refresh it so age-based cleanup sees this arrival
+                os.utime(dest_path)
+            else:
+                tmp_path.unlink(missing_ok=True)
+                try:
+                    os.link(blob_path, tmp_path)
+                except OSError:
+                    shutil.copyfile(blob_path, tmp_path)
+                os.utime(tmp_path)
+                os.replace(tmp_path, dest_path)
+                # rename() is a no-op when both names are links to one inode, leaving tmp behind
+                tmp_path.unlink(missing_ok=True)
+            previous = self.refs.get(dest_path.name)
+            self.refs[dest_path.name] = sha256
+            if previous and previous != sha256:
+                self._collect(previous)
+            self._save_refs()
+        return dest_path
+
+    def release(self, name):
+        """Forget the visible name ``name`` and drop its blob if nothing else uses it."""
+        with self.lock:
+            sha256 = self.refs.pop(name, None)
+            if sha256:
+                self._collect(sha256)
+                self._save_refs()
+            return sha256
+
+    def _collect(self, sha256):
+        if sha256 not in self.refs.values():
+            blob_path = self.path_for(sha256)
+            try:
+                os.chmod(blob_path, stat.S_IRUSR | stat.S_IWUSR)
+                blob_path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def prune(self, files_dir):
+        """Drop references whose visible file was deleted outside the store, and their orphaned blobs."""
+        files_dir = Path(files_dir)
+        removed = []
+        with self.lock:
+            for name in list(self.refs):
+                if not (files_dir / name).is_file():
+                    self.refs.pop(name)
+                    removed.append(name)
+            if removed:
+                live = set(self.refs.values())
+                for blob_path in self.root.glob('??/*'):
+                    if len(blob_path.name) == 64 and blob_path.name not in live:
+                        self._collect(blob_path.name)
+                self._save_refs()
+        return removed
@@ -0,0 +1,99 @@
+import lzma
+import math
+import zlib
+from collections import Counter
+
+# Codecs a transfer can use on the wire; None means bytes travel as-is
+CODECS = ('zlib', 'lzma')
+
+# Formats that are already compressed; recompressing them only burns CPU
+MAGIC_PREFIXES = (
+    (0, b'\xff\xd8\xff'),              # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),         # PNG
+    (0, b'GIF8'),                      # GIF
+    (0, b'PK\x03\x04'),                # zip, docx/xlsx/pptx, jar, apk
+    (0, b'\x1f\x8b'),                  # gzip
+    (0, b'BZh'),                       # bzip2
+    (0, b'\xfd7zXZ\x00'),              # xz
+    (0, b'7z\xbc\xaf\x27\x1c'),        # 7-Zip
+    (0, b'Rar!\x1a\x07'),              # RAR
+    (0, b'\x28\xb5\x2f\xfd'),          # zstd
+    (0, b'ID3'),                       # MP3 with ID3 tag
+    (0, b'OggS'),                      # Ogg
+    (0, b'fLaC'),                      # FLAC
+    (0, b'\x1a\x45\xdf\xa3'),          # Matroska / WebM
+    (4, b'ftyp'),                      # MP4 / MOV / HEIC
+)
+
+SAMPLE_SIZE = 64 * 1024
+MIN_COMPRESS_SIZE = 4096
+# Bits per byte above which a sample is treated as incompressible
+ENTROPY_THRESHOLD = 7.5
+# A trial compression of the sample must save at least this much
+MIN_SAVING = 0.1
+
+
+def is_compressed_format(sample):
+    """Recognise already-compressed file formats by their magic bytes."""
+    return any(sample[offset:offset + len(magic)] == magic for offset, magic in MAGIC_PREFIXES)
+
+
+def entropy(sample):
+    """Shannon entropy of a byte sample in bits per byte (0..8)."""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(n / total * math.log2(n / total) for n in Counter(sample).values())
+
+
+def choose_codec(sample, size, prefer='zlib'):
+    """Pick a codec for a payload of ``size`` bytes that starts with ``sample``.
+
+    Returns None for small payloads, known compressed formats, and samples
+    that look random or fail to shrink under a quick zlib trial; otherwise
+    ``prefer`` ('zlib' for speed, 'lzma' for ratio).
+    """
+    if prefer not in CODECS:
+        raise ValueError(f"Unknown codec: {prefer!r}")
+    sample = bytes(sample[:SAMPLE_SIZE])
+    if size < MIN_COMPRESS_SIZE or is_compressed_format(sample):
+        return None
+    if entropy(sample) > ENTROPY_THRESHOLD:
+        return None
+    if len(zlib.compress(sample, 1)) > len(sample) * (1 - MIN_SAVING):
+        return None
+    return prefer
+
+
+def sniff_file(filepath, prefer='zlib'):
+    """``choose_codec`` for a file on disk, sampling its first bytes."""
+    with open(filepath, 'rb') as f:
+        sample = f.read(SAMPLE_SIZE)
+        f.seek(0, 2)
+        size = f.tell()
+    return choose_codec(sample, size, prefer)
+
+
+def compress(codec, data):
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    if codec == 'lzma':
+        return lzma.compress(data, preset=1)
+    raise ValueError(f"Unknown codec: {codec!r}")
+
+
+def decompress(codec, data, max_length):
+    """Decompress ``data``, refusing output beyond ``max_length`` bytes."""
+    if codec == 'zlib':
+        decompressor = zlib.decompressobj()
+        out = decompressor.decompress(data, max_length)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError("Compressed data is truncated or too large")
+        return out
+    if codec == 'lzma':
+        decompressor = lzma.LZMADecompressor()
+        out = decompressor.decompress(data, max_length)
+        if not decompressor.eof:
+            raise ValueError("Compressed data is truncated or too large")
+        return out
+    raise ValueError(f"Unknown codec: {codec!r}")
@@ -0,0 +1,121 @@
+import socket
+import threading
+import time
+
+
+class ConnectionPool:
+    """Long-lived TCP connections to peers, reused across many frames.
+
+    Each peer address keeps a small stack of idle sockets. A socket is
+    checked before reuse (the peer may have closed it while it sat idle)
+    and dropped once idle for longer than ``idle_timeout``; a send that
+    fails on a reused socket is retried once on a fresh connection.
+    """
+
+    def __init__(self, idle_timeout=60.0, connect_timeout=10.0, max_idle_per_peer=4):
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.max_idle_per_peer = max_idle_per_peer
+        self.lock = threading.Lock()
+        self.idle = {}  # (ip, port) -> [(socket, last_used), ...]
+
+    def _connect(self, address):
+        sock = socket.create_connection(address, timeout=self.connect_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    @staticmethod
+    def _is_alive(sock):
+        """A healthy idle socket has nothing to read; EOF or stray data means it is unusable.
+
+        Peeks with a non-blocking recv rather than select(), which cannot
+        watch descriptors >= FD_SETSIZE (1024) in a busy process.
+        """
+        timeout = sock.gettimeout()
+        try:
+            sock.setblocking(False)
+            sock.recv(1, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return True
+        except OSError:
+            return False
+        finally:
+            try:
+                sock.settimeout(timeout)
+            except OSError:
+                pass
+        return False
+
+    def acquire(self, address):
+        """Return ``(socket, reused)`` for ``address``, preferring an idle connection."""
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                idle = self.idle.get(address)
+                if not idle:
+                    break
+                sock, last_used = idle.pop()
+            if now - last_used < self.idle_timeout and self._is_alive(sock):
+                return sock, True
+            sock.close()
+        return self._connect(address), False
+
+    def release(self, address, sock):
+        """Return a healthy socket to the pool."""
+        with self.lock:
+            idle = self.idle.setdefault(address, [])
+            if len(idle) < self.max_idle_per_peer:
+                idle.append((sock, time.monotonic()))
+                return
+        sock.close()
+
+    def send(self, address, data):
+        """Send ``data`` on a pooled connection to ``address``, reconnecting once if it went stale."""
+        sock, reused = self.acquire(address)
+        try:
+            sock.sendall(data)
+        except OSError:
+            sock.close()
+            if not reused:
+                raise
+            sock = self._connect(address)
+            try:
+                sock.sendall(data)
+            except OSError:
+                sock.close()
+                raise
+        self.release(address, sock)
+
+    def send_once(self, address, data):
+        """Send ``data`` on a new connection and close it, for peers that read one message per connection."""
+        with self._connect(address) as sock:
+            sock.sendall(data)
+
+    def close_idle(self):
+        """Close connections that have been idle longer than ``idle_timeout``."""
+        now = time.monotonic()
+        expired = []
+        with self.lock:
+            for address, idle in list(self.idle.items()):
+                keep = [(sock, last) for sock, last in idle if now - last < self.idle_timeout]
+                expired.extend(sock for sock, last in idle if now - last >= self.idle_timeout)
+                if keep:
+                    self.idle[address] = keep
+                else:
+                    del self.idle[address]
+        for sock in expired:
+            sock.close()
+
+    def discard(self, address):
+        """Close every idle connection to ``address``, e.g. when the peer leaves."""
+        with self.lock:
+            idle = self.idle.pop(address, [])
+        for sock, _ in idle:
+            sock.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for connections in idle.values():
+            for sock, _ in connections:
+                sock.close()
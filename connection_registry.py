@@ -0,0 +1,62 @@
+class ConnectionRegistry:
+    """Connected websocket clients, indexed by (IP, client id) and by IP.
+
+    A client id names one browser tab: the ``client_id`` the client asked
+    for when connecting, or ``ip:port`` otherwise. Ids are scoped to the
+    connecting IP, so one machine cannot take over another's tab id. One
+    IP may have several tabs open; ``latest(ip)`` is the one that
+    connected most recently. Every lookup is a dict access, so routing
+    does not scan all clients.
+    """
+
+    def __init__(self):
+        self.clients = {}  # (ip, client id) -> websocket
+        self.by_ip = {}    # ip -> {client id: websocket}, oldest first
+
+    def add(self, ip, client_id, websocket):
+        """Register a connection; returns the websocket it displaced, if any.
+
+        A reconnect with the same client id from the same IP replaces the
+        old entry; the caller should close the displaced connection.
+        """
+        displaced = self.clients.get((ip, client_id))
+        self.remove(ip, client_id)
+        self.clients[(ip, client_id)] = websocket
+        self.by_ip.setdefault(ip, {})[client_id] = websocket
+        return displaced
+
+    def remove(self, ip, client_id, websocket=None):
+        """Forget a client; with ``websocket``, only if it is still that connection."""
+        current = self.clients.get((ip, client_id))
+        if current is None or (websocket is not None and current is not websocket):
+            return False
+        del self.clients[(ip, client_id)]
+        tabs = self.by_ip[ip]
+        del tabs[client_id]
+        if not tabs:
+            del self.by_ip[ip]
+        return True
+
+    def get(self, ip, client_id):
+        return self.clients.get((ip, client_id))
+
+    def for_ip(self, ip):
+        """All connections from ``ip``, oldest first."""
+        return list(self.by_ip.get(ip, {}).values())
+
+    def latest(self, ip):
+        tabs = self.by_ip.get(ip)
+        return next(reversed(tabs.values())) if tabs else None
+
+    def has_ip(self, ip):
+        return ip in self.by_ip
+
+    def items(self):
+        """``[((ip, client id), websocket), ...]``"""
+        return list(self.clients.items())
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __contains__(self, key):
+        return key in self.clients
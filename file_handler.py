@@ -1,13 +1,26 @@
 import os
 import base64
+import binascii
+import hashlib
 import json
+import uuid
+import zlib
 from pathlib import Path
 from datetime import datetime
+from blob_store import BlobStore
+from file_transfer import expire_partials, safe_filename
 
 class FileHandler:
+    # Base64 characters decoded per step (a multiple of 4). Each step is one
+    # short C call, so a big upload decoded on a worker thread keeps
+    # releasing the GIL instead of freezing the event loop.
+    DECODE_CHUNK = 4 * 1024 * 1024
+
     def __init__(self, files_dir="data/files"):
         self.files_dir = files_dir
         self.ensure_files_dir()
+        # Identical files share one blob; visible names are links into it
+        self.blobs = BlobStore(Path(files_dir) / ".blobs")
         
     def ensure_files_dir(self):
         """Ensure the files directory exists"""
@@ -24,30 +37,9 @@ class FileHandler:
             if not content:
                 raise ValueError("File content not provided")
                 
-            # Decode base64 content
-            try:
-                file_bytes = base64.b64decode(content)
-            except Exception as e:
-                raise ValueError(f"Invalid file content: {str(e)}")
-                
-            # Generate unique filename to prevent overwrites
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            unique_filename = f"{timestamp}_{filename}"
-            file_path = Path(self.files_dir) / unique_filename
-            
-            # Save the file
-            with open(file_path, 'wb') as f:
-                f.write(file_bytes)
-                
-            # Return file info
-            return {
-                'success': True,
-                'filename': unique_filename,
-                'originalName': filename,
-                'path': str(file_path),
-                'size': len(file_bytes),
-                'timestamp': datetime.now().isoformat()
-            }
+            # Decode to disk, reusing the stored blob if these bytes were seen before
+            sha256, size = self.save_base64(content)
+            return self.link_upload(sha256, filename, size)
             
         except Exception as e:
             return {
@@ -55,6 +47,69 @@ class FileHandler:
                 'error': str(e)
             }
             
+    def link_upload(self, sha256, filename, size):
+        """Give a stored blob a unique visible name and describe the saved file"""
+        # Generate unique filename to prevent overwrites
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        unique_filename = f"{timestamp}_{safe_filename(filename)}"
+        file_path = Path(self.files_dir) / unique_filename
+        self.blobs.link(sha256, file_path)
+        return {
+            'success': True,
+            'filename': unique_filename,
+            'originalName': filename,
+            'path': str(file_path),
+            'size': size,
+            'sha256': sha256,
+            'timestamp': datetime.now().isoformat()
+        }
+
+    def begin_upload(self, filename, size):
+        """Start receiving a file in pieces; see FileUpload"""
+        return FileUpload(self, safe_filename(filename), size)
+
+    def stored_file_path(self, filename):
+        """Path of a received file, refusing names that point outside the files directory"""
+        file_path = Path(self.files_dir) / safe_filename(filename)
+        if not file_path.is_file():
+            raise FileNotFoundError(f"File {filename} not found")
+        return file_path
+
+
+    def save_base64(self, content):
+        """Decode base64 content into the blob store step by step; returns (sha256, size)"""
+        tmp_path = self.blobs.root / f"upload-{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(content), self.DECODE_CHUNK):
+                    try:
+                        chunk = binascii.a2b_base64(content[start:start + self.DECODE_CHUNK])
+                    except (binascii.Error, ValueError) as e:
+                        raise ValueError(f"Invalid file content: {str(e)}")
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            self.blobs.put_file(tmp_path, sha256)
+            return sha256, size
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def has_blob(self, sha256):
+        """Check whether a file with this sha256 is already stored"""
+        return self.blobs.has(sha256)
+
+    def link_blob(self, sha256, filename):
+        """Make a stored blob visible under filename without copying its bytes"""
+        return self.blobs.link(sha256, Path(self.files_dir) / filename)
+
+    def save_bytes(self, filename, file_bytes):
+        """Store file bytes under filename, deduplicated by content"""
+        return self.link_blob(self.blobs.put_bytes(file_bytes), filename)
+
     def read_file(self, filename):
         """Read a file from the files directory"""
         try:
@@ -114,6 +169,7 @@ class FileHandler:
                 raise ValueError(f"{filename} is not a file")
                 
             file_path.unlink()
+            self.blobs.release(filename)
             
             return {
                 'success': True,
@@ -127,7 +183,7 @@ class FileHandler:
             }
             
     def clean_old_files(self, max_age_days=7):
-        """Clean files older than max_age_days"""
+        """Clean files, and abandoned partial transfers, older than max_age_days"""
         try:
             threshold = datetime.now().timestamp() - (max_age_days * 24 * 60 * 60)
             deleted_files = []
@@ -136,11 +192,15 @@ class FileHandler:
                 if file_path.is_file():
                     if file_path.stat().st_mtime < threshold:
                         file_path.unlink()
+                        self.blobs.release(file_path.name)
                         deleted_files.append(file_path.name)
+            self.blobs.prune(self.files_dir)
+            expired_partials = expire_partials(self.files_dir, max_age_days)
                         
             return {
                 'success': True,
-                'deleted_files': deleted_files
+                'deleted_files': deleted_files,
+                'expired_partials': expired_partials
             }
             
         except Exception as e:
@@ -148,3 +208,51 @@ class FileHandler:
                 'success': False,
                 'error': str(e)
             }
+
+
+class FileUpload:
+    """A file arriving in pieces, written to disk and hashed as it comes.
+
+    Pieces must arrive in order; ``finish`` checks the announced size and
+    the sender's checksum (sha256 hex digest or CRC-32) before the file
+    is moved into the blob store under a unique name.
+    """
+
+    def __init__(self, handler, filename, size):
+        self.handler = handler
+        self.filename = filename
+        self.size = size
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+        self.crc32 = 0
+        self.tmp_path = handler.blobs.root / f"upload-{uuid.uuid4().hex}.tmp"
+        self.file = open(self.tmp_path, 'wb')
+
+    def write(self, offset, data):
+        if offset != self.received:
+            raise ValueError(f"Expected data at offset {self.received}, got {offset}")
+        if self.received + len(data) > self.size:
+            raise ValueError(f"More data than the announced {self.size} bytes")
+        self.file.write(data)
+        self.sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        self.received += len(data)
+
+    def finish(self, sha256=None, crc32=None):
+        """Verify and store the file; returns the same info as process_file_upload"""
+        self.file.close()
+        if self.received != self.size:
+            raise ValueError(f"Received {self.received} of {self.size} bytes")
+        digest = self.sha256.hexdigest()
+        if sha256 is None and crc32 is None:
+            raise ValueError("No checksum provided")
+        if sha256 is not None and str(sha256).lower() != digest:
+            raise ValueError("sha256 mismatch")
+        if crc32 is not None and int(crc32) != self.crc32:
+            raise ValueError("CRC-32 mismatch")
+        self.handler.blobs.put_file(self.tmp_path, digest)
+        return self.handler.link_upload(digest, self.filename, self.size)
+
+    def discard(self):
+        self.file.close()
+        self.tmp_path.unlink(missing_ok=True)
@@ -0,0 +1,536 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+from compression import CODECS, compress, decompress
+
+# Length prefix used by LANMessenger: 8 ASCII digits followed by a JSON body
+HEADER_LEN = 8
+CHUNK_SIZE = 256 * 1024
+
+
+def recv_exact(sock, length):
+    """Read exactly ``length`` bytes from a socket into one preallocated buffer."""
+    data = bytearray(length)
+    view = memoryview(data)
+    received = 0
+    while received < length:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise EOFError("Socket closed before receiving required data")
+        received += n
+    return data
+
+
+def send_json_frame(sock, obj):
+    """Send a dict as a length-prefixed JSON frame."""
+    body = json.dumps(obj).encode('utf-8')
+    sock.sendall(f"{len(body):08}".encode('utf-8') + body)
+
+
+def recv_json_frame(sock):
+    """Receive one length-prefixed JSON frame."""
+    length = int(recv_exact(sock, HEADER_LEN).decode('utf-8'))
+    return json.loads(recv_exact(sock, length).decode('utf-8'))
+
+
+def safe_filename(filename):
+    """Strip any directory components a peer may have put in a filename."""
+    name = os.path.basename(str(filename).replace('\\', '/'))
+    if name in ('', '.', '..'):
+        raise ValueError(f"Invalid filename: {filename!r}")
+    return name
+
+
+def send_file_stream(sock, filepath, header):
+    """Send a ``file_stream`` header frame followed by the raw file bytes.
+
+    ``header`` carries any extra metadata (e.g. username); ``filename`` and
+    ``size`` are filled in here. The body goes out with ``socket.sendfile``,
+    i.e. ``os.sendfile`` from the page cache where the platform has it.
+    """
+    size = os.path.getsize(filepath)
+    send_json_frame(sock, dict(header, type='file_stream',
+                               filename=os.path.basename(filepath), size=size))
+    with open(filepath, 'rb') as f:
+        sent = sock.sendfile(f, 0, size)
+    if sent != size:
+        raise EOFError(f"{filepath} shrank while being sent")
+    return sent
+
+
+def receive_file_stream(sock, header, files_dir, blobs=None):
+    """Receive the raw bytes announced by a ``file_stream`` header into ``files_dir``.
+
+    Data goes to a ``.part`` file that is renamed into place only once the
+    full size has arrived, so a dropped connection never leaves a truncated
+    file under the real name. With a ``BlobStore`` the bytes are hashed on
+    the way in and stored as a blob that the visible name links to.
+    """
+    filename = safe_filename(header['filename'])
+    size = int(header['size'])
+    files_dir = Path(files_dir)
+    files_dir.mkdir(parents=True, exist_ok=True)
+    file_path = files_dir / filename
+    part_path = files_dir / f".{filename}.part"
+
+    remaining = size
+    buffer = memoryview(bytearray(CHUNK_SIZE))
+    digest = hashlib.sha256() if blobs is not None else None
+    try:
+        with open(part_path, 'wb') as f:
+            while remaining:
+                n = sock.recv_into(buffer[:min(CHUNK_SIZE, remaining)])
+                if not n:
+                    raise EOFError(f"Connection closed with {remaining} of {size} bytes outstanding")
+                f.write(buffer[:n])
+                if digest is not None:
+                    digest.update(buffer[:n])
+                remaining -= n
+        if digest is not None:
+            blobs.put_file(part_path, digest.hexdigest())
+            blobs.link(digest.hexdigest(), file_path)
+        else:
+            os.replace(part_path, file_path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    return file_path
+
+
+# Resumable transfers: the sender announces a manifest of per-chunk hashes,
+# the receiver answers with the chunk indices it still needs, and each chunk
+# then travels as a (index, length) header followed by its bytes. A header
+# with index END_OF_CHUNKS closes a run of chunks; on the manifest connection
+# its length field carries the number of extra parallel streams used. When the
+# manifest names a codec, chunks that shrink under it are sent compressed and
+# flagged with COMPRESSED_FLAG in their length field.
+MANIFEST_CHUNK_SIZE = 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+CHUNK_HEADER = struct.Struct('>II')
+END_OF_CHUNKS = 0xFFFFFFFF
+COMPRESSED_FLAG = 0x80000000
+PARTIAL_DIR = '.partial'
+MAX_RESUME_ROUNDS = 3
+MAX_STREAMS = 16
+STREAM_WAIT_TIMEOUT = 30.0
+# Partial transfers untouched for this long are assumed abandoned and deleted
+PARTIAL_MAX_AGE_DAYS = 7
+
+# Incoming transfers by transfer_id, shared by the manifest connection and
+# any parallel chunk streams that join it
+_transfers_lock = threading.Lock()
+_transfers = {}
+# Held while partial state is opened or expired, so a transfer being resumed is never deleted
+_partials_lock = threading.RLock()
+
+
+def build_manifest(filepath, chunk_size=MANIFEST_CHUNK_SIZE):
+    """Hash ``filepath`` chunk by chunk.
+
+    Returns a dict with ``size``, ``chunk_size``, the per-chunk sha256 list,
+    the whole-file sha256 and a ``transfer_id`` that depends only on the
+    content, so the same file resumes into the same partial state.
+    """
+    chunks = []
+    whole = hashlib.sha256()
+    size = 0
+    with open(filepath, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            chunks.append(hashlib.sha256(block).hexdigest())
+            whole.update(block)
+            size += len(block)
+    digest = whole.hexdigest()
+    transfer_id = hashlib.sha256(f"{digest}:{size}:{chunk_size}".encode('utf-8')).hexdigest()[:32]
+    return {
+        'transfer_id': transfer_id,
+        'size': size,
+        'chunk_size': chunk_size,
+        'chunks': chunks,
+        'sha256': digest,
+    }
+
+
+def _chunk_count(size, chunk_size):
+    return (size + chunk_size - 1) // chunk_size
+
+
+def _validate_manifest(header):
+    size = int(header['size'])
+    chunk_size = int(header['chunk_size'])
+    transfer_id = str(header['transfer_id'])
+    if not (MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE) or size < 0:
+        raise ValueError("Invalid chunk size in manifest")
+    if len(header['chunks']) != _chunk_count(size, chunk_size):
+        raise ValueError("Manifest chunk list does not match file size")
+    if not transfer_id.isalnum():
+        raise ValueError(f"Invalid transfer id: {transfer_id!r}")
+    if header.get('codec') not in (None,) + CODECS:
+        raise ValueError(f"Unsupported codec: {header.get('codec')!r}")
+    return transfer_id, size, chunk_size
+
+
+class PartialTransfer:
+    """On-disk state of one incoming resumable transfer.
+
+    Lives under ``<files_dir>/.partial/<transfer_id>.*``: the preallocated
+    data file, the manifest, and an append-only log of verified chunk
+    indices. The log is only trusted after re-hashing, so a crash between
+    writing a chunk and logging it costs at most a re-send of that chunk.
+
+    Chunks may arrive on several connections at once; each is written with
+    ``pwrite`` at its own offset, and ``cond`` guards the bookkeeping.
+    """
+
+    def __init__(self, files_dir, manifest):
+        self.manifest = manifest
+        self.transfer_id, self.size, self.chunk_size = _validate_manifest(manifest)
+        self.filename = safe_filename(manifest['filename'])
+        self.files_dir = Path(files_dir)
+        partial_dir = self.files_dir / PARTIAL_DIR
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        self.data_path = partial_dir / f"{self.transfer_id}.part"
+        self.manifest_path = partial_dir / f"{self.transfer_id}.json"
+        self.log_path = partial_dir / f"{self.transfer_id}.done"
+        self.cond = threading.Condition()
+        self.have = set()
+        self.streams_done = 0
+        self.refs = 1
+        self.fd = None
+        self._open()
+
+    def _open(self):
+        if not self.manifest_path.exists():
+            self.log_path.unlink(missing_ok=True)
+            with open(self.manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(self.manifest, f)
+        self.fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self.fd).st_size != self.size:
+            os.ftruncate(self.fd, self.size)
+        if self.log_path.exists():
+            with open(self.log_path, 'r', encoding='utf-8') as f:
+                logged = {int(line) for line in f if line.strip().isdigit()}
+            self.have = {i for i in logged if i < len(self.manifest['chunks']) and self._verify(i)}
+        self.log = open(self.log_path, 'a', encoding='utf-8')
+
+    def _chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def _verify(self, index):
+        data = os.pread(self.fd, self._chunk_length(index), index * self.chunk_size)
+        return hashlib.sha256(data).hexdigest() == self.manifest['chunks'][index]
+
+    def missing(self):
+        with self.cond:
+            return [i for i in range(len(self.manifest['chunks'])) if i not in self.have]
+
+    def write_chunk(self, index, data):
+        """Store one chunk if its hash matches the manifest; return whether it did."""
+        if index >= len(self.manifest['chunks']) or len(data) != self._chunk_length(index):
+            return False
+        if hashlib.sha256(data).hexdigest() != self.manifest['chunks'][index]:
+            return False
+        os.pwrite(self.fd, data, index * self.chunk_size)
+        with self.cond:
+            self.have.add(index)
+            self.log.write(f"{index}\n")
+            self.log.flush()
+            self.cond.notify_all()
+        return True
+
+    def receive_chunks(self, sock):
+        """Read chunks from ``sock`` until END_OF_CHUNKS; return its length field."""
+        while True:
+            index, length = CHUNK_HEADER.unpack(recv_exact(sock, CHUNK_HEADER.size))
+            if index == END_OF_CHUNKS:
+                return length
+            compressed = length & COMPRESSED_FLAG
+            length &= ~COMPRESSED_FLAG
+            if length > self.chunk_size or index >= len(self.manifest['chunks']):
+                raise ValueError(f"Chunk {index} does not fit the manifest")
+            data = recv_exact(sock, length)
+            if compressed:
+                data = decompress(self.manifest['codec'], data, self._chunk_length(index))
+            self.write_chunk(index, data)
+
+    def stream_finished(self):
+        with self.cond:
+            self.streams_done += 1
+            self.cond.notify_all()
+
+    def wait_for_streams(self, target, timeout=STREAM_WAIT_TIMEOUT):
+        """Wait until ``target`` parallel streams in total have finished."""
+        with self.cond:
+            return self.cond.wait_for(lambda: self.streams_done >= target, timeout)
+
+    def finish(self, blobs=None):
+        """Check the whole-file hash and move the file to its visible name.
+
+        With a ``BlobStore`` the bytes become a blob and the visible name a
+        link to it.
+        """
+        os.fsync(self.fd)
+        whole = hashlib.sha256()
+        offset = 0
+        while offset < self.size:
+            block = os.pread(self.fd, MANIFEST_CHUNK_SIZE, offset)
+            whole.update(block)
+            offset += len(block)
+        if whole.hexdigest() != self.manifest['sha256']:
+            self.discard()
+            raise ValueError(f"Checksum mismatch for {self.filename}")
+        file_path = self.files_dir / self.filename
+        if blobs is not None:
+            blobs.put_file(self.data_path, self.manifest['sha256'])
+            blobs.link(self.manifest['sha256'], file_path)
+        else:
+            os.replace(self.data_path, file_path)
+        self.manifest_path.unlink(missing_ok=True)
+        self.log_path.unlink(missing_ok=True)
+        return file_path
+
+    def discard(self):
+        for path in (self.data_path, self.manifest_path, self.log_path):
+            path.unlink(missing_ok=True)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.log.close()
+
+
+def expire_partials(files_dir, max_age_days=PARTIAL_MAX_AGE_DAYS):
+    """Delete partial transfers not written to for ``max_age_days``; returns their ids.
+
+    A sender that never comes back would otherwise leave its preallocated
+    ``.part`` file on disk forever. Transfers in progress are kept.
+    """
+    partial_dir = Path(files_dir) / PARTIAL_DIR
+    if not partial_dir.is_dir():
+        return []
+    threshold = time.time() - max_age_days * 24 * 60 * 60
+    newest = {}  # transfer id -> latest mtime of its files
+    for path in partial_dir.iterdir():
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            continue
+        transfer_id = path.name.split('.')[0]
+        newest[transfer_id] = max(newest.get(transfer_id, 0), mtime)
+    expired = []
+    with _partials_lock, _transfers_lock:
+        for transfer_id, mtime in newest.items():
+            if mtime >= threshold or transfer_id in _transfers:
+                continue
+            for suffix in ('.part', '.json', '.done'):
+                (partial_dir / f"{transfer_id}{suffix}").unlink(missing_ok=True)
+            expired.append(transfer_id)
+    if expired:
+        print(f"🧹 Removed {len(expired)} abandoned partial transfer(s)")
+    return expired
+
+
+def _open_transfer(files_dir, header):
+    with _partials_lock:
+        expire_partials(files_dir)
+        partial = PartialTransfer(files_dir, header)
+    with _transfers_lock:
+        if partial.transfer_id not in _transfers:
+            _transfers[partial.transfer_id] = partial
+            return partial
+    partial.close()
+    raise ConnectionError(f"Transfer {partial.transfer_id} already in progress")
+
+
+def _join_transfer(transfer_id):
+    with _transfers_lock:
+        partial = _transfers.get(transfer_id)
+        if partial is None:
+            raise ConnectionError(f"Unknown transfer {transfer_id}")
+        partial.refs += 1
+        return partial
+
+
+def _release_transfer(partial):
+    """Drop one reference; the last connection out closes the file."""
+    with _transfers_lock:
+        partial.refs -= 1
+        if partial.refs:
+            return
+        del _transfers[partial.transfer_id]
+    partial.close()
+
+
+def _send_chunks(sock, f, manifest, indices):
+    """Send chunks by index; returns the number of file bytes they cover."""
+    sent = 0
+    chunk_size = manifest['chunk_size']
+    codec = manifest.get('codec')
+    for index in indices:
+        offset = index * chunk_size
+        length = min(chunk_size, manifest['size'] - offset)
+        if codec:
+            data = os.pread(f.fileno(), length, offset)
+            if len(data) != length:
+                raise EOFError(f"{f.name} shrank while being sent")
+            packed = compress(codec, data)
+            if len(packed) < length:
+                sock.sendall(CHUNK_HEADER.pack(index, len(packed) | COMPRESSED_FLAG))
+                sock.sendall(packed)
+            else:
+                sock.sendall(CHUNK_HEADER.pack(index, length))
+                sock.sendall(data)
+        else:
+            sock.sendall(CHUNK_HEADER.pack(index, length))
+            if sock.sendfile(f, offset, length) != length:
+                raise EOFError(f"{f.name} shrank while being sent")
+        sent += length
+    return sent
+
+
+def _send_chunk_stream(connect, filepath, header, manifest, indices, results, slot):
+    try:
+        with connect() as sock:
+            send_json_frame(sock, dict(header, type='file_chunks', transfer_id=manifest['transfer_id']))
+            with open(filepath, 'rb') as f:
+                sent = _send_chunks(sock, f, manifest, indices)
+            sock.sendall(CHUNK_HEADER.pack(END_OF_CHUNKS, 0))
+        results[slot] = sent
+    except Exception as e:
+        results[slot] = e
+
+
+def send_file_resumable(sock, filepath, header, manifest=None, streams=1, connect=None, codec=None):
+    """Send ``filepath`` as a manifest followed by whichever chunks the peer lacks.
+
+    With ``streams > 1`` and a ``connect`` callable returning new connected
+    sockets, the missing chunks are split into contiguous ranges that travel
+    over that many connections at once. ``codec`` ('zlib' or 'lzma')
+    compresses each chunk that shrinks under it; uncompressed transfers go
+    out with sendfile. Returns the number of file bytes sent, which is less
+    than the file size when the receiver already held part of it from an
+    earlier attempt.
+    """
+    manifest = dict(manifest or build_manifest(filepath), codec=codec)
+    send_json_frame(sock, dict(header, type='file_manifest',
+                               filename=os.path.basename(filepath), **manifest))
+    sent = 0
+    with open(filepath, 'rb') as f:
+        while True:
+            reply = recv_json_frame(sock)
+            if reply.get('type') == 'file_complete':
+                return sent
+            if reply.get('type') != 'file_resume':
+                raise ConnectionError(reply.get('error', f"Unexpected reply: {reply.get('type')}"))
+            missing = reply['missing']
+            n = max(1, min(streams, MAX_STREAMS, len(missing))) if connect else 1
+            shares = [missing[i * len(missing) // n:(i + 1) * len(missing) // n] for i in range(n)]
+            results = [None] * n
+            workers = [threading.Thread(target=_send_chunk_stream,
+                                        args=(connect, filepath, header, manifest, shares[i], results, i),
+                                        daemon=True)
+                       for i in range(1, n)]
+            for worker in workers:
+                worker.start()
+            sent += _send_chunks(sock, f, manifest, shares[0])
+            for worker in workers:
+                worker.join()
+            for result in results[1:]:
+                if isinstance(result, Exception):
+                    raise result
+                sent += result
+            sock.sendall(CHUNK_HEADER.pack(END_OF_CHUNKS, n - 1))
+
+
+def receive_file_resumable(sock, header, files_dir, blobs=None):
+    """Answer a ``file_manifest`` header, receive the missing chunks, and finish the file.
+
+    Verified chunks survive a dropped connection, so the next attempt with
+    the same content only transfers what is still missing. If ``blobs``
+    already holds the file's sha256, the name is linked to it and the
+    sender is told the transfer is complete before any chunk is sent.
+    """
+    if blobs is not None and blobs.has(header.get('sha256')):
+        _validate_manifest(header)
+        file_path = blobs.link(header['sha256'], Path(files_dir) / safe_filename(header['filename']))
+        send_json_frame(sock, {'type': 'file_complete', 'filename': file_path.name, 'deduplicated': True})
+        return file_path
+    try:
+        partial = _open_transfer(files_dir, header)
+    except ConnectionError as e:
+        send_json_frame(sock, {'type': 'file_error', 'error': str(e)})
+        raise
+    try:
+        for _ in range(MAX_RESUME_ROUNDS):
+            missing = partial.missing()
+            if not missing:
+                break
+            finished = partial.streams_done
+            send_json_frame(sock, {'type': 'file_resume', 'missing': missing})
+            extra_streams = partial.receive_chunks(sock)
+            if not partial.wait_for_streams(finished + min(extra_streams, MAX_STREAMS)):
+                print(f"⚠️ Timed out waiting for parallel streams of {partial.filename}")
+        if partial.missing():
+            raise ValueError(f"Chunks for {partial.filename} kept failing verification")
+        file_path = partial.finish(blobs)
+    finally:
+        _release_transfer(partial)
+    # Acknowledge only once the transfer is unregistered, so an immediate resend is not refused
+    send_json_frame(sock, {'type': 'file_complete', 'filename': file_path.name})
+    return file_path
+
+
+def receive_file_chunks(sock, header):
+    """Receive one parallel ``file_chunks`` stream for a transfer already announced by its manifest."""
+    partial = _join_transfer(str(header['transfer_id']))
+    try:
+        partial.receive_chunks(sock)
+    finally:
+        partial.stream_finished()
+        _release_transfer(partial)
+
+
+class StreamTuner:
+    """Per-peer hill climbing over the number of parallel streams.
+
+    Keeps a smoothed throughput for every stream count tried with a peer,
+    probes the untried neighbours (half and double) of the best one, and
+    otherwise sticks with the best.
+    """
+
+    MIN_SAMPLE_BYTES = 8 * 1024 * 1024
+
+    def __init__(self, initial=2, max_streams=8):
+        self.initial = initial
+        self.max_streams = max_streams
+        self.lock = threading.Lock()
+        self.peers = {}
+
+    def streams_for(self, peer):
+        with self.lock:
+            return self.peers.get(peer, {}).get('next', self.initial)
+
+    def record(self, peer, streams, nbytes, seconds):
+        """Feed back one transfer; small ones are ignored as setup cost dominates them."""
+        if nbytes < self.MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        with self.lock:
+            state = self.peers.setdefault(peer, {'tput': {}, 'next': self.initial})
+            previous = state['tput'].get(streams)
+            rate = nbytes / seconds
+            state['tput'][streams] = rate if previous is None else 0.5 * previous + 0.5 * rate
+            best = max(state['tput'], key=state['tput'].get)
+            for candidate in (min(best * 2, self.max_streams), max(best // 2, 1)):
+                if candidate not in state['tput']:
+                    state['next'] = candidate
+                    return
+            state['next'] = best
@@ -0,0 +1,279 @@
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from framing import read_message, split_frame
+
+# Frames followed by raw transfer data; the connection ends with the transfer
+STREAM_FRAME_TYPES = ('file_manifest', 'file_chunks', 'file_stream')
+
+
+class BufferedSocket:
+    """A blocking socket that first replays bytes already read off the wire.
+
+    Used when a connection moves from the event loop to a worker thread in
+    the middle of a stream: whatever the loop had buffered past the header
+    frame is served before reading from the socket itself.
+    """
+
+    def __init__(self, sock, prefix):
+        self.sock = sock
+        self.prefix = memoryview(bytes(prefix))
+
+    def recv_into(self, buffer, nbytes=0, flags=0):
+        if self.prefix:
+            n = min(len(buffer) if not nbytes else nbytes, len(self.prefix))
+            buffer[:n] = self.prefix[:n]
+            self.prefix = self.prefix[n:]
+            return n
+        return self.sock.recv_into(buffer, nbytes, flags)
+
+    def recv(self, bufsize, flags=0):
+        if self.prefix:
+            data = bytes(self.prefix[:bufsize])
+            self.prefix = self.prefix[len(data):]
+            return data
+        return self.sock.recv(bufsize, flags)
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.sock.close()
+
+
+class FrameServer:
+    """Common setup for the LANMessenger TCP servers.
+
+    ``on_frame(addr, message)`` handles ordinary frames (chat, legacy
+    base64 files); ``on_stream(sock, addr, message)`` takes over the
+    connection after a frame in STREAM_FRAME_TYPES. ``accept(addr)``
+    decides which peers may connect at all.
+    """
+
+    def __init__(self, port, on_frame, on_stream, accept=None, host='', backlog=128, idle_timeout=120.0):
+        self.on_frame = on_frame
+        self.on_stream = on_stream
+        self.accept = accept or (lambda addr: True)
+        self.backlog = backlog
+        self.idle_timeout = idle_timeout
+        self.running = False
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen(backlog)
+        self.address = self.server_socket.getsockname()
+
+    def _handle_stream(self, sock, addr, message):
+        try:
+            sock.settimeout(None)
+            self.on_stream(sock, addr, message)
+        except Exception as e:
+            print(f"❌ Error handling transfer from {addr}: {e}")
+        finally:
+            sock.close()
+
+    def _handle_frame(self, addr, message):
+        try:
+            self.on_frame(addr, message)
+        except Exception as e:
+            print(f"❌ Error handling message from {addr}: {e}")
+
+    def stop(self):
+        self.running = False
+        try:
+            self.server_socket.close()
+        except OSError:
+            pass
+
+
+class ThreadedFrameServer(FrameServer):
+    """One OS thread per connection; simple, but threads pile up under load."""
+
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            try:
+                client_socket, addr = self.server_socket.accept()
+            except OSError:
+                if self.running:
+                    print("❌ Server socket closed.")
+                break
+            if self.accept(addr):
+                threading.Thread(target=self._handle_client, args=(client_socket, addr), daemon=True).start()
+            else:
+                client_socket.close()
+
+    def _handle_client(self, client_socket, addr):
+        """Handle length-prefixed frames from one connection until the peer closes it or goes idle."""
+        try:
+            while self.running:
+                client_socket.settimeout(self.idle_timeout)
+                try:
+                    message = read_message(client_socket)
+                except (EOFError, socket.timeout):
+                    break
+                if message.get('type') in STREAM_FRAME_TYPES:
+                    self._handle_stream(client_socket, addr, message)
+                    return
+                self._handle_frame(addr, message)
+        except Exception as e:
+            print(f"❌ Error handling client {addr}: {e}")
+        finally:
+            client_socket.close()
+
+
+class _Connection:
+    __slots__ = ('sock', 'addr', 'buffer', 'last_active', 'pending', 'busy')
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.buffer = bytearray()
+        self.last_active = time.monotonic()
+        self.pending = deque()
+        self.busy = False
+
+
+class SelectorFrameServer(FrameServer):
+    """All connections multiplexed on one thread with ``selectors``.
+
+    The loop only accepts, reads and splits frames. Frames are handled on
+    a small worker pool, in order per connection, so a slow disk write
+    never stalls other peers. A connection that starts a file transfer is
+    handed to a worker thread as a blocking socket, since the transfer
+    protocol is request/response and benefits from sendfile/recv_into.
+    Parallel ``file_chunks`` streams get their own pool: a manifest worker
+    waits for its transfer's chunk streams, so sharing one pool would let
+    a few waiting manifests starve the streams they are waiting for.
+    """
+
+    RECV_SIZE = 64 * 1024
+    ACCEPTS_PER_WAKEUP = 256
+
+    def __init__(self, port, on_frame, on_stream, accept=None, host='', backlog=1024, idle_timeout=120.0,
+                 frame_workers=4, stream_workers=32, chunk_workers=64):
+        super().__init__(port, on_frame, on_stream, accept, host, backlog, idle_timeout)
+        self.selector = selectors.DefaultSelector()
+        self.frame_pool = ThreadPoolExecutor(max_workers=frame_workers, thread_name_prefix='frames')
+        self.stream_pool = ThreadPoolExecutor(max_workers=stream_workers, thread_name_prefix='transfers')
+        self.chunk_pool = ThreadPoolExecutor(max_workers=chunk_workers, thread_name_prefix='chunks')
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def serve_forever(self):
+        self.running = True
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        next_sweep = time.monotonic() + 1.0
+        try:
+            while self.running:
+                for key, _ in self.selector.select(timeout=1.0):
+                    if key.fileobj is self.server_socket:
+                        self._accept_ready()
+                    else:
+                        self._read_ready(key.data)
+                if time.monotonic() >= next_sweep:
+                    self._close_idle()
+                    next_sweep = time.monotonic() + 1.0
+        except (OSError, ValueError):
+            if self.running:
+                print("❌ Server socket closed.")
+        finally:
+            for conn in list(self.connections.values()):
+                self._close(conn)
+            self.selector.close()
+            self.frame_pool.shutdown(wait=False)
+            self.stream_pool.shutdown(wait=False)
+            self.chunk_pool.shutdown(wait=False)
+
+    def _accept_ready(self):
+        for _ in range(self.ACCEPTS_PER_WAKEUP):
+            try:
+                sock, addr = self.server_socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            if not self.accept(addr):
+                sock.close()
+                continue
+            sock.setblocking(False)
+            conn = _Connection(sock, addr)
+            self.connections[sock.fileno()] = conn
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _read_ready(self, conn):
+        try:
+            data = conn.sock.recv(self.RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        conn.last_active = time.monotonic()
+        conn.buffer += data
+        try:
+            self._split_frames(conn)
+        except Exception as e:
+            print(f"❌ Error handling client {conn.addr}: {e}")
+            self._close(conn)
+
+    def _split_frames(self, conn):
+        buffer = conn.buffer
+        offset = 0
+        while True:
+            parsed = split_frame(buffer, offset)
+            if parsed is None:
+                break
+            message, offset = parsed
+            if message.get('type') in STREAM_FRAME_TYPES:
+                self._hand_off(conn, message, buffer[offset:])
+                return
+            self._enqueue(conn, message)
+        del buffer[:offset]
+
+    def _enqueue(self, conn, message):
+        with self.lock:
+            conn.pending.append(message)
+            if conn.busy:
+                return
+            conn.busy = True
+        self.frame_pool.submit(self._drain, conn)
+
+    def _drain(self, conn):
+        while True:
+            with self.lock:
+                if not conn.pending:
+                    conn.busy = False
+                    return
+                message = conn.pending.popleft()
+            self._handle_frame(conn.addr, message)
+
+    def _hand_off(self, conn, message, rest):
+        self._unregister(conn)
+        conn.sock.setblocking(True)
+        pool = self.chunk_pool if message.get('type') == 'file_chunks' else self.stream_pool
+        pool.submit(self._handle_stream, BufferedSocket(conn.sock, rest), conn.addr, message)
+
+    def _unregister(self, conn):
+        self.connections.pop(conn.sock.fileno(), None)
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _close(self, conn):
+        self._unregister(conn)
+        conn.sock.close()
+
+    def _close_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for conn in [c for c in self.connections.values() if c.last_active < cutoff]:
+            self._close(conn)
@@ -0,0 +1,185 @@
+import json
+import struct
+import zlib
+
+from compression import choose_codec, decompress
+from file_transfer import HEADER_LEN, recv_exact
+
+# Binary frame: magic, version, type, flags, body length. The body is a
+# varint-prefixed metadata block followed by the raw payload. Legacy frames
+# start with 8 ASCII digits, so the first two bytes tell the formats apart.
+MAGIC = b'LM'
+VERSION = 2
+FRAME_HEADER = struct.Struct('>2sBBBI')
+MAX_BODY = 64 * 1024 * 1024
+
+# Frame types
+TEXT = 1   # payload: UTF-8 chat text
+FILE = 2   # payload: raw file bytes
+JSON = 3   # payload: a JSON object, for anything without its own type
+
+# Flags
+FLAG_ZLIB = 0x01  # payload is zlib-compressed
+
+COMPRESS_MIN_PAYLOAD = 1024
+
+# Metadata keys that get a one-byte id; any other key is spelled out
+META_KEYS = ('username', 'filename', 'id', 'timestamp', 'sender_ip', 'target', 'mime')
+_META_IDS = {key: i + 1 for i, key in enumerate(META_KEYS)}
+_INLINE_KEY = 0
+
+
+def _put_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_meta(meta):
+    """Encode a dict of string values as (key id, varint length, UTF-8 value) entries."""
+    out = bytearray()
+    for key, value in meta.items():
+        encoded = value.encode('utf-8')
+        key_id = _META_IDS.get(key)
+        if key_id is None:
+            name = key.encode('utf-8')
+            out.append(_INLINE_KEY)
+            _put_varint(out, len(name))
+            out += name
+        else:
+            out.append(key_id)
+        _put_varint(out, len(encoded))
+        out += encoded
+    return bytes(out)
+
+
+def decode_meta(data):
+    meta = {}
+    offset = 0
+    while offset < len(data):
+        key_id = data[offset]
+        offset += 1
+        if key_id == _INLINE_KEY:
+            length, offset = _get_varint(data, offset)
+            key = data[offset:offset + length].decode('utf-8')
+            offset += length
+        else:
+            key = META_KEYS[key_id - 1]
+        length, offset = _get_varint(data, offset)
+        meta[key] = data[offset:offset + length].decode('utf-8')
+        offset += length
+    return meta
+
+
+def encode_frame(frame_type, meta=None, payload=b'', compress=False):
+    """Build one binary frame; ``compress`` zlib-compresses a payload worth compressing."""
+    flags = 0
+    if compress and len(payload) >= COMPRESS_MIN_PAYLOAD and choose_codec(payload, len(payload)):
+        packed = zlib.compress(payload, 6)
+        if len(packed) < len(payload):
+            payload, flags = packed, FLAG_ZLIB
+    meta_bytes = encode_meta(meta or {})
+    prefix = bytearray()
+    _put_varint(prefix, len(meta_bytes))
+    length = len(prefix) + len(meta_bytes) + len(payload)
+    if length > MAX_BODY:
+        raise ValueError(f"Frame body of {length} bytes exceeds {MAX_BODY}")
+    return b''.join((FRAME_HEADER.pack(MAGIC, VERSION, frame_type, flags, length), prefix, meta_bytes, payload))
+
+
+def decode_frame(frame_type, flags, body):
+    """Turn a binary frame body back into the message dict the handlers expect."""
+    meta_len, offset = _get_varint(body, 0)
+    meta = decode_meta(body[offset:offset + meta_len])
+    payload = body[offset + meta_len:]
+    if flags & FLAG_ZLIB:
+        payload = decompress('zlib', payload, MAX_BODY)
+    if frame_type == JSON:
+        return json.loads(payload.decode('utf-8'))
+    if frame_type == TEXT:
+        return dict(meta, type='text', content=payload.decode('utf-8'))
+    if frame_type == FILE:
+        return dict(meta, type='file', data=bytes(payload))
+    raise ValueError(f"Unknown frame type {frame_type}")
+
+
+def encode_message(message, compress=True):
+    """Encode a message dict in the binary format.
+
+    Text and raw-bytes file messages whose other fields are strings carry
+    their content as the payload; anything else travels as a JSON frame.
+    """
+    msg_type = message.get('type', 'text')
+    meta = {k: v for k, v in message.items() if k not in ('type', 'content', 'data')}
+    if all(isinstance(v, str) for v in meta.values()):
+        if msg_type == 'text' and isinstance(message.get('content', ''), str) and 'data' not in message:
+            return encode_frame(TEXT, meta, message.get('content', '').encode('utf-8'), compress)
+        if msg_type == 'file' and isinstance(message.get('data'), bytes) and 'content' not in message:
+            return encode_frame(FILE, meta, message['data'], compress)
+    return encode_frame(JSON, payload=json.dumps(message).encode('utf-8'), compress=compress)
+
+
+def encode_legacy(message):
+    """Encode a message dict with the 8-digit ASCII length header older peers expect."""
+    body = json.dumps(message).encode('utf-8')
+    if len(body) >= 10 ** HEADER_LEN:
+        raise ValueError(f"Message of {len(body)} bytes is too large for a legacy frame")
+    return f"{len(body):0{HEADER_LEN}}".encode('utf-8') + body
+
+
+def split_frame(buffer, offset=0):
+    """Parse one frame of either format from ``buffer`` at ``offset``.
+
+    Returns ``(message, end_offset)``, or None if the frame is incomplete.
+    """
+    available = len(buffer) - offset
+    if available < 2:
+        return None
+    if buffer[offset:offset + 2] == MAGIC:
+        if available < FRAME_HEADER.size:
+            return None
+        _, version, frame_type, flags, length = FRAME_HEADER.unpack_from(buffer, offset)
+        _check_header(version, length)
+        start = offset + FRAME_HEADER.size
+        if len(buffer) < start + length:
+            return None
+        return decode_frame(frame_type, flags, bytes(buffer[start:start + length])), start + length
+    if available < HEADER_LEN:
+        return None
+    length = int(bytes(buffer[offset:offset + HEADER_LEN]).decode('utf-8'))
+    start = offset + HEADER_LEN
+    if len(buffer) < start + length:
+        return None
+    return json.loads(bytes(buffer[start:start + length]).decode('utf-8')), start + length
+
+
+def read_message(sock):
+    """Read one frame of either format from a blocking socket."""
+    head = recv_exact(sock, 2)
+    if head == MAGIC:
+        head += recv_exact(sock, FRAME_HEADER.size - 2)
+        _, version, frame_type, flags, length = FRAME_HEADER.unpack(head)
+        _check_header(version, length)
+        return decode_frame(frame_type, flags, recv_exact(sock, length))
+    head += recv_exact(sock, HEADER_LEN - 2)
+    length = int(head.decode('utf-8'))
+    return json.loads(recv_exact(sock, length).decode('utf-8'))
+
+
+def _check_header(version, length):
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    if length > MAX_BODY:
+        raise ValueError(f"Frame body of {length} bytes exceeds {MAX_BODY}")
@@ -4,22 +4,57 @@ import json
 import time
 import os
 import base64
+import struct
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from message_handler import MessageHandler
 from file_handler import FileHandler
+from compression import sniff_file
+from file_transfer import (receive_file_stream, build_manifest, send_file_resumable,
+                           receive_file_resumable, receive_file_chunks, safe_filename, StreamTuner)
+from connection_pool import ConnectionPool
+from outbox import Outbox
+from frame_server import SelectorFrameServer, ThreadedFrameServer
+from framing import VERSION as FRAME_VERSION, encode_message, encode_legacy, split_frame
 from voicevideo_handler import VoiceVideoHandler  # Import our new handler
 
+# Small broadcasts can go out as one UDP datagram to this group
+MULTICAST_GROUP = '239.255.42.99'
+MULTICAST_PORT = 50001
+MULTICAST_MAX_DATAGRAM = 1200  # Fits one Ethernet frame, so it is never fragmented
+
+
 class LANMessenger:
-    def __init__(self, username, server_port=12345, broadcast_port=50000):
+    def __init__(self, username, server_port=12345, broadcast_port=50000,
+                 server_mode='selectors', server_backlog=1024):
         self.username = username
         self.server_port = server_port
+        self.server_mode = server_mode  # 'selectors' (one event loop thread) or 'threads' (one per connection)
+        self.server_backlog = server_backlog
+        self.server = None
         self.broadcast_port = broadcast_port
         self.local_ip = self._get_local_ip()
         self.peers = {}  # Stores discovered peers {ip: {'username': name, ...}}
         self.running = False
+        self.file_streams = None  # Parallel connections per file; None auto-tunes per peer
+        self.stream_tuner = StreamTuner()
+        self.file_compression = 'zlib'  # 'zlib', 'lzma' or None; compressed formats are always sent raw
+        # Chat frames reuse long-lived connections; the server side waits longer than the
+        # client side so that an idle connection is normally closed by its sender
+        self.connection_pool = ConnectionPool(idle_timeout=60)
+        self.client_idle_timeout = 120
+        self.small_file_limit = 256 * 1024  # Files up to this size go as a single binary frame
+        self.broadcast_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='broadcast')
+        self.multicast_enabled = False  # Set once we have joined the multicast group
+        self._seen_multicast = OrderedDict()  # Recent multicast ids, to drop duplicate datagrams
+        # Sends are queued per peer and retried in the background, so a dead peer never blocks the CLI
+        self.outbox = Outbox("data/outbox.jsonl", self._deliver, is_available=lambda ip: ip in self.peers,
+                             on_delivered=self._on_delivered, on_failed=self._on_failed)
 
         # Handlers for messages, files, and voice/video
-        self.message_handler = MessageHandler()
+        self.message_handler = MessageHandler(durability="fsync")
         self.file_handler = FileHandler()
         self.voice_video_handler = VoiceVideoHandler(username, base_port=13000)
 
@@ -44,77 +79,78 @@ class LANMessenger:
 
     # SERVER FUNCTIONALITY
     def _start_server(self):
-        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_socket.bind(('', self.server_port))
-        server_socket.listen(5)
+        server_class = SelectorFrameServer if self.server_mode == 'selectors' else ThreadedFrameServer
+        self.server = server_class(self.server_port, self._handle_message, self._handle_stream,
+                                   accept=lambda addr: addr[0] in self.peers,
+                                   backlog=self.server_backlog, idle_timeout=self.client_idle_timeout)
         print(f"✅ Server is listening on {self.local_ip}:{self.server_port}")
-        while self.running:
+        self.server.serve_forever()
+
+    def _handle_stream(self, client_socket, addr, message):
+        """Handle a frame that is followed by raw file transfer data on the same connection."""
+        msg_type = message.get('type')
+        if msg_type == 'file_manifest':
+            # Resumable transfer: reply with the missing chunks, then receive them
+            try:
+                file_path = receive_file_resumable(client_socket, message, self.file_handler.files_dir,
+                                                   self.file_handler.blobs)
+                sender_username = message.get('username', 'Unknown')
+                timestamp = datetime.now().strftime("%H:%M:%S")
+                print(f"\n📎 [{timestamp}] File received from {sender_username} ({addr[0]}):")
+                print(f"   > {message['filename']} saved to {file_path}")
+            except Exception as e:
+                print(f"❌ Error receiving file {message.get('filename')}: {e}")
+        elif msg_type == 'file_chunks':
+            # Extra parallel connection carrying a range of chunks for an announced manifest
+            try:
+                receive_file_chunks(client_socket, message)
+            except Exception as e:
+                print(f"❌ Error receiving file chunks: {e}")
+        elif msg_type == 'file_stream':
+            # Raw file bytes follow the header frame on the same connection
+            try:
+                file_path = receive_file_stream(client_socket, message, self.file_handler.files_dir,
+                                                self.file_handler.blobs)
+                sender_username = message.get('username', 'Unknown')
+                timestamp = datetime.now().strftime("%H:%M:%S")
+                print(f"\n📎 [{timestamp}] File received from {sender_username} ({addr[0]}):")
+                print(f"   > {message['filename']} saved to {file_path}")
+            except Exception as e:
+                print(f"❌ Error receiving file stream: {e}")
+
+    def _handle_message(self, addr, message):
+        """Handle one self-contained frame: a chat message or a legacy base64 file."""
+        msg_type = message.get('type', 'text')
+        if msg_type == 'file':
+            # Small files arrive in one frame; legacy peers base64-encode them inside the JSON
             try:
-                client_socket, addr = server_socket.accept()
-                if addr[0] in self.peers:
-                    threading.Thread(target=self._handle_client, args=(client_socket, addr), daemon=True).start()
+                filename = safe_filename(message['filename'])
+                if 'data' in message:
+                    file_data = message['data']  # Binary frames carry the raw bytes
                 else:
-                    client_socket.close()
-            except Exception:
-                if self.running:
-                    print("❌ Server socket closed.")
-                break
-        server_socket.close()
-
-    def _recv_all(self, sock, length):
-        data = b''
-        while len(data) < length:
-            more = sock.recv(length - len(data))
-            if not more:
-                raise EOFError("Socket closed before receiving required data")
-            data += more
-        return data
-
-    def _handle_client(self, client_socket, addr):
-        try:
-            # Read first 8 bytes for length header
-            length_bytes = self._recv_all(client_socket, 8)
-            msg_length = int(length_bytes.decode('utf-8'))
-            # Read the full JSON message now
-            data_bytes = self._recv_all(client_socket, msg_length)
-            message = json.loads(data_bytes.decode('utf-8'))
-            msg_type = message.get('type', 'text')
-            
-            if msg_type == 'file':
-                # Handle file reception directly here instead of using file_handler
-                try:
-                    filename = message['filename']
                     file_data = base64.b64decode(message['content'])  # Use 'content' key
-                    
-                    # Ensure files directory exists
-                    files_dir = "data/files"
-                    if not os.path.exists(files_dir):
-                        os.makedirs(files_dir)
-                    
-                    # Save file
-                    file_path = os.path.join(files_dir, filename)
-                    with open(file_path, 'wb') as f:
-                        f.write(file_data)
-                    
-                    sender_username = message.get('username', 'Unknown')
-                    timestamp = datetime.now().strftime("%H:%M:%S")
-                    print(f"\n📎 [{timestamp}] File received from {sender_username} ({addr[0]}):")
-                    print(f"   > {filename} saved to {file_path}")
-                    
-                except Exception as e:
-                    print(f"❌ Error processing file: {e}")
-            else:
-                timestamp = datetime.now().strftime("%H:%M:%S")
+                
+                # Save file, sharing the stored blob if we already have these bytes
+                file_path = self.file_handler.save_bytes(filename, file_data)
+                
                 sender_username = message.get('username', 'Unknown')
-                content = message.get('content', '')
-                print(f"\n💬 [{timestamp}] New message from {sender_username} ({addr[0]}):")
-                print(f"   > {content}")
-                self.message_handler.save_message(addr[0], sender_username, content)
-        except Exception as e:
-            print(f"❌ Error handling client {addr}: {e}")
-        finally:
-            client_socket.close()
+                timestamp = datetime.now().strftime("%H:%M:%S")
+                print(f"\n📎 [{timestamp}] File received from {sender_username} ({addr[0]}):")
+                print(f"   > {filename} saved to {file_path}")
+                
+            except Exception as e:
+                print(f"❌ Error processing file: {e}")
+        else:
+            timestamp = datetime.now().strftime("%H:%M:%S")
+            sender_username = message.get('username', 'Unknown')
+            content = message.get('content', '')
+            print(f"\n💬 [{timestamp}] New message from {sender_username} ({addr[0]}):")
+            print(f"   > {content}")
+            self.message_handler.save_message({
+                'sender_ip': addr[0],
+                'username': sender_username,
+                'content': content
+            })
 
     # PEER DISCOVERY
     def _start_discovery(self):
@@ -125,13 +161,15 @@ class LANMessenger:
     def _broadcast_presence(self):
         broadcast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        message = json.dumps({
-            'type': 'discovery',
-            'username': self.username,
-            'port': self.server_port
-        }).encode('utf-8')
         while self.running:
             try:
+                message = json.dumps({
+                    'type': 'discovery',
+                    'username': self.username,
+                    'port': self.server_port,
+                    'proto': FRAME_VERSION,  # Highest frame format we accept; older peers omit it
+                    'multicast': self.multicast_enabled
+                }).encode('utf-8')
                 broadcast_socket.sendto(message, ('<broadcast>', self.broadcast_port))
                 time.sleep(5)
             except Exception as e:
@@ -148,17 +186,55 @@ class LANMessenger:
                 data, addr = listen_socket.recvfrom(1024)
                 message = json.loads(data.decode('utf-8'))
                 if message.get('type') == 'discovery' and addr[0] != self.local_ip:
+                    is_new = addr[0] not in self.peers
                     self.peers[addr[0]] = {
                         'username': message['username'],
                         'port': message['port'],
+                        'proto': message.get('proto', 1),
+                        'multicast': message.get('multicast', False),
                         'last_seen': time.time()
                     }
+                    if is_new:
+                        self.outbox.wake(addr[0])  # Deliver anything queued while it was away
             except Exception:
                 if self.running:
                     print("❌ Peer listener closed.")
                 break
         listen_socket.close()
 
+    def _listen_for_multicast(self):
+        listen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listen_socket.bind(('', MULTICAST_PORT))
+            membership = struct.pack('4s4s', socket.inet_aton(MULTICAST_GROUP), socket.inet_aton('0.0.0.0'))
+            listen_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            print(f"⚠️ Multicast unavailable, broadcasts will use TCP only: {e}")
+            listen_socket.close()
+            return
+        self.multicast_enabled = True
+        while self.running:
+            try:
+                data, addr = listen_socket.recvfrom(65535)
+                if addr[0] not in self.peers or addr[0] == self.local_ip:
+                    continue
+                parsed = split_frame(data)
+                if not parsed:
+                    continue
+                message = parsed[0]
+                message_id = message.get('id')
+                if message_id in self._seen_multicast:
+                    continue
+                self._seen_multicast[message_id] = True
+                if len(self._seen_multicast) > 1024:
+                    self._seen_multicast.popitem(last=False)
+                self._handle_message(addr, message)
+            except Exception as e:
+                if self.running:
+                    print(f"❌ Multicast listener error: {e}")
+        listen_socket.close()
+
     def _prune_inactive_peers(self):
         while self.running:
             current_time = time.time()
@@ -166,16 +242,20 @@ class LANMessenger:
                               if current_time - data['last_seen'] > 30]
             for ip in inactive_peers:
                 print(f"\n👋 Peer '{self.peers[ip]['username']}' has gone offline.")
+                self.connection_pool.discard((ip, self.peers[ip]['port']))
                 del self.peers[ip]
+            self.connection_pool.close_idle()
             time.sleep(10)
 
-    # SEND WITH LENGTH HEADER
-    def _send_with_length(self, peer_ip, peer_port, json_bytes):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(10)
-            s.connect((peer_ip, peer_port))
-            length_header = f"{len(json_bytes):08}".encode('utf-8')
-            s.sendall(length_header + json_bytes)
+    # SEND A FRAME IN THE PEER'S FORMAT
+    def _send_frame(self, peer_ip, message):
+        """Send a message dict as a binary frame, or with the 8-digit length header to older peers"""
+        peer_info = self.peers[peer_ip]
+        if peer_info.get('proto', 1) >= FRAME_VERSION:
+            self.connection_pool.send((peer_ip, peer_info['port']), encode_message(message))
+        else:
+            # Older peers close the connection after reading one message
+            self.connection_pool.send_once((peer_ip, peer_info['port']), encode_legacy(message))
 
     # CLIENT FUNCTIONALITY
     def send_message(self, peer_ip, message_content):
@@ -183,16 +263,108 @@ class LANMessenger:
         if not peer_info:
             print("❌ Peer not found or is inactive.")
             return
-        try:
-            data = json.dumps({
-                'type': 'text',
-                'content': message_content,
-                'username': self.username
-            }).encode('utf-8')
-            self._send_with_length(peer_ip, peer_info['port'], data)
-            print(f"✅ Message sent to '{peer_info['username']}' ({peer_ip})")
-        except Exception as e:
-            print(f"❌ Failed to send message to {peer_ip}: {e}")
+        queued = self.outbox.enqueue(peer_ip, 'message', {
+            'type': 'text',
+            'content': message_content,
+            'username': self.username
+        })
+        if not queued:
+            print(f"❌ Outbox for '{peer_info['username']}' is full; message not sent.")
+
+    def broadcast_message(self, message_content, peer_ips=None, multicast=False):
+        """Send one message to many peers at once, without waiting for them.
+
+        The frame is encoded once per wire format and written to every peer
+        concurrently over pooled connections. With ``multicast``, a message
+        small enough for one datagram goes out once over UDP multicast to
+        the peers that listen for it; nothing acknowledges a datagram, so
+        those peers are reported as unconfirmed (``'ok': None``). Returns a
+        Future of {peer_ip: {'ok', 'via', 'latency_ms', 'error'}} that is
+        completed, and summarized on the console, once every TCP send has
+        finished. Peers that failed are handed to the outbox, whose
+        callbacks report the retries.
+        """
+        done = Future()
+        targets = {ip: info for ip, info in list(self.peers.items()) if peer_ips is None or ip in peer_ips}
+        if not targets:
+            print("\n[ No peers to broadcast to. ]")
+            done.set_result({})
+            return done
+        message = {
+            'type': 'text',
+            'content': message_content,
+            'username': self.username,
+            'id': uuid.uuid4().hex
+        }
+        binary_frame = encode_message(message)
+        legacy_frame = None
+        results = {}
+        started = time.perf_counter()
+
+        if multicast and len(binary_frame) <= MULTICAST_MAX_DATAGRAM:
+            multicast_peers = [ip for ip, info in targets.items()
+                               if info.get('multicast') and info.get('proto', 1) >= FRAME_VERSION]
+            if multicast_peers:
+                try:
+                    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                        s.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+                        s.sendto(binary_frame, (MULTICAST_GROUP, MULTICAST_PORT))
+                    latency = (time.perf_counter() - started) * 1000
+                    for ip in multicast_peers:
+                        results[ip] = {'ok': None, 'via': 'multicast', 'latency_ms': latency, 'error': None}
+                except OSError as e:
+                    print(f"⚠️ Multicast send failed, falling back to TCP: {e}")
+
+        tcp_peers = [ip for ip in targets if ip not in results]
+        remaining = [len(tcp_peers)]
+        lock = threading.Lock()
+
+        def finish():
+            total_ms = (time.perf_counter() - started) * 1000
+            latencies = sorted(r['latency_ms'] for r in results.values())
+            failed = [ip for ip, r in results.items() if r['ok'] is False]
+            unconfirmed = sum(1 for r in results.values() if r['ok'] is None)
+            ok = len(results) - len(failed) - unconfirmed
+            via_multicast = f", {unconfirmed} unconfirmed (multicast)" if unconfirmed else ""
+            print(f"📣 Broadcast to {len(results)} peers: {ok} ok, {len(failed)} failed{via_multicast} "
+                  f"(median {latencies[len(latencies) // 2]:.1f} ms, slowest {latencies[-1]:.1f} ms, "
+                  f"total {total_ms:.1f} ms)")
+            for ip in failed:
+                retry = "; queued for retry" if results[ip].get('queued') else ""
+                print(f"   ❌ {targets[ip]['username']} ({ip}): {results[ip]['error']}{retry}")
+            done.set_result(results)
+
+        def send_one(ip, frame):
+            sent_at = time.perf_counter()
+            try:
+                if frame is binary_frame:
+                    self.connection_pool.send((ip, targets[ip]['port']), frame)
+                else:
+                    self.connection_pool.send_once((ip, targets[ip]['port']), frame)
+                error = None
+            except Exception as e:
+                error = str(e)
+            result = {'ok': error is None, 'via': 'tcp', 'error': error,
+                      'latency_ms': (time.perf_counter() - sent_at) * 1000}
+            if error and self.outbox.enqueue(ip, 'message', message):
+                result['queued'] = True
+            with lock:
+                results[ip] = result
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                finish()
+
+        if not tcp_peers:
+            finish()
+        for ip in tcp_peers:
+            if targets[ip].get('proto', 1) >= FRAME_VERSION:
+                frame = binary_frame
+            else:
+                legacy_frame = legacy_frame or encode_legacy(message)
+                frame = legacy_frame
+            self.broadcast_pool.submit(send_one, ip, frame)
+        return done
 
     def send_file_to_peer(self, peer_ip, filepath):
         peer_info = self.peers.get(peer_ip)
@@ -202,20 +374,68 @@ class LANMessenger:
         if not os.path.exists(filepath):
             print("❌ File does not exist.")
             return
-        try:
-            with open(filepath, "rb") as f:
-                encoded_content = base64.b64encode(f.read()).decode('utf-8')
-            filename = os.path.basename(filepath)
-            data = json.dumps({
-                'type': 'file',
-                'username': self.username,
-                'filename': filename,
-                'content': encoded_content  # Keep using 'content' key consistently
-            }).encode('utf-8')
-            self._send_with_length(peer_ip, peer_info['port'], data)
-            print(f"✅ File '{filename}' sent to '{peer_info['username']}' ({peer_ip})")
-        except Exception as e:
-            print(f"❌ Failed to send file to {peer_ip}: {e}")
+        if not self.outbox.enqueue(peer_ip, 'file', {'path': os.path.abspath(filepath)}):
+            print(f"❌ Outbox for '{peer_info['username']}' is full; file not sent.")
+
+    # OUTBOX DELIVERY (runs on outbox worker threads)
+    def _deliver(self, item):
+        """Make one attempt at an outbox item; raise so the outbox retries it later."""
+        if item['kind'] == 'file':
+            item['note'] = self._transfer_file(item['peer_ip'], item['payload']['path'])
+        else:
+            self._send_frame(item['peer_ip'], item['payload'])
+
+    def _on_delivered(self, item, error):
+        peer_name = self.peers.get(item['peer_ip'], {}).get('username', item['peer_ip'])
+        if item['kind'] == 'file':
+            filename = os.path.basename(item['payload']['path'])
+            print(f"✅ File '{filename}' sent to '{peer_name}' ({item['peer_ip']}){item.get('note', '')}")
+        else:
+            print(f"✅ Message sent to '{peer_name}' ({item['peer_ip']})")
+
+    def _on_failed(self, item, error):
+        what = f"file '{os.path.basename(item['payload']['path'])}'" if item['kind'] == 'file' else "message"
+        print(f"❌ Failed to send {what} to {item['peer_ip']} after {item['attempts']} attempts: {error}")
+
+    def _transfer_file(self, peer_ip, filepath):
+        """Send one file; returns a note for the success message."""
+        peer_info = self.peers[peer_ip]
+        filename = os.path.basename(filepath)
+        if peer_info.get('proto', 1) < FRAME_VERSION:
+            # Older peers only understand the whole file base64-encoded in one legacy frame
+            with open(filepath, 'rb') as f:
+                content = base64.b64encode(f.read()).decode('ascii')
+            self._send_frame(peer_ip, {'type': 'file', 'username': self.username,
+                                       'filename': filename, 'content': content})
+            return ""
+        if os.path.getsize(filepath) <= self.small_file_limit:
+            # Small files skip the manifest round trip and ride the pooled connection as one frame
+            with open(filepath, 'rb') as f:
+                data = f.read()
+            self._send_frame(peer_ip, {'type': 'file', 'filename': filename,
+                                       'username': self.username, 'data': data})
+            return ""
+        manifest = build_manifest(filepath)
+        codec = sniff_file(filepath, self.file_compression) if self.file_compression else None
+        # The receiver re-hashes the whole file before answering the last chunk
+        timeout = 10 + manifest['size'] / (50 * 1024 * 1024)
+
+        def connect():
+            return socket.create_connection((peer_ip, peer_info['port']), timeout=timeout)
+
+        # A retry resumes from the chunks the receiver already verified
+        streams = self.file_streams or self.stream_tuner.streams_for(peer_ip)
+        started = time.monotonic()
+        with connect() as s:
+            sent = send_file_resumable(s, filepath, {'username': self.username}, manifest,
+                                       streams=streams, connect=connect, codec=codec)
+        if not self.file_streams:
+            self.stream_tuner.record(peer_ip, streams, sent, time.monotonic() - started)
+        if sent == 0 and manifest['size']:
+            return " (peer already had it, nothing sent)"
+        if sent < manifest['size']:
+            return f" (resumed, {sent} of {manifest['size']} bytes sent)"
+        return ""
 
     # VOICE/VIDEO CALL FUNCTIONALITY
     def make_voice_call(self, peer_ip):
@@ -237,7 +457,9 @@ class LANMessenger:
     # MAIN LOGIC
     def start(self):
         self.running = True
+        self.outbox.start()
         threading.Thread(target=self._start_server, daemon=True).start()
+        threading.Thread(target=self._listen_for_multicast, daemon=True).start()
         self._start_discovery()
         threading.Thread(target=self._prune_inactive_peers, daemon=True).start()
 
@@ -249,6 +471,11 @@ class LANMessenger:
     def stop(self):
         print("\n🛑 Shutting down...")
         self.running = False
+        if self.server:
+            self.server.stop()
+        self.outbox.stop()
+        self.broadcast_pool.shutdown(wait=False)
+        self.connection_pool.close()
         self.voice_video_handler.stop_server()
         time.sleep(0.1)
 
@@ -258,6 +485,8 @@ class LANMessenger:
                 "\n> Enter a command:\n" +
                 "  l - List peers\n" +
                 "  s - Send message\n" +
+                "  b - Broadcast message to all peers\n" +
+                "  m - Multicast message to all peers (delivery not confirmed)\n" +
                 "  f - Send file\n" +
                 "  v - Voice call\n" +
                 "  c - Video call\n" +
@@ -274,6 +503,18 @@ class LANMessenger:
                         print(f"  {i}. {data['username']} ({ip})")
             elif command == 's':
                 self.list_and_send()
+            elif command == 'b':
+                if not self.peers:
+                    print("\n[ No peers to broadcast to. ]")
+                else:
+                    message = input(f"> Enter message for all {len(self.peers)} peers: ")
+                    self.broadcast_message(message)
+            elif command == 'm':
+                if not self.peers:
+                    print("\n[ No peers to broadcast to. ]")
+                else:
+                    message = input(f"> Enter message for all {len(self.peers)} peers: ")
+                    self.broadcast_message(message, multicast=True)
             elif command == 'f':
                 self.list_and_send_file()
             elif command == 'v':
@@ -1,20 +1,72 @@
-import json
 import os
+import sys
 from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Optional
 import threading
-import shutil
+import time
+from concurrent.futures import Future
+from message_store import MessageStore, JournalMessageStore
+from backup_manager import BackupManager
+from search_index import SearchIndex
+
+def to_micros(dt: datetime) -> int:
+    """Convert a naive local datetime to integer microseconds since the epoch."""
+    return int(dt.replace(microsecond=0).timestamp()) * 1_000_000 + dt.microsecond
+
+
+def from_micros(micros: int) -> datetime:
+    """Inverse of ``to_micros``."""
+    seconds, micro = divmod(micros, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=micro)
+
 
 class Message:
+    """A chat message.
+
+    Messages stay resident by the hundred thousand, so the class is slotted:
+    ``sender_ip``, ``sender_username`` and ``type`` are interned (a handful
+    of distinct values shared by every message), the timestamp is kept as
+    integer microseconds and the default id is derived from it on demand
+    instead of being stored as a separate string.
+    """
+
+    __slots__ = ('sender_ip', 'sender_username', 'content', 'type', 'read', '_ts', '_id')
+
     def __init__(self, sender_ip: str, sender_username: str, content: str, msg_type: str = "text"):
-        self.sender_ip = sender_ip
-        self.sender_username = sender_username
+        self.sender_ip = sys.intern(sender_ip)
+        self.sender_username = sys.intern(sender_username)
         self.content = content
-        self.type = msg_type
-        self.timestamp = datetime.now().isoformat()
+        self.type = sys.intern(msg_type)
+        self._ts = to_micros(datetime.now())
         self.read = False
-        self.id = f"{int(datetime.now().timestamp() * 1000)}_{sender_ip}"
+        self._id = None
+        
+    @property
+    def timestamp(self) -> str:
+        return from_micros(self._ts).isoformat()
+        
+    @timestamp.setter
+    def timestamp(self, value: str):
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is not None:
+            dt = dt.astimezone().replace(tzinfo=None)
+        self._ts = to_micros(dt)
+        
+    @property
+    def timestamp_us(self) -> int:
+        return self._ts
+        
+    @property
+    def id(self) -> str:
+        if self._id is not None:
+            return self._id
+        return f"{self._ts // 1000}_{self.sender_ip}"
+        
+    @id.setter
+    def id(self, value: str):
+        # Only keep ids that differ from the one derived from the timestamp
+        self._id = None if value == f"{self._ts // 1000}_{self.sender_ip}" else value
         
     def to_dict(self) -> Dict:
         return {
@@ -29,25 +81,113 @@ class Message:
         
     @staticmethod
     def from_dict(data: Dict) -> 'Message':
-        msg = Message(
-            data['sender_ip'],
-            data['sender_username'],
-            data['content'],
-            data.get('type', 'text')
-        )
+        msg = Message.__new__(Message)
+        msg.sender_ip = sys.intern(data['sender_ip'])
+        msg.sender_username = sys.intern(data['sender_username'])
+        msg.content = data['content']
+        msg.type = sys.intern(data.get('type', 'text'))
         msg.timestamp = data['timestamp']
         msg.read = data.get('read', False)
-        msg.id = data.get('id', msg.id)
+        msg._id = None
+        if 'id' in data:
+            msg.id = data['id']
         return msg
 
+class PeerStats:
+    """Running counters for one peer's messages.
+
+    ``read_upto`` is the read high-water mark: messages at positions below
+    it in the peer's list are read, everything after it is unread.
+    """
+
+    __slots__ = ('total', 'text', 'file', 'last_ts', 'read_upto')
+
+    def __init__(self):
+        self.total = 0
+        self.text = 0
+        self.file = 0
+        self.last_ts = None
+        self.read_upto = 0
+
+    @property
+    def unread(self) -> int:
+        return self.total - self.read_upto
+
+    def add(self, msg: 'Message'):
+        self.total += 1
+        if msg.type == 'text':
+            self.text += 1
+        elif msg.type == 'file':
+            self.file += 1
+        if self.last_ts is None or msg.timestamp_us > self.last_ts:
+            self.last_ts = msg.timestamp_us
+
+    def to_dict(self) -> Dict:
+        return {
+            'total_messages': self.total,
+            'unread_messages': self.unread,
+            'text_messages': self.text,
+            'file_messages': self.file,
+            'last_message_time': from_micros(self.last_ts).isoformat() if self.last_ts is not None else None
+        }
+
+
 class MessageHandler:
-    def __init__(self, data_dir: str = "data"):
+    """Chat history kept resident in memory and persisted through a MessageStore.
+
+    ``durability`` controls when mutations reach the store:
+
+    * ``"always"`` - every call writes through before returning.
+    * ``"group"`` - calls return immediately and a write-behind thread
+      flushes everything queued every ``flush_interval_ms`` as one batch.
+    * ``"fsync"`` - group commit: callers block until a single writer has
+      drained everything pending into one fsync'd write.
+    """
+
+    DURABILITY_MODES = ('always', 'group', 'fsync')
+
+    def __init__(self, data_dir: str = "data", store: Optional[MessageStore] = None,
+                 durability: str = "always", flush_interval_ms: int = 100):
+        if durability not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {durability}")
         self.data_dir = Path(data_dir)
-        self.messages_file = self.data_dir / "messages.json"
         self.backup_dir = self.data_dir / "backups"
         self.ensure_directories()
+        # Default to the append-only journal; an existing messages.json is migrated once
+        self.store = store or JournalMessageStore(
+            self.data_dir / "messages.jsonl",
+            legacy_path=self.data_dir / "messages.json"
+        )
+        self.messages_file = self.store.path
+        self.durability = durability
+        self.flush_interval = flush_interval_ms / 1000
         self.lock = threading.Lock()
-        self.load_messages()  # Load messages at initialization
+        self.backups = BackupManager(self.store, self.backup_dir)
+
+        # Resident model: global timeline plus a per-peer index
+        self._messages: List[Message] = []
+        self._by_peer: Dict[str, List[Message]] = {}
+        # id -> position in its peer's list, used as a pagination cursor
+        self._positions: Dict[str, int] = {}
+        # Incremental statistics: per peer and overall
+        self._peer_stats: Dict[str, PeerStats] = {}
+        self._totals = PeerStats()
+        self.search_index = SearchIndex()
+        self._load_from_store()  # Load messages once at initialization
+
+        # Write-behind queue of (op, args, future) tuples drained by the flusher thread
+        self._pending: List[tuple] = []
+        self._flush_cond = threading.Condition()
+        self._flushing = False
+        self._closed = False
+        self._flusher = None
+        if self.durability == 'group':
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+        elif self.durability == 'fsync':
+            self._flusher = threading.Thread(target=self._commit_loop, daemon=True)
+            self._flusher.start()
+        self.backups.start()
         
     def ensure_directories(self):
         """Ensure all required directories exist."""
@@ -55,137 +195,342 @@ class MessageHandler:
         self.backup_dir.mkdir(parents=True, exist_ok=True)
         
     def create_backup(self):
-        """Create a backup of the messages file."""
+        """Take a full snapshot now, starting a new backup set."""
+        self.flush()
         if not self.messages_file.exists():
             return
+        self.backups.snapshot()
             
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_path = self.backup_dir / f"messages_{timestamp}.json"
-        shutil.copy2(self.messages_file, backup_path)
-        
-        # Clean old backups (keep last 5)
-        backups = sorted(self.backup_dir.glob("messages_*.json"))
-        for old_backup in backups[:-5]:
-            old_backup.unlink()
-            
-    def load_messages(self) -> List[Message]:
-        """Load all messages from the JSON file."""
+    def _load_from_store(self):
+        """Populate the resident model from the store."""
         try:
-            if self.messages_file.exists():
-                with open(self.messages_file, 'r') as f:
-                    data = json.load(f)
-                    return [Message.from_dict(msg_data) for msg_data in data]
-            return []
+            messages = [Message.from_dict(msg_data) for msg_data in self.store.load()]
         except Exception as e:
             print(f"❌ Failed to load messages: {e}")
             # Try to restore from latest backup
-            self._restore_from_backup()
-            return []
+            messages = []
+            if self._restore_from_backup():
+                try:
+                    messages = [Message.from_dict(msg_data) for msg_data in self.store.load()]
+                except Exception as e:
+                    print(f"❌ Failed to load restored messages: {e}")
+        self._set_messages(messages)
+        self.search_index.clear()
+        for msg in messages:
+            try:
+                self.search_index.add(msg.id, msg.content, msg.sender_ip, msg.timestamp_us)
+            except (AttributeError, TypeError) as e:
+                # Written before save_message coerced fields; keep the message, just don't index it
+                print(f"⚠️ Not indexing message {msg.id}: {e}")
+        
+    def _set_messages(self, messages: List[Message]):
+        """Replace the resident model and rebuild the per-peer index and counters."""
+        self._sync_read_flags()
+        self._messages = messages
+        self._by_peer = {}
+        self._positions = {}
+        self._peer_stats = {}
+        self._totals = PeerStats()
+        for msg in messages:
+            self._index_message(msg)
+        # Everything up to the last message flagged read counts as read
+        for peer_ip, peer_messages in self._by_peer.items():
+            stats = self._peer_stats[peer_ip]
+            for position in range(len(peer_messages) - 1, -1, -1):
+                if peer_messages[position].read:
+                    stats.read_upto = position + 1
+                    break
+            self._totals.read_upto += stats.read_upto
+            
+    def _index_message(self, msg: Message):
+        """Add a message to the per-peer index and counters."""
+        peer_messages = self._by_peer.setdefault(msg.sender_ip, [])
+        self._positions[msg.id] = len(peer_messages)
+        peer_messages.append(msg)
+        stats = self._peer_stats.get(msg.sender_ip)
+        if stats is None:
+            stats = self._peer_stats[msg.sender_ip] = PeerStats()
+        stats.add(msg)
+        self._totals.add(msg)
+        
+    def _read_flags(self, peer_ip: str, start: int, messages: List[Message]) -> List[Message]:
+        """Bring ``read`` up to date on messages returned from a peer's list.
+
+        Marking read only moves the peer's high-water mark, so flags are
+        refreshed lazily on the rows a caller actually gets back.
+        """
+        read_upto = self._peer_stats[peer_ip].read_upto if peer_ip in self._peer_stats else 0
+        for offset, msg in enumerate(messages):
+            msg.read = start + offset < read_upto
+        return messages
+        
+    def _sync_read_flags(self):
+        """Refresh ``read`` on every resident message."""
+        for peer_ip, peer_messages in self._by_peer.items():
+            self._read_flags(peer_ip, 0, peer_messages)
             
-    def _restore_from_backup(self):
-        """Attempt to restore messages from the latest backup."""
+    def load_messages(self) -> List[Message]:
+        """Return all messages from the resident model."""
+        with self.lock:
+            self._sync_read_flags()
+            return list(self._messages)
+            
+    def _restore_from_backup(self) -> bool:
+        """Attempt to restore messages from the latest snapshot plus its segments."""
         try:
-            backups = sorted(self.backup_dir.glob("messages_*.json"))
-            if backups:
-                latest_backup = backups[-1]
-                shutil.copy2(latest_backup, self.messages_file)
-                print(f"✅ Restored messages from backup: {latest_backup.name}")
+            restored = self.backups.restore_latest()
+            if restored:
+                print(f"✅ Restored messages from backup: {restored.name}")
+                return True
         except Exception as e:
             print(f"❌ Failed to restore from backup: {e}")
+        return False
+            
+    def _persist(self, op: str, *args) -> Optional[Future]:
+        """Write a mutation through to the store or queue it for the flusher.
+
+        In ``fsync`` mode the returned future resolves once the mutation is
+        on disk; callers should wait on it after releasing ``self.lock`` so
+        concurrent callers can share one commit.
+        """
+        if self.durability == 'always':
+            self._apply_ops([(op, args, None)])
+            return None
+        future = Future() if self.durability == 'fsync' else None
+        with self._flush_cond:
+            self._pending.append((op, args, future))
+            self._flush_cond.notify_all()
+        return future
+        
+    def _apply_ops(self, ops: List[tuple]):
+        """Apply queued mutations to the store, batching consecutive appends."""
+        batch = []
+        for op, args, _ in ops:
+            if op == 'append':
+                batch.append(args[0])
+                continue
+            if batch:
+                self.store.append_many(batch)
+                batch = []
+            if op == 'mark_read':
+                self.store.mark_read(*args)
+            elif op == 'delete':
+                self.store.delete(*args)
+        if batch:
+            self.store.append_many(batch)
+            
+    def _wait_for_commit(self, commit: Optional[Future], action: str) -> bool:
+        """Block on a group commit future, if any. Returns False if it failed."""
+        if commit is None:
+            return True
+        try:
+            commit.result()
+            return True
+        except Exception as e:
+            print(f"❌ Failed to {action}: {e}")
+            return False
+            
+    def flush(self):
+        """Write every queued mutation to the store now."""
+        with self._flush_cond:
+            while self._flushing:
+                self._flush_cond.wait()
+            ops, self._pending = self._pending, []
+            self._flushing = bool(ops)
+        if not ops:
+            return
+        try:
+            self._apply_ops(ops)
+            if self.durability == 'fsync':
+                self.store.sync()
+        except Exception as e:
+            waiters = [future for _, _, future in ops if future is not None]
+            if waiters:
+                # Group commit callers see the failure instead of a retry
+                for future in waiters:
+                    future.set_exception(e)
+            else:
+                print(f"❌ Failed to flush messages: {e}")
+                # Keep them queued so the next flush retries
+                with self._flush_cond:
+                    self._pending[:0] = ops
+        else:
+            for _, _, future in ops:
+                if future is not None:
+                    future.set_result(True)
+        finally:
+            with self._flush_cond:
+                self._flushing = False
+                self._flush_cond.notify_all()
+                
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(self.flush_interval)
+            self.flush()
+            
+    def _commit_loop(self):
+        # Drain as soon as anything is queued; whatever arrives while a commit
+        # is in progress is picked up together by the next one
+        while True:
+            with self._flush_cond:
+                while not self._pending and not self._closed:
+                    self._flush_cond.wait()
+                if self._closed and not self._pending:
+                    return
+            self.flush()
             
     def save_message(self, message_data: dict) -> Message:
         """Save a new message from WebSocket data."""
-        sender_ip = message_data.get('sender_ip', message_data.get('peer', 'unknown'))
-        sender_username = message_data.get('username', 'Anonymous')
-        content = message_data.get('content', '')
-        msg_type = message_data.get('type', 'text')
+        # Fields come from clients: coerce them to strings before anything is persisted
+        sender_ip = str(message_data.get('sender_ip') or message_data.get('peer') or 'unknown')
+        sender_username = str(message_data.get('username') or 'Anonymous')
+        content = message_data.get('content')
+        content = '' if content is None else str(content)
+        msg_type = str(message_data.get('type') or 'text')
         
         message = Message(sender_ip, sender_username, content, msg_type)
         
         with self.lock:
-            messages = self.load_messages()
-            messages.append(message)
+            # Ids double as cursors, so keep them unique within a burst
+            base_id, n = message.id, 1
+            while message.id in self._positions:
+                message.id = f"{base_id}_{n}"
+                n += 1
+            try:
+                commit = self._persist('append', message.to_dict())
+            except Exception as e:
+                print(f"❌ Failed to save message: {e}")
+                return None
+            self._messages.append(message)
+            self._index_message(message)
+            self.search_index.add(message.id, content, sender_ip, message.timestamp_us)
             
+        if commit is not None:
             try:
-                # Create backup before saving
-                self.create_backup()
-                
-                # Save messages
-                with open(self.messages_file, 'w') as f:
-                    json.dump([msg.to_dict() for msg in messages], f, indent=2)
-                    
-                return message
+                commit.result()
             except Exception as e:
                 print(f"❌ Failed to save message: {e}")
+                with self.lock:
+                    self._set_messages([msg for msg in self._messages if msg is not message])
+                    self.search_index.remove(message.id, content)
                 return None
+        return message
                 
     def get_messages_with_peer(self, peer_ip: str, limit: Optional[int] = None) -> List[Message]:
         """Retrieve messages exchanged with a specific peer."""
-        messages = self.load_messages()
-        peer_messages = [msg for msg in messages if msg.sender_ip == peer_ip]
+        with self.lock:
+            peer_messages = self._by_peer.get(peer_ip, [])
+            if limit:
+                start = max(0, len(peer_messages) - limit)
+            else:
+                start = 0
+            return self._read_flags(peer_ip, start, peer_messages[start:])
         
-        if limit:
-            return peer_messages[-limit:]
-        return peer_messages
+    def get_messages_page(self, peer_ip: str, before_id: Optional[str] = None,
+                          page_size: int = 50) -> Dict:
+        """Page backwards through the history with a peer.
+
+        Returns up to ``page_size`` messages (oldest first) that precede
+        ``before_id``, or the newest ones when no cursor is given.
+        ``next_cursor`` is the id to pass as ``before_id`` for the previous
+        page, or None when the start of the conversation has been reached.
+        """
+        if page_size <= 0:
+            raise ValueError("page_size must be positive")
+        with self.lock:
+            peer_messages = self._by_peer.get(peer_ip, [])
+            if before_id is None:
+                end = len(peer_messages)
+            else:
+                end = self._positions.get(before_id)
+                if end is None or end >= len(peer_messages) or peer_messages[end].id != before_id:
+                    raise ValueError(f"Unknown cursor {before_id} for peer {peer_ip}")
+            start = max(0, end - page_size)
+            page = self._read_flags(peer_ip, start, peer_messages[start:end])
+            return {
+                'messages': page,
+                'next_cursor': page[0].id if start > 0 else None
+            }
         
     def mark_messages_read(self, peer_ip: str) -> bool:
         """Mark all messages from a specific peer as read."""
         with self.lock:
-            messages = self.load_messages()
-            changed = False
-            
-            for msg in messages:
-                if msg.sender_ip == peer_ip and not msg.read:
-                    msg.read = True
-                    changed = True
-                    
-            if changed:
-                try:
-                    with open(self.messages_file, 'w') as f:
-                        json.dump([msg.to_dict() for msg in messages], f, indent=2)
-                    return True
-                except Exception as e:
-                    print(f"❌ Failed to update read status: {e}")
-                    
-            return False
+            stats = self._peer_stats.get(peer_ip)
+            if stats is None or not stats.unread:
+                return False
+            try:
+                commit = self._persist('mark_read', peer_ip)
+            except Exception as e:
+                print(f"❌ Failed to update read status: {e}")
+                return False
+            self._totals.read_upto += stats.unread
+            stats.read_upto = stats.total
+        return self._wait_for_commit(commit, "update read status")
             
     def delete_messages(self, peer_ip: Optional[str] = None, before_date: Optional[datetime] = None):
         """Delete messages matching criteria."""
-        with self.lock:
-            messages = self.load_messages()
-            original_count = len(messages)
-            
-            if peer_ip:
-                messages = [msg for msg in messages if msg.sender_ip != peer_ip]
-                
-            if before_date:
-                messages = [
-                    msg for msg in messages 
-                    if datetime.fromisoformat(msg.timestamp) >= before_date
-                ]
-                
-            if len(messages) < original_count:
-                try:
-                    self.create_backup()
-                    with open(self.messages_file, 'w') as f:
-                        json.dump([msg.to_dict() for msg in messages], f, indent=2)
-                    return True
-                except Exception as e:
-                    print(f"❌ Failed to delete messages: {e}")
-                    
+        if not peer_ip and not before_date:
             return False
             
+        with self.lock:
+            before_us = to_micros(before_date) if before_date else None
+            kept, removed = [], []
+            for msg in self._messages:
+                if (peer_ip and msg.sender_ip == peer_ip) or \
+                   (before_us is not None and msg.timestamp_us < before_us):
+                    removed.append(msg)
+                else:
+                    kept.append(msg)
+            if not removed:
+                return False
+            try:
+                self.create_backup()
+                commit = self._persist('delete', peer_ip, before_date)
+            except Exception as e:
+                print(f"❌ Failed to delete messages: {e}")
+                return False
+            self._set_messages(kept)
+            for msg in removed:
+                self.search_index.remove(msg.id, msg.content)
+        return self._wait_for_commit(commit, "delete messages")
+            
+    def search(self, query: str, peer_ip: Optional[str] = None, since: Optional[datetime] = None,
+               until: Optional[datetime] = None, limit: int = 20) -> List[Message]:
+        """Full-text search over message content, best match first.
+
+        All query words must match; the last one also matches as a prefix.
+        ``since``/``until`` bound the message timestamp (until is exclusive).
+        """
+        hits = self.search_index.search(
+            query,
+            peer=peer_ip,
+            since_us=to_micros(since) if since else None,
+            until_us=to_micros(until) if until else None,
+            limit=limit
+        )
+        results = []
+        with self.lock:
+            for msg_id, _ in hits:
+                position = self._positions.get(msg_id)
+                peer = self.search_index.peer_of(msg_id)
+                peer_messages = self._by_peer.get(peer, [])
+                if position is not None and position < len(peer_messages) \
+                   and peer_messages[position].id == msg_id:
+                    results.extend(self._read_flags(peer, position, [peer_messages[position]]))
+        return results
+        
     def get_message_stats(self, peer_ip: Optional[str] = None) -> Dict:
-        """Get message statistics."""
-        messages = self.load_messages()
+        """Get message statistics from the running counters."""
+        with self.lock:
+            if peer_ip:
+                return self._peer_stats.get(peer_ip, PeerStats()).to_dict()
+            return self._totals.to_dict()
         
-        if peer_ip:
-            messages = [msg for msg in messages if msg.sender_ip == peer_ip]
-            
-        return {
-            'total_messages': len(messages),
-            'unread_messages': len([msg for msg in messages if not msg.read]),
-            'text_messages': len([msg for msg in messages if msg.type == 'text']),
-            'file_messages': len([msg for msg in messages if msg.type == 'file']),
-            'last_message_time': max([msg.timestamp for msg in messages]) if messages else None
-        }
+    def close(self):
+        """Flush pending writes and release the underlying store."""
+        with self._flush_cond:
+            self._closed = True
+            self._flush_cond.notify_all()
+        self.flush()
+        self.backups.stop()
+        self.store.close()
@@ -0,0 +1,578 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Optional
+
+
+class MessageStore:
+    """Base class for message storage backends.
+
+    Stores work with plain message dicts (``Message.to_dict()`` records).
+    Subclasses must implement ``load``, ``append``, ``mark_read`` and
+    ``delete``; the query helpers fall back to scanning ``load()``.
+    """
+
+    path: Path
+    # True if the store supports snapshot_to / read_from for snapshot-plus-delta backups
+    incremental_backups = False
+
+    def load(self) -> List[Dict]:
+        """Return every stored message in insertion order."""
+        raise NotImplementedError
+
+    def append(self, record: Dict):
+        """Persist a single new message."""
+        raise NotImplementedError
+
+    def append_many(self, records: List[Dict]):
+        """Persist several new messages."""
+        for record in records:
+            self.append(record)
+
+    def mark_read(self, peer_ip: str) -> bool:
+        """Mark all messages from a peer as read. Returns True if anything changed."""
+        raise NotImplementedError
+
+    def delete(self, peer_ip: Optional[str] = None, before_date: Optional[datetime] = None) -> bool:
+        """Delete messages matching criteria. Returns True if anything was removed."""
+        raise NotImplementedError
+
+    def query_peer(self, peer_ip: str, limit: Optional[int] = None) -> List[Dict]:
+        """Return messages from a peer, oldest first, optionally only the last ``limit``."""
+        records = [r for r in self.load() if r['sender_ip'] == peer_ip]
+        if limit:
+            return records[-limit:]
+        return records
+
+    def sync(self):
+        """Make every write so far durable on disk."""
+        pass
+
+    def backup_to(self, backup_path):
+        """Write a consistent copy of the store to ``backup_path``."""
+        shutil.copy2(self.path, backup_path)
+
+    def restore_from(self, backup_path):
+        """Replace the store contents with a copy made by ``backup_to``."""
+        shutil.copy2(backup_path, self.path)
+
+    def close(self):
+        """Release any resources held by the store."""
+        pass
+
+    @staticmethod
+    def _matches_delete(record: Dict, peer_ip: Optional[str], before_date: Optional[datetime]) -> bool:
+        """True if a record is removed by a delete with the given criteria."""
+        if peer_ip and record['sender_ip'] == peer_ip:
+            return True
+        if before_date and datetime.fromisoformat(record['timestamp']) < before_date:
+            return True
+        return False
+
+
+class JSONFileStore(MessageStore):
+    """Legacy store: a single JSON array rewritten on every change."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self) -> List[Dict]:
+        if not self.path.exists():
+            return []
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def _write(self, records: List[Dict]):
+        with open(self.path, 'w') as f:
+            json.dump(records, f, indent=2)
+
+    def append(self, record: Dict):
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict]):
+        self._write(self.load() + records)
+
+    def mark_read(self, peer_ip: str) -> bool:
+        records = self.load()
+        changed = False
+        for record in records:
+            if record['sender_ip'] == peer_ip and not record.get('read', False):
+                record['read'] = True
+                changed = True
+        if changed:
+            self._write(records)
+        return changed
+
+    def delete(self, peer_ip: Optional[str] = None, before_date: Optional[datetime] = None) -> bool:
+        records = self.load()
+        kept = [r for r in records if not self._matches_delete(r, peer_ip, before_date)]
+        if len(kept) < len(records):
+            self._write(kept)
+            return True
+        return False
+
+
+class JournalMessageStore(MessageStore):
+    """Append-only newline-delimited JSON journal.
+
+    Every change is a single appended line::
+
+        {"op": "add", "msg": {...}}
+        {"op": "read", "peer": "10.0.0.5"}
+        {"op": "delete", "peer": null, "before": "2025-10-01T00:00:00"}
+
+    A ``read`` entry is a per-peer high-water mark: every message from that
+    peer earlier in the journal is read. Add entries carry no read flag of
+    their own once compacted. Loading replays the journal. A background thread compacts it (rewrites
+    only the live messages) once enough superseded records pile up. If the
+    journal does not exist yet and ``legacy_path`` points at an old JSON
+    array file, that file is migrated once and renamed to ``*.migrated``.
+
+    Between compactions the journal only grows, so a byte offset identifies
+    a consistent point in it; ``generation`` changes whenever the file is
+    rewritten and old offsets stop being meaningful.
+    """
+
+    incremental_backups = True
+
+    def __init__(self, path, legacy_path=None, compact_threshold: int = 1000,
+                 compact_interval: float = 30.0):
+        self.path = Path(path)
+        self.compact_threshold = compact_threshold
+        self.compact_interval = compact_interval
+        self.lock = threading.RLock()
+        self._record_count = 0
+        self._live_count = 0
+        self._unread: Dict[str, int] = {}
+        self._file = None
+        self.generation = 0
+
+        if legacy_path and not self.path.exists() and Path(legacy_path).exists():
+            self.migrate_from_json(legacy_path)
+
+        self.load()
+        self._stop = threading.Event()
+        self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+        self._compactor.start()
+
+    def migrate_from_json(self, legacy_path):
+        """One-time import of a legacy JSON array file into the journal."""
+        legacy_path = Path(legacy_path)
+        with open(legacy_path, 'r') as f:
+            records = json.load(f)
+        self._rewrite(records)
+        legacy_path.rename(legacy_path.with_name(legacy_path.name + '.migrated'))
+        print(f"✅ Migrated {len(records)} messages from {legacy_path.name} to {self.path.name}")
+
+    def _replay(self) -> List[Dict]:
+        """Rebuild the live message list from the journal."""
+        messages = []
+        record_count = 0
+        # Per-peer message counts and read high-water marks during the replay
+        state = ({}, {})
+        if self.path.exists():
+            with open(self.path, 'r') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line is expected after a crash mid-append
+                        print(f"⚠️ Skipping corrupt journal line {line_no} in {self.path.name}")
+                        continue
+                    record_count += 1
+                    self._apply(messages, entry, state)
+        self._apply_read_marks(messages, state)
+        self._record_count = record_count
+        self._live_count = len(messages)
+        self._unread = {}
+        for record in messages:
+            if not record['read']:
+                self._unread[record['sender_ip']] = self._unread.get(record['sender_ip'], 0) + 1
+        return messages
+
+    def _apply(self, messages: List[Dict], entry: Dict, state: tuple):
+        """Apply one journal entry to an in-progress replay."""
+        counts, read_upto = state
+        op = entry.get('op')
+        if op == 'add':
+            record = entry['msg']
+            messages.append(record)
+            counts[record['sender_ip']] = counts.get(record['sender_ip'], 0) + 1
+        elif op == 'read':
+            read_upto[entry['peer']] = counts.get(entry['peer'], 0)
+        elif op == 'delete':
+            # Positions shift, so turn the marks into flags before filtering
+            self._apply_read_marks(messages, state)
+            before = entry.get('before')
+            before_date = datetime.fromisoformat(before) if before else None
+            messages[:] = [
+                r for r in messages
+                if not self._matches_delete(r, entry.get('peer'), before_date)
+            ]
+            counts.clear()
+            for record in messages:
+                counts[record['sender_ip']] = counts.get(record['sender_ip'], 0) + 1
+
+    @staticmethod
+    def _apply_read_marks(messages: List[Dict], state: tuple):
+        """Set ``read`` on replayed records from the high-water marks, then reset the marks."""
+        _, read_upto = state
+        seen: Dict[str, int] = {}
+        for record in messages:
+            position = seen.get(record['sender_ip'], 0)
+            seen[record['sender_ip']] = position + 1
+            record['read'] = record.get('read', False) or position < read_upto.get(record['sender_ip'], 0)
+        read_upto.clear()
+
+    def load(self) -> List[Dict]:
+        with self.lock:
+            return self._replay()
+
+    def _append_entries(self, entries: List[Dict]):
+        """Append journal entries with a single write."""
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self._file.flush()
+        self._record_count += len(entries)
+
+    def sync(self):
+        with self.lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def append(self, record: Dict):
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict]):
+        if not records:
+            return
+        with self.lock:
+            self._append_entries([{'op': 'add', 'msg': record} for record in records])
+            self._live_count += len(records)
+            for record in records:
+                if not record.get('read', False):
+                    self._unread[record['sender_ip']] = self._unread.get(record['sender_ip'], 0) + 1
+
+    def mark_read(self, peer_ip: str) -> bool:
+        with self.lock:
+            if not self._unread.get(peer_ip):
+                return False
+            self._append_entries([{'op': 'read', 'peer': peer_ip}])
+            self._unread[peer_ip] = 0
+            return True
+
+    def delete(self, peer_ip: Optional[str] = None, before_date: Optional[datetime] = None) -> bool:
+        with self.lock:
+            removed = sum(
+                1 for r in self._replay()
+                if self._matches_delete(r, peer_ip, before_date)
+            )
+            if removed:
+                self._append_entries([{
+                    'op': 'delete',
+                    'peer': peer_ip,
+                    'before': before_date.isoformat() if before_date else None
+                }])
+                # Recount live and unread messages
+                self._replay()
+            return removed > 0
+
+    def _rewrite(self, records: List[Dict]):
+        """Atomically replace the journal with one add entry per record.
+
+        Read flags are folded into one read marker per peer, written right
+        after that peer's last read message.
+        """
+        last_read = {}
+        for i, record in enumerate(records):
+            if record.get('read', False):
+                last_read[record['sender_ip']] = i
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            for i, record in enumerate(records):
+                msg = {key: value for key, value in record.items() if key != 'read'}
+                f.write(json.dumps({'op': 'add', 'msg': msg}) + '\n')
+                if last_read.get(record['sender_ip']) == i:
+                    f.write(json.dumps({'op': 'read', 'peer': record['sender_ip']}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+        self.generation += 1
+        self._replay()
+
+    def snapshot_to(self, snapshot_path) -> tuple:
+        """Copy the journal to ``snapshot_path``. Returns ``(generation, offset)``."""
+        with self.lock:
+            if self.path.exists():
+                shutil.copyfile(self.path, snapshot_path)
+            else:
+                Path(snapshot_path).touch()
+            return self.generation, Path(snapshot_path).stat().st_size
+
+    def read_from(self, offset: int) -> tuple:
+        """Return ``(generation, bytes)`` appended to the journal since ``offset``."""
+        with self.lock:
+            if not self.path.exists():
+                return self.generation, b''
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                return self.generation, f.read()
+
+    def restore_from_files(self, paths: List[Path]):
+        """Replace the journal with the concatenation of ``paths`` (snapshot, then segments)."""
+        with self.lock:
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'wb') as out:
+                for path in paths:
+                    with open(path, 'rb') as f:
+                        shutil.copyfileobj(f, out)
+                out.flush()
+                os.fsync(out.fileno())
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            os.replace(tmp_path, self.path)
+            self.generation += 1
+            self._replay()
+
+    def backup_to(self, backup_path):
+        self.snapshot_to(backup_path)
+
+    def restore_from(self, backup_path):
+        self.restore_from_files([backup_path])
+
+    def needs_compaction(self) -> bool:
+        """True once superseded journal records exceed the compaction threshold."""
+        return self._record_count - self._live_count >= self.compact_threshold
+
+    def compact(self):
+        """Rewrite the journal so it only contains live messages."""
+        with self.lock:
+            self._rewrite(self._replay())
+
+    def _compact_loop(self):
+        while not self._stop.wait(self.compact_interval):
+            try:
+                if self.needs_compaction():
+                    self.compact()
+            except Exception as e:
+                print(f"❌ Journal compaction failed: {e}")
+
+    def close(self):
+        self._stop.set()
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class SQLiteMessageStore(MessageStore):
+    """SQLite-backed store with indexes on sender_ip and timestamp.
+
+    The database runs in WAL mode so readers on other threads (the
+    ``LANServer`` event loop, ``LANMessenger`` client threads) are not
+    blocked while a write is in progress. Each thread gets its own
+    connection. If ``legacy_path`` points at an old JSON array file and the
+    database is empty, the file is imported once and renamed to
+    ``*.migrated``.
+
+    Read state lives in ``read_markers`` as a per-peer high-water ``seq``;
+    the ``read`` column only carries flags imported with legacy data.
+    """
+
+    COLUMNS = ('id', 'sender_ip', 'sender_username', 'content', 'type', 'timestamp', 'read')
+    SELECT_COLUMNS = (
+        "id, sender_ip, sender_username, content, type, timestamp, "
+        "(read OR seq <= COALESCE((SELECT upto_seq FROM read_markers "
+        "WHERE read_markers.peer_ip = messages.sender_ip), 0)) AS read"
+    )
+
+    def __init__(self, path, legacy_path=None):
+        self.path = Path(path)
+        self.write_lock = threading.Lock()
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT,
+                    sender_ip TEXT NOT NULL,
+                    sender_username TEXT,
+                    content TEXT,
+                    type TEXT NOT NULL DEFAULT 'text',
+                    timestamp TEXT NOT NULL,
+                    read INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_sender_ip ON messages (sender_ip, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS read_markers (
+                    peer_ip TEXT PRIMARY KEY,
+                    upto_seq INTEGER NOT NULL
+                )
+            """)
+
+        if legacy_path and Path(legacy_path).exists() and self._is_empty():
+            self.migrate_from_json(legacy_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _is_empty(self) -> bool:
+        return self._conn().execute('SELECT 1 FROM messages LIMIT 1').fetchone() is None
+
+    def sync(self):
+        """fsync the WAL, which makes every commit so far durable.
+
+        With ``synchronous=NORMAL`` a WAL commit is written but only reaches
+        the disk at the next checkpoint. Syncing here gives the
+        ``synchronous=FULL`` guarantee once per group commit instead of on
+        every transaction.
+        """
+        wal_path = self.path.with_name(self.path.name + '-wal')
+        try:
+            fd = os.open(wal_path, os.O_RDWR)
+        except FileNotFoundError:
+            return  # No WAL yet, or the last connection removed it on close
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def migrate_from_json(self, legacy_path):
+        """One-time import of a legacy JSON array file."""
+        legacy_path = Path(legacy_path)
+        with open(legacy_path, 'r') as f:
+            records = json.load(f)
+        self.append_many(records)
+        legacy_path.rename(legacy_path.with_name(legacy_path.name + '.migrated'))
+        print(f"✅ Migrated {len(records)} messages from {legacy_path.name} to {self.path.name}")
+
+    @classmethod
+    def _to_row(cls, record: Dict) -> tuple:
+        return (
+            record.get('id'),
+            record['sender_ip'],
+            record.get('sender_username'),
+            record.get('content', ''),
+            record.get('type', 'text'),
+            record['timestamp'],
+            1 if record.get('read', False) else 0
+        )
+
+    @classmethod
+    def _to_record(cls, row: tuple) -> Dict:
+        record = dict(zip(cls.COLUMNS, row))
+        record['read'] = bool(record['read'])
+        if record['id'] is None:
+            del record['id']
+        return record
+
+    def _select(self, where: str = '', params: tuple = (), order: str = 'seq') -> List[Dict]:
+        sql = f"SELECT {self.SELECT_COLUMNS} FROM messages {where} ORDER BY {order}"
+        return [self._to_record(row) for row in self._conn().execute(sql, params)]
+
+    def load(self) -> List[Dict]:
+        return self._select()
+
+    def append(self, record: Dict):
+        self.append_many([record])
+
+    def append_many(self, records: List[Dict]):
+        if not records:
+            return
+        conn = self._conn()
+        with self.write_lock, conn:
+            conn.executemany(
+                f"INSERT INTO messages ({', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [self._to_row(record) for record in records]
+            )
+
+    def query_peer(self, peer_ip: str, limit: Optional[int] = None) -> List[Dict]:
+        if not limit:
+            return self._select('WHERE sender_ip = ?', (peer_ip,))
+        records = self._select('WHERE sender_ip = ?', (peer_ip,), order=f'seq DESC LIMIT {int(limit)}')
+        records.reverse()
+        return records
+
+    def mark_read(self, peer_ip: str) -> bool:
+        conn = self._conn()
+        with self.write_lock, conn:
+            # Both lookups are served by the (sender_ip, seq) index / primary key
+            latest = conn.execute(
+                'SELECT MAX(seq) FROM messages WHERE sender_ip = ?', (peer_ip,)
+            ).fetchone()[0]
+            if latest is None:
+                return False
+            marker = conn.execute(
+                'SELECT upto_seq FROM read_markers WHERE peer_ip = ?', (peer_ip,)
+            ).fetchone()
+            if marker is not None and marker[0] >= latest:
+                return False
+            conn.execute(
+                'INSERT OR REPLACE INTO read_markers (peer_ip, upto_seq) VALUES (?, ?)',
+                (peer_ip, latest)
+            )
+            return True
+
+    def delete(self, peer_ip: Optional[str] = None, before_date: Optional[datetime] = None) -> bool:
+        clauses, params = [], []
+        if peer_ip:
+            clauses.append('sender_ip = ?')
+            params.append(peer_ip)
+        if before_date:
+            clauses.append('timestamp < ?')
+            params.append(before_date.isoformat())
+        if not clauses:
+            return False
+        conn = self._conn()
+        with self.write_lock, conn:
+            cursor = conn.execute(f"DELETE FROM messages WHERE {' OR '.join(clauses)}", params)
+            return cursor.rowcount > 0
+
+    def backup_to(self, backup_path):
+        target = sqlite3.connect(backup_path)
+        try:
+            self._conn().backup(target)
+        finally:
+            target.close()
+
+    def restore_from(self, backup_path):
+        source = sqlite3.connect(backup_path)
+        try:
+            with self.write_lock:
+                source.backup(self._conn())
+        finally:
+            source.close()
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
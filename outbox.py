@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+
+class Outbox:
+    """Per-peer outbound queues drained by background workers.
+
+    Every peer has one FIFO lane per kind ('message', 'file'), so a large
+    transfer never holds chat messages back and chat stays in order. A lane
+    holds at most ``capacity`` items; ``enqueue`` refuses more, which is
+    the backpressure signal to the caller. Failed sends are retried with
+    exponential backoff up to ``max_attempts``; while a peer is offline
+    its lanes simply wait, up to ``max_age`` seconds per item.
+
+    ``deliver(item)`` performs one send attempt and raises on failure.
+    Results are reported as ``callback(item, error)`` (error is None on
+    success) to the per-item callback and to ``on_delivered``/``on_failed``.
+    Queued items are journaled to ``path`` (an append-only log of add/done
+    records, compacted as it grows) and reloaded on ``start``, so unsent
+    messages survive a restart. Items hold file paths, never file bytes,
+    so memory stays bounded by the lane capacity.
+    """
+
+    def __init__(self, path, deliver, is_available=None, capacity=500, max_attempts=8,
+                 base_delay=1.0, max_delay=60.0, max_age=24 * 3600, on_delivered=None, on_failed=None):
+        self.path = Path(path)
+        self.deliver = deliver
+        self.is_available = is_available or (lambda peer_ip: True)
+        self.capacity = capacity
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_age = max_age
+        self.on_delivered = on_delivered
+        self.on_failed = on_failed
+        self.cond = threading.Condition()
+        self.lanes = {}     # (peer_ip, kind) -> deque of items
+        self.workers = {}   # (peer_ip, kind) -> Thread
+        self.callbacks = {}  # item id -> callable(item, error)
+        self.running = False
+        self._log = None
+        self._dead_records = 0
+
+    # Persistence
+    def _load(self):
+        items = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    if record.get('op') == 'add':
+                        items[record['item']['id']] = record['item']
+                    elif record.get('op') == 'done':
+                        items.pop(record.get('id'), None)
+        except FileNotFoundError:
+            pass
+        return list(items.values())
+
+    def _append(self, record):
+        self._log.write(json.dumps(record) + '\n')
+        self._log.flush()
+
+    def _compact(self):
+        """Rewrite the journal with only the items still queued."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for lane in self.lanes.values():
+                for item in lane:
+                    f.write(json.dumps({'op': 'add', 'item': item}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._log:
+            self._log.close()
+        os.replace(tmp_path, self.path)
+        self._log = open(self.path, 'a', encoding='utf-8')
+        self._dead_records = 0
+
+    # Lifecycle
+    def start(self):
+        """Reload persisted items and start draining every non-empty lane."""
+        with self.cond:
+            self.running = True
+            for item in sorted(self._load(), key=lambda i: i['enqueued_at']):
+                self.lanes.setdefault((item['peer_ip'], item['kind']), deque()).append(item)
+            self._compact()
+            for key in self.lanes:
+                self._ensure_worker(key)
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+            if self._log:
+                self._log.close()
+                self._log = None
+
+    def wake(self, peer_ip=None):
+        """Retry waiting lanes now, e.g. when a peer reappears."""
+        with self.cond:
+            for lane in self.lanes.values():
+                for item in lane:
+                    if peer_ip is None or item['peer_ip'] == peer_ip:
+                        item['next_attempt'] = 0
+            self.cond.notify_all()
+
+    # Queueing
+    def enqueue(self, peer_ip, kind, payload, callback=None):
+        """Queue ``payload`` for ``peer_ip``; returns the item id, or None if the lane is full."""
+        with self.cond:
+            if not self.running:
+                return None
+            key = (peer_ip, kind)
+            lane = self.lanes.setdefault(key, deque())
+            if len(lane) >= self.capacity:
+                return None
+            item = {
+                'id': uuid.uuid4().hex,
+                'peer_ip': peer_ip,
+                'kind': kind,
+                'payload': payload,
+                'attempts': 0,
+                'enqueued_at': time.time(),
+                'next_attempt': 0,
+            }
+            lane.append(item)
+            self._append({'op': 'add', 'item': item})
+            if callback:
+                self.callbacks[item['id']] = callback
+            self._ensure_worker(key)
+            self.cond.notify_all()
+            return item['id']
+
+    def pending(self, peer_ip=None):
+        with self.cond:
+            return sum(len(lane) for (ip, _), lane in self.lanes.items() if peer_ip in (None, ip))
+
+    def _ensure_worker(self, key):
+        worker = self.workers.get(key)
+        if worker is None or not worker.is_alive():
+            worker = threading.Thread(target=self._drain, args=(key,), daemon=True)
+            self.workers[key] = worker
+            worker.start()
+
+    def _finish(self, key, item, error):
+        with self.cond:
+            lane = self.lanes.get(key)
+            if lane and lane[0] is item:
+                lane.popleft()
+            if self._log:
+                self._append({'op': 'done', 'id': item['id']})
+                self._dead_records += 2
+                if self._dead_records > 1000 and self._dead_records > 4 * self.pending():
+                    self._compact()
+            callback = self.callbacks.pop(item['id'], None)
+        self._notify(callback, item, error)
+        if error:
+            self._notify(self.on_failed, item, error)
+        else:
+            self._notify(self.on_delivered, item, None)
+
+    @staticmethod
+    def _notify(callback, item, error):
+        if callback:
+            try:
+                callback(item, error)
+            except Exception as e:
+                print(f"❌ Outbox callback error: {e}")
+
+    def _drain(self, key):
+        peer_ip = key[0]
+        while True:
+            with self.cond:
+                lane = self.lanes.get(key)
+                if not self.running or not lane:
+                    self.workers.pop(key, None)
+                    return
+                item = lane[0]
+                if time.time() - item['enqueued_at'] > self.max_age:
+                    expired = True
+                else:
+                    expired = False
+                    wait = item['next_attempt'] - time.time()
+                    if wait > 0 or not self.is_available(peer_ip):
+                        # Backing off, or the peer is offline: sleep until woken or the retry is due
+                        self.cond.wait(timeout=wait if wait > 0 else 5.0)
+                        continue
+            if expired:
+                self._finish(key, item, TimeoutError("Gave up after the message expired in the outbox"))
+                continue
+            try:
+                self.deliver(item)
+            except Exception as e:
+                item['attempts'] += 1
+                if item['attempts'] >= self.max_attempts:
+                    self._finish(key, item, e)
+                else:
+                    delay = min(self.base_delay * 2 ** (item['attempts'] - 1), self.max_delay)
+                    item['next_attempt'] = time.time() + delay
+                continue
+            self._finish(key, item, None)
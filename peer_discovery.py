@@ -10,6 +10,7 @@ class PeerDiscovery:
         self.listen_port = listen_port
         self.peers = {}
         self.running = False
+        self.on_peer_discovered = None  # Called with the peer info on every beacon heard
         
     def start_discovery(self):
         self.running = True
@@ -101,8 +102,11 @@ class PeerDiscovery:
                         'last_seen': time.time()
                     }
                     
+                    if addr[0] not in self.peers:
+                        print(f"👋 Discovered peer: {message['username']} at {addr[0]}")
                     self.peers[addr[0]] = peer_info
-                    print(f"👋 Discovered peer: {message['username']} at {addr[0]}")
+                    if self.on_peer_discovered:
+                        self.on_peer_discovered(peer_info)
                     
             except Exception as e:
                 if self.running:
@@ -0,0 +1,229 @@
+import bisect
+import heapq
+import itertools
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Set
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens of a message."""
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchIndex:
+    """Incrementally maintained inverted index over message content.
+
+    Postings map a term to ``{doc_id: term_frequency}`` in insertion order,
+    which is time order for chat history; each peer's messages are kept the
+    same way. A sorted term list lets the last query word match by prefix;
+    newly seen terms go to a small unsorted overflow that is merged in once
+    it grows, so indexing a message never shifts the whole sorted list.
+    Results are ranked with BM25 and can be filtered by peer and by a
+    timestamp range (integer microseconds, see ``Message.timestamp_us``).
+    """
+
+    K1 = 1.2
+    B = 0.75
+    MERGE_THRESHOLD = 1024
+    # Only the most recent matches of the rarest query word are scored, so a
+    # query made of very common words stays bounded instead of touching every message
+    MAX_CANDIDATES = 2000
+    # A prefix shorter than this only matches the exact term, and a prefix
+    # expands to at most MAX_EXPANSIONS terms (the first ones in sorted order)
+    MIN_PREFIX = 2
+    MAX_EXPANSIONS = 64
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._terms: List[str] = []
+        self._new_terms: List[str] = []
+        self._doc_len: Dict[str, int] = {}
+        self._doc_peer: Dict[str, str] = {}
+        self._doc_ts: Dict[str, int] = {}
+        self._peer_docs: Dict[str, Dict[str, None]] = {}  # peer -> its doc ids, oldest first
+        self._total_len = 0
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def add(self, doc_id: str, text: str, peer: str, timestamp_us: int):
+        """Index one message."""
+        tokens = tokenize(text)
+        with self.lock:
+            if doc_id in self._doc_len:
+                self._remove(doc_id)
+            freqs: Dict[str, int] = {}
+            for token in tokens:
+                freqs[token] = freqs.get(token, 0) + 1
+            for term, tf in freqs.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    self._new_terms.append(term)
+                postings[doc_id] = tf
+            self._doc_len[doc_id] = len(tokens)
+            self._doc_peer[doc_id] = peer
+            self._doc_ts[doc_id] = timestamp_us
+            self._peer_docs.setdefault(peer, {})[doc_id] = None
+            self._total_len += len(tokens)
+
+    def peer_of(self, doc_id: str) -> Optional[str]:
+        return self._doc_peer.get(doc_id)
+
+    def remove(self, doc_id: str, text: str):
+        """Drop one message; ``text`` is needed to find its postings."""
+        with self.lock:
+            self._remove(doc_id, set(tokenize(text)))
+
+    def _remove(self, doc_id: str, terms: Optional[Set[str]] = None):
+        if terms is None:
+            terms = [term for term, postings in self._postings.items() if doc_id in postings]
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                # Stale entries in the term lists are skipped and dropped on the next merge
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(doc_id, 0)
+        peer = self._doc_peer.pop(doc_id, None)
+        peer_docs = self._peer_docs.get(peer)
+        if peer_docs is not None:
+            peer_docs.pop(doc_id, None)
+            if not peer_docs:
+                del self._peer_docs[peer]
+        self._doc_ts.pop(doc_id, None)
+
+    def clear(self):
+        with self.lock:
+            self._postings = {}
+            self._terms = []
+            self._new_terms = []
+            self._doc_len = {}
+            self._doc_peer = {}
+            self._doc_ts = {}
+            self._peer_docs = {}
+            self._total_len = 0
+
+    def _merge_terms(self):
+        """Fold the overflow into the sorted term list, dropping removed terms."""
+        merged = sorted(self._terms + self._new_terms)
+        self._terms = [t for i, t in enumerate(merged)
+                       if t in self._postings and (i == 0 or merged[i - 1] != t)]
+        self._new_terms = []
+
+    def _expand(self, word: str, prefix: bool) -> List[str]:
+        """Index terms matching a query word."""
+        if not prefix or len(word) < self.MIN_PREFIX:
+            return [word] if word in self._postings else []
+        if len(self._new_terms) > self.MERGE_THRESHOLD:
+            self._merge_terms()
+        start = bisect.bisect_left(self._terms, word)
+        end = bisect.bisect_left(self._terms, word + '\U0010ffff')
+        matches = set(itertools.islice(
+            (self._terms[i] for i in range(start, end) if self._terms[i] in self._postings), self.MAX_EXPANSIONS))
+        matches.update(t for t in self._new_terms if t.startswith(word) and t in self._postings)
+        return sorted(matches)[:self.MAX_EXPANSIONS]
+
+    def _newest_matches(self, terms, peer, since_us, until_us):
+        """Doc ids containing any of ``terms`` that pass the filters, newest first.
+
+        Walks whichever is shorter: the terms' postings merged by time, or
+        the peer's own messages. Stops at the first message older than
+        ``since_us``.
+        """
+        postings = [self._postings[t] for t in terms]
+        peer_docs = self._peer_docs.get(peer, {}) if peer is not None else None
+        if peer_docs is not None and len(peer_docs) < sum(len(p) for p in postings):
+            if len(postings) == 1:
+                only = postings[0]
+                newest = (d for d in reversed(peer_docs) if d in only)
+            else:
+                newest = (d for d in reversed(peer_docs) if any(d in p for p in postings))
+        else:
+            if len(postings) == 1:
+                newest = reversed(postings[0])
+            else:
+                newest = heapq.merge(*(reversed(p) for p in postings), key=lambda d: -self._doc_ts[d])
+            if peer is not None:
+                newest = (d for d in newest if self._doc_peer[d] == peer)
+        seen = set()
+        for doc_id in newest:
+            ts = self._doc_ts[doc_id]
+            if since_us is not None and ts < since_us:
+                return
+            if (until_us is not None and ts >= until_us) or doc_id in seen:
+                continue
+            seen.add(doc_id)
+            yield doc_id
+
+    def search(self, query: str, peer: Optional[str] = None, since_us: Optional[int] = None,
+               until_us: Optional[int] = None, limit: int = 20, prefix: bool = True) -> List[tuple]:
+        """Return ``[(doc_id, score), ...]`` best first.
+
+        Every query word must match (AND). With ``prefix`` the last word
+        also matches longer terms, so partially typed input still finds hits.
+        Prefixes are bounded by ``MIN_PREFIX`` and ``MAX_EXPANSIONS``.
+        Very common words only consider the newest ``MAX_CANDIDATES`` matches
+        that pass the peer and time filters.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            n_docs = len(self._doc_len)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs
+            scores: Optional[Dict[str, float]] = None
+            # Rarest words first keeps the candidate set small
+            groups = []
+            for i, word in enumerate(words):
+                terms = self._expand(word, prefix and i == len(words) - 1)
+                if not terms:
+                    return []
+                groups.append(terms)
+            groups.sort(key=lambda terms: sum(len(self._postings[t]) for t in terms))
+
+            for terms in groups:
+                word_scores: Dict[str, float] = {}
+                if scores is None:
+                    # One cap for the whole word, applied after the filters so older
+                    # matches of a common word are still found
+                    candidates = dict.fromkeys(itertools.islice(
+                        self._newest_matches(terms, peer, since_us, until_us), self.MAX_CANDIDATES))
+                else:
+                    candidates = scores
+                for term in terms:
+                    postings = self._postings[term]
+                    idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    # Walk whichever side is smaller
+                    if len(postings) < len(candidates):
+                        matches = (d for d in postings if d in candidates)
+                    else:
+                        matches = (d for d in candidates if d in postings)
+                    for doc_id in matches:
+                        tf = postings[doc_id]
+                        norm = tf + self.K1 * (1 - self.B + self.B * self._doc_len[doc_id] / avg_len)
+                        score = idf * tf * (self.K1 + 1) / norm
+                        if score > word_scores.get(doc_id, 0.0):
+                            word_scores[doc_id] = score
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {d: scores[d] + s for d, s in word_scores.items()}
+                if not scores:
+                    return []
+
+            results = []
+            for doc_id, score in scores.items():
+                # Newer messages win ties
+                results.append((doc_id, score, self._doc_ts[doc_id]))
+            best = heapq.nlargest(limit, results, key=lambda r: (r[1], r[2]))
+            return [(doc_id, score) for doc_id, score, _ in best]
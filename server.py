@@ -1,57 +1,177 @@
 import asyncio
+import functools
+import hashlib
+import os
 import websockets
 import socket
 import json
+import struct
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+from connection_registry import ConnectionRegistry
 from peer_discovery import PeerDiscovery
 from file_handler import FileHandler
+from message_handler import MessageHandler
+
+# Binary websocket frames carry file data: upload id (16 raw bytes), byte offset, then the bytes
+FILE_CHUNK_HEADER = struct.Struct('>16sQ')
+FILE_CHUNK_SIZE = 256 * 1024
+
 
 class LANServer:
     def __init__(self, host='0.0.0.0', port=12345, username="Anonymous"):
         self.host = host
         self.port = port
         self.username = username
-        self.peers = {}
+        self.connections = ConnectionRegistry()  # Browser tabs by client id and by IP
         self.file_handler = FileHandler()
+        # Write-behind so saving chat history never blocks the event loop on disk I/O
+        self.message_handler = MessageHandler(durability="group")
         self.peer_discovery = PeerDiscovery(username, listen_port=port)
         self.available_peers = {}
+        # A client whose unread backlog stays over this many bytes without shrinking
+        # for stall_timeout seconds is treated as stalled and dropped
+        self.write_buffer_limit = 1024 * 1024
+        self.stall_timeout = 10.0
+        # Largest websocket message accepted. Files travel as binary chunks, so this
+        # only bounds chat and the older single-message base64 uploads.
+        self.max_message_size = 16 * 1024 * 1024
+        self.max_upload_size = 4 * 1024 * 1024 * 1024
+        self.max_uploads_per_client = 4
+        self.max_downloads_per_client = 4
+        # File decoding and disk writes run here, never on the loop.
+        # At most upload_slots jobs run or wait at once; further uploads stop reading their socket.
+        self.upload_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='uploads')
+        self.upload_slots = asyncio.Semaphore(4)
+        # Peer-list changes are coalesced for this long, then sent as one versioned delta
+        self.peer_update_delay = 0.25
+        self.peer_list_version = 0
+        self.published_peers = {}  # ip -> username, as of peer_list_version
+        self._peer_update_pending = False
         self.loop = asyncio.get_event_loop()
 
     def on_peer_discovered(self, peer_info):
+        # Called from the discovery thread for every beacon
+        self.loop.call_soon_threadsafe(self._peer_seen, peer_info)
+
+    def _peer_seen(self, peer_info):
         self.available_peers[peer_info['ip']] = {
             'username': peer_info['username'],
             'last_seen': time.time()
         }
-        asyncio.run_coroutine_threadsafe(self.broadcast_peer_list(), self.loop)
+        self.schedule_peer_update()
+
+    def schedule_peer_update(self):
+        """Publish peer changes after ``peer_update_delay``, once for any number of calls."""
+        if not self._peer_update_pending:
+            self._peer_update_pending = True
+            asyncio.get_running_loop().call_later(self.peer_update_delay, self.publish_peer_changes)
 
-    async def broadcast_peer_list(self):
+    def publish_peer_changes(self):
+        """Send clients a versioned join/leave delta, if the peer list actually changed.
+
+        Delta: ``{"type": "peer_delta", "version": n, "joined": [{"ip", "username"}], "left": [ip]}``
+        """
+        self._peer_update_pending = False
         current_time = time.time()
         self.available_peers = {
             ip: info for ip, info in self.available_peers.items()
-            if current_time - info['last_seen'] < 30
-        }
-        peer_list_message = {
-            'type': 'peer_list',
-            'peers': [
-                {'ip': ip, 'username': info['username']}
-                for ip, info in self.available_peers.items()
-            ]
+            if current_time - info['last_seen'] < 30 or self.connections.has_ip(ip)
         }
-        remove = []
-        for peer_info, websocket in list(self.peers.items()):
-            try:
-                await websocket.send(json.dumps(peer_list_message))
-            except Exception as e:
-                print(f"Error broadcasting: {e}")
-                remove.append(peer_info)
-        for p in remove:
-            self.peers.pop(p, None)
+        peers = {ip: info['username'] for ip, info in self.available_peers.items()}
+        joined = [{'ip': ip, 'username': name} for ip, name in peers.items()
+                  if self.published_peers.get(ip) != name]
+        left = [ip for ip in self.published_peers if ip not in peers]
+        if not joined and not left:
+            return
+        self.peer_list_version += 1
+        self.published_peers = peers
+        self.fan_out(json.dumps({
+            'type': 'peer_delta',
+            'version': self.peer_list_version,
+            'joined': joined,
+            'left': left
+        }))
+
+    async def send_peer_snapshot(self, websocket):
+        """Send one client the full peer list; on connect, or when it saw a version gap."""
+        try:
+            await websocket.send(json.dumps({
+                'type': 'peer_list',
+                'version': self.peer_list_version,
+                'peers': [{'ip': ip, 'username': name} for ip, name in self.published_peers.items()]
+            }))
+        except Exception as e:
+            print(f"❌ Error sending peer list to {websocket.remote_address[0]}: {e}")
+
+    async def expire_peers(self):
+        """Drop peers whose beacons stopped, even when nothing else triggers an update."""
+        while True:
+            await asyncio.sleep(5)
+            self.schedule_peer_update()
+
+    def fan_out(self, payload, exclude=None):
+        """Queue one already-serialized frame on every client except ``exclude``.
+
+        Nothing is awaited, so one slow client cannot delay the others.
+        A client whose unsent backlog is over ``write_buffer_limit`` and
+        has not shrunk for ``stall_timeout`` has stopped reading; it is
+        disconnected instead of buffering forever.
+        """
+        recipients = []
+        for (ip, client_id), websocket in self.connections.items():
+            if websocket is exclude:
+                continue
+            if self._is_stalled(websocket):
+                print(f"⚠️ Dropping stalled client {client_id}")
+                self.connections.remove(ip, client_id, websocket)
+                websocket.transport.abort()
+                continue
+            recipients.append(websocket)
+        websockets.broadcast(recipients, payload)
+
+    def _is_stalled(self, websocket):
+        backlog = websocket.transport.get_write_buffer_size()
+        if backlog <= self.write_buffer_limit:
+            websocket.backlog_mark = None
+            return False
+        now = time.monotonic()
+        mark = getattr(websocket, 'backlog_mark', None)
+        if mark is None or backlog < mark[0]:
+            # Over the limit but still draining, e.g. a large file broadcast
+            websocket.backlog_mark = (backlog, now)
+            return False
+        return now - mark[1] > self.stall_timeout
+
+    async def run_blocking(self, func, *args):
+        """Run CPU- or disk-heavy work on the upload pool, holding one upload slot."""
+        async with self.upload_slots:
+            return await asyncio.get_running_loop().run_in_executor(self.upload_pool, func, *args)
+
+    @staticmethod
+    def client_id_for(websocket):
+        """The ``client_id`` query parameter a tab connected with, else ``ip:port``."""
+        try:
+            requested = parse_qs(urlsplit(websocket.request.path).query).get('client_id')
+        except AttributeError:
+            requested = None
+        if requested and requested[0]:
+            return requested[0][:64]
+        return f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
 
     async def handle_websocket(self, websocket):
-        peer_info = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
+        peer_info = self.client_id_for(websocket)
         peer_ip = websocket.remote_address[0]
-        self.peers[peer_info] = websocket
+        websocket.client_id = peer_info
+        websocket.uploads = {}  # upload id -> FileUpload in progress on this connection
+        websocket.downloads = {}  # request id -> task streaming a stored file to this connection
+        displaced = self.connections.add(peer_ip, peer_info, websocket)
+        if displaced is not None:
+            # Same tab reconnecting; don't leave the old socket open but unrouted
+            print(f"🔁 {peer_info} reconnected, closing its previous connection")
+            asyncio.create_task(displaced.close(reason='replaced by a newer connection'))
 
         # Add this WebSocket-connected peer to available_peers
         self.available_peers[peer_ip] = {
@@ -61,20 +181,39 @@ class LANServer:
 
         print(f"🔗 New connection from {peer_info}")
         try:
-            await self.broadcast_peer_list()
+            self.schedule_peer_update()
+            await self.send_peer_snapshot(websocket)
             async for message in websocket:
                 try:
+                    if isinstance(message, bytes):
+                        await self.receive_file_chunk(message, websocket)
+                        continue
+                    # Parsed on the loop: json holds the GIL, so a worker thread would stall it
+                    # just the same, and max_message_size bounds the cost
                     data = json.loads(message)
+                    if not isinstance(data, dict):
+                        raise ValueError("expected a JSON object")
                     # THIS IS THE KEY CHANGE: We call a method on self, not self.handler
                     await self.process_message(data, websocket)
                 except json.JSONDecodeError:
                     print(f"❌ Invalid JSON from {peer_info}")
+                except websockets.exceptions.ConnectionClosed:
+                    raise
+                except Exception as e:
+                    # One bad frame must not take the whole connection down
+                    print(f"❌ Error handling message from {peer_info}: {e}")
         except websockets.exceptions.ConnectionClosed:
             print(f"👋 Client {peer_info} disconnected")
         finally:
-            self.peers.pop(peer_info, None)
-            self.available_peers.pop(peer_ip, None)
-            await self.broadcast_peer_list()
+            for upload in websocket.uploads.values():
+                upload.discard()
+            for download in websocket.downloads.values():
+                download.cancel()
+            self.connections.remove(peer_ip, peer_info, websocket)
+            # Other tabs from the same machine keep it listed
+            if not self.connections.has_ip(peer_ip):
+                self.available_peers.pop(peer_ip, None)
+            self.schedule_peer_update()
 
     def get_local_ips(self):
         ips = []
@@ -109,6 +248,9 @@ class LANServer:
         return list(set(ips))
 
     async def start_server(self):
+        # Discovery callbacks are handed to the loop that actually runs the server
+        self.loop = asyncio.get_running_loop()
+        expiry = asyncio.create_task(self.expire_peers())
         try:
             if self.peer_discovery:
                 self.peer_discovery.on_peer_discovered = self.on_peer_discovered
@@ -125,7 +267,8 @@ class LANServer:
             self.host,
             self.port,
             ping_interval=20,
-            ping_timeout=20
+            ping_timeout=20,
+            max_size=self.max_message_size
         )
         local_ips = self.get_local_ips()
         print(f"\n🚀 LANServer running at ws://{self.host}:{self.port}")
@@ -136,6 +279,8 @@ class LANServer:
             await server.wait_closed()
         except Exception as e:
             print(f"❌ Server error: {e}")
+        finally:
+            expiry.cancel()
 
     # This method is now part of the LANServer class
     async def process_message(self, message, websocket):
@@ -145,27 +290,55 @@ class LANServer:
         sender_ip = websocket.remote_address[0]
         print(f"Received {msg_type} from {sender_address}")
 
+        # History requests are answered to the requester only
+        if msg_type == 'history':
+            await self.send_history(message, websocket)
+            return
+        if msg_type == 'search':
+            await self.send_search_results(message, websocket)
+            return
+        if msg_type == 'peer_list':
+            await self.send_peer_snapshot(websocket)
+            return
+        if msg_type == 'file_start':
+            await self.start_upload(message, websocket)
+            return
+        if msg_type == 'file_end':
+            await self.finish_upload(message, websocket)
+            return
+        if msg_type == 'file_get':
+            await self.start_download(message, websocket)
+            return
+
         # Add sender info to message
         message['sender'] = sender_ip
         message['timestamp'] = timestamp
 
         # Handle file uploads - save to data/files folder
         if msg_type == 'file':
-            file_info = self.file_handler.process_file_upload({
+            file_info = await self.run_blocking(self.file_handler.process_file_upload, {
                 'filename': message.get('fileName', 'unknown_file'),
                 'content': message.get('content', '')
             })
             if file_info['success']:
                 print(f"📁 File saved: {file_info['filename']} ({file_info['size']} bytes)")
-                # Add file info to message
+                # Clients fetch the bytes with file_get; only the reference is broadcast
+                message.pop('content', None)
                 message['savedFilename'] = file_info['filename']
-                message['filePath'] = file_info['path']
+                message['fileSize'] = file_info['size']
+                message['sha256'] = file_info['sha256']
             else:
                 print(f"❌ File save failed: {file_info.get('error', 'Unknown error')}")
 
+        # Persist chat history so clients can page through it later
+        if msg_type in ['text', 'file']:
+            self.save_to_history(message, sender_ip)
+
         # Handle WebRTC signaling messages (route to specific peer)
         if msg_type in ['offer', 'answer', 'ice-candidate', 'call-rejected']:
             target_ip = message.get('target')
+            # Lets the other side reply to this exact tab with 'target_client'
+            message['sender_client'] = getattr(websocket, 'client_id', sender_address)
             if target_ip:
                 await self.send_to_peer(target_ip, message)
             else:
@@ -174,25 +347,245 @@ class LANServer:
             # Broadcast text and file messages to all peers
             await self.broadcast_message(message, websocket)
 
+    def save_to_history(self, message, sender_ip):
+        msg_type = message.get('type', 'text')
+        # Client fields are untrusted: fall back to defaults rather than persisting nulls or numbers
+        username = message.get('username')
+        if not isinstance(username, str) or not username:
+            username = f'User@{sender_ip.split(".")[-1]}'
+        if msg_type == 'file':
+            content = message.get('savedFilename', '')
+        else:
+            content = message.get('content')
+            content = message['content'] = '' if content is None else str(content)
+        saved = self.message_handler.save_message({
+            'sender_ip': sender_ip,
+            'username': username,
+            'content': content,
+            'type': msg_type
+        })
+        if saved:
+            message['id'] = saved.id
+
+    async def send_file_error(self, websocket, upload_id, error):
+        print(f"❌ File transfer {upload_id} from {websocket.remote_address[0]} failed: {error}")
+        try:
+            await websocket.send(json.dumps({'type': 'file_error', 'upload_id': upload_id, 'error': str(error)}))
+        except Exception:
+            pass
+
+    async def start_upload(self, message, websocket):
+        """Begin a chunked upload.
+
+        ``{"type": "file_start", "upload_id": 32 hex chars, "fileName": str, "size": n, "mimeType"?}``
+        is followed by binary frames (FILE_CHUNK_HEADER + bytes, in order) and
+        ``{"type": "file_end", "upload_id": id, "sha256"|"crc32": checksum}``.
+        Failures are reported as ``{"type": "file_error", "upload_id", "error"}``.
+        """
+        upload_id = str(message.get('upload_id', ''))
+        try:
+            if len(bytes.fromhex(upload_id)) != 16:
+                raise ValueError("upload_id must be 32 hex characters")
+            size = int(message.get('size'))
+            if not 0 <= size <= self.max_upload_size:
+                raise ValueError(f"File size must be between 0 and {self.max_upload_size} bytes")
+            if upload_id in websocket.uploads:
+                raise ValueError("Upload already in progress")
+            if len(websocket.uploads) >= self.max_uploads_per_client:
+                raise ValueError("Too many uploads in progress")
+            upload = await self.run_blocking(
+                self.file_handler.begin_upload, message.get('fileName', 'unknown_file'), size)
+        except (TypeError, ValueError, OSError) as e:
+            await self.send_file_error(websocket, upload_id, e)
+            return
+        upload.message = {
+            key: message[key] for key in ('fileName', 'mimeType', 'username', 'target') if key in message
+        }
+        websocket.uploads[upload_id] = upload
+
+    async def receive_file_chunk(self, data, websocket):
+        if len(data) < FILE_CHUNK_HEADER.size:
+            print(f"❌ Short binary frame from {websocket.remote_address[0]}")
+            return
+        raw_id, offset = FILE_CHUNK_HEADER.unpack_from(data)
+        upload_id = raw_id.hex()
+        upload = websocket.uploads.get(upload_id)
+        if upload is None:
+            return  # Unknown, or already failed and reported
+        try:
+            await self.run_blocking(upload.write, offset, memoryview(data)[FILE_CHUNK_HEADER.size:])
+        except (ValueError, OSError) as e:
+            websocket.uploads.pop(upload_id, None)
+            await self.run_blocking(upload.discard)
+            await self.send_file_error(websocket, upload_id, e)
+
+    async def finish_upload(self, message, websocket):
+        upload_id = str(message.get('upload_id', ''))
+        upload = websocket.uploads.pop(upload_id, None)
+        if upload is None:
+            await self.send_file_error(websocket, upload_id, "Unknown upload")
+            return
+        try:
+            file_info = await self.run_blocking(upload.finish, message.get('sha256'), message.get('crc32'))
+        except (TypeError, ValueError, OSError) as e:
+            await self.run_blocking(upload.discard)
+            await self.send_file_error(websocket, upload_id, e)
+            return
+        print(f"📁 File saved: {file_info['filename']} ({file_info['size']} bytes)")
+        sender_ip = websocket.remote_address[0]
+        file_message = dict(
+            upload.message,
+            type='file',
+            fileName=file_info['originalName'],
+            savedFilename=file_info['filename'],
+            fileSize=file_info['size'],
+            sha256=file_info['sha256'],
+            sender=sender_ip,
+            timestamp=datetime.now().strftime("%H:%M:%S")
+        )
+        self.save_to_history(file_message, sender_ip)
+        try:
+            await websocket.send(json.dumps(dict(file_message, type='file_saved', upload_id=upload_id)))
+        except Exception as e:
+            print(f"❌ Error confirming upload to {sender_ip}: {e}")
+        await self.broadcast_message(file_message, websocket)
+
+    async def start_download(self, request, websocket):
+        """Stream a stored file in its own task, so the client's other messages keep flowing."""
+        request_id = str(request.get('request_id', ''))
+        if request_id in websocket.downloads:
+            await self.send_file_error(websocket, request_id, "Download already in progress")
+            return
+        if len(websocket.downloads) >= self.max_downloads_per_client:
+            await self.send_file_error(websocket, request_id, "Too many downloads in progress")
+            return
+        task = asyncio.create_task(self.send_stored_file(request, websocket))
+        websocket.downloads[request_id] = task
+        task.add_done_callback(lambda _: websocket.downloads.pop(request_id, None))
+
+    async def send_stored_file(self, request, websocket):
+        """Stream a received file back to one client.
+
+        Request: ``{"type": "file_get", "request_id": 32 hex chars, "savedFilename": str}``
+        The reply uses the upload framing: ``file_start``, binary chunks, ``file_end`` with sha256.
+        """
+        request_id = str(request.get('request_id', ''))
+        try:
+            raw_id = bytes.fromhex(request_id)
+            if len(raw_id) != 16:
+                raise ValueError("request_id must be 32 hex characters")
+            file_path = self.file_handler.stored_file_path(request.get('savedFilename', ''))
+            f = await self.run_blocking(open, file_path, 'rb')
+        except (TypeError, ValueError, OSError) as e:
+            await self.send_file_error(websocket, request_id, e)
+            return
+        try:
+            size = os.fstat(f.fileno()).st_size
+            await websocket.send(json.dumps({
+                'type': 'file_start',
+                'upload_id': request_id,
+                'fileName': file_path.name,
+                'size': size
+            }))
+            digest = hashlib.sha256()
+            offset = 0
+            while True:
+                chunk = await self.run_blocking(f.read, FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                # Awaiting send waits for this client to drain, so a slow reader is not buffered in memory
+                await websocket.send(FILE_CHUNK_HEADER.pack(raw_id, offset) + chunk)
+                offset += len(chunk)
+            await websocket.send(json.dumps({
+                'type': 'file_end',
+                'upload_id': request_id,
+                'sha256': digest.hexdigest()
+            }))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except OSError as e:
+            await self.send_file_error(websocket, request_id, e)
+        finally:
+            f.close()
+
+    async def send_history(self, request, websocket):
+        """Reply with one page of history with a peer, newest page first.
+
+        Request: ``{"type": "history", "peer": ip, "before": id?, "limit": n?}``
+        Response: ``{"type": "history", "peer": ip, "messages": [...], "next_cursor": id|null}``
+        """
+        peer_ip = request.get('peer')
+        try:
+            page = self.message_handler.get_messages_page(
+                peer_ip,
+                before_id=request.get('before'),
+                page_size=min(int(request.get('limit', 50)), 200)
+            )
+            response = {
+                'type': 'history',
+                'peer': peer_ip,
+                'messages': [msg.to_dict() for msg in page['messages']],
+                'next_cursor': page['next_cursor']
+            }
+        except (TypeError, ValueError) as e:
+            response = {'type': 'history', 'peer': peer_ip, 'error': str(e)}
+        try:
+            await websocket.send(json.dumps(response))
+        except Exception as e:
+            print(f"❌ Error sending history to {websocket.remote_address[0]}: {e}")
+
+    async def send_search_results(self, request, websocket):
+        """Reply with ranked full-text search results.
+
+        Request: ``{"type": "search", "query": str, "peer": ip?, "since": iso?, "until": iso?, "limit": n?}``
+        Response: ``{"type": "search", "query": str, "results": [...]}``
+        """
+        query = str(request.get('query') or '')
+        try:
+            search = functools.partial(
+                self.message_handler.search,
+                query,
+                peer_ip=request.get('peer'),
+                since=datetime.fromisoformat(request['since']) if request.get('since') else None,
+                until=datetime.fromisoformat(request['until']) if request.get('until') else None,
+                limit=min(int(request.get('limit', 20)), 200)
+            )
+            # Off the loop, and not on the upload pool where it would queue behind file writes
+            results = await asyncio.get_running_loop().run_in_executor(None, search)
+            response = {
+                'type': 'search',
+                'query': query,
+                'results': [msg.to_dict() for msg in results]
+            }
+        except (TypeError, ValueError) as e:
+            response = {'type': 'search', 'query': query, 'error': str(e)}
+        try:
+            await websocket.send(json.dumps(response))
+        except Exception as e:
+            print(f"❌ Error sending search results to {websocket.remote_address[0]}: {e}")
+
     async def broadcast_message(self, message, sender_socket):
-        for peer_info, websocket in list(self.peers.items()):
-            if websocket != sender_socket:
-                try:
-                    await websocket.send(json.dumps(message))
-                except Exception as e:
-                    print(f"❌ Error broadcasting to {peer_info}: {e}")
+        payload = json.dumps(message)
+        self.fan_out(payload, exclude=sender_socket)
 
     async def send_to_peer(self, target_ip, message):
-        """Send message to a specific peer by IP"""
-        for peer_info, websocket in list(self.peers.items()):
-            if peer_info.startswith(target_ip + ':'):
-                try:
-                    await websocket.send(json.dumps(message))
-                    print(f"✅ Sent {message.get('type')} to {target_ip}")
-                    return
-                except Exception as e:
-                    print(f"❌ Error sending to {target_ip}: {e}")
-        print(f"⚠️ Peer {target_ip} not found")
+        """Send message to a specific peer by IP.
+
+        A ``target_client`` in the message picks one tab; otherwise the tab
+        from ``target_ip`` that connected most recently gets it.
+        """
+        websocket = self.connections.get(target_ip, message.get('target_client'))
+        if websocket is None:
+            websocket = self.connections.latest(target_ip)
+        if websocket is None:
+            print(f"⚠️ Peer {target_ip} not found")
+            return
+        try:
+            await websocket.send(json.dumps(message))
+            print(f"✅ Sent {message.get('type')} to {target_ip}")
+        except Exception as e:
+            print(f"❌ Error sending to {target_ip}: {e}")
 
 if __name__ == "__main__":
     server = LANServer()
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useCallback } from 'react';
 import { useWebSocket } from './contexts/WebSocketContext';
 import UserList from './components/Sidebar/UserList';
 import ChatWindow from './components/Chat/ChatWindow';
@@ -14,8 +14,24 @@ interface Message {
   timestamp: number;
   fileUrl?: string;
   fileName?: string;
+  savedFilename?: string;
+  mimeType?: string;
 }
 
+// Messages per history page
+const HISTORY_PAGE_SIZE = 50;
+
+// A stored message as the server's history reply carries it
+const fromHistory = (msg: any): Message => ({
+  id: msg.id,
+  sender: msg.sender_username,
+  content: msg.type === 'file' ? '' : msg.content,
+  type: msg.type === 'file' ? 'file' : 'text',
+  timestamp: Date.parse(msg.timestamp),
+  fileName: msg.type === 'file' ? msg.content : undefined,
+  savedFilename: msg.type === 'file' ? msg.content : undefined,
+});
+
 function App() {
   const {
     connectToServer,
@@ -24,36 +40,84 @@ function App() {
     isConnecting,
     connectionError,
     sendMessage,
+    sendFile,
     onMessage,
   } = useWebSocket();
 
   const [serverIp, setServerIp] = useState('192.168.29.49');
   const [selectedUser, setSelectedUser] = useState<string | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  // Per peer: the id to page back from, null once the start is reached; absent before the first page
+  const [historyCursors, setHistoryCursors] = useState<Record<string, string | null>>({});
+  const [loadingHistory, setLoadingHistory] = useState(false);
 
   // Handle incoming messages
   useEffect(() => {
     onMessage((data) => {
-      if (data.type === 'text' || data.type === 'file') {
+      if (data.type === 'history') {
+        setLoadingHistory(false);
+        if (!data.peer) return;
+        if (data.error) {
+          // Stop paging this peer rather than retrying a request that will fail again
+          console.error('History request failed:', data.error);
+          setHistoryCursors((prev) => ({ ...prev, [data.peer as string]: null }));
+          return;
+        }
+        const older: Message[] = (data.messages || []).map(fromHistory);
+        setMessages((prev) => {
+          const known = new Set(prev.map((message) => message.id));
+          return [...older.filter((message) => !known.has(message.id)), ...prev];
+        });
+        setHistoryCursors((prev) => ({ ...prev, [data.peer as string]: data.next_cursor ?? null }));
+      } else if (data.type === 'text' || data.type === 'file') {
         const newMessage: Message = {
-          id: Date.now().toString() + Math.random(),
+          // The server's id lets history pages skip messages we already show
+          id: data.id || Date.now().toString() + Math.random(),
           sender: data.sender || 'Unknown',
           content: data.content || '',
           type: data.type,
           timestamp: data.timestamp || Date.now(),
-          fileName: data.filename,
+          fileName: data.fileName || data.filename,
+          savedFilename: data.savedFilename,
+          mimeType: data.mimeType,
         };
         setMessages((prev) => [...prev, newMessage]);
 
         if (data.type === 'text') {
           toast.info(`New message from ${data.sender}`);
         } else if (data.type === 'file') {
-          toast.info(`${data.sender} sent a file: ${data.filename}`);
+          toast.info(`${data.sender} sent a file: ${data.fileName || data.filename}`);
         }
       }
     });
   }, [onMessage]);
 
+  // A reply lost with the connection must not block paging after a reconnect
+  useEffect(() => {
+    if (!isConnected) setLoadingHistory(false);
+  }, [isConnected]);
+
+  // Ask for the page before the oldest message we hold; the reply arrives as a 'history' message
+  const loadOlderMessages = useCallback(() => {
+    if (!selectedUser || loadingHistory) return;
+    const cursor = historyCursors[selectedUser];
+    if (cursor === null) return;
+    setLoadingHistory(true);
+    sendMessage({
+      type: 'history',
+      peer: selectedUser,
+      before: cursor,
+      limit: HISTORY_PAGE_SIZE,
+    });
+  }, [selectedUser, loadingHistory, historyCursors, sendMessage]);
+
+  // The newest page is fetched the first time a peer is opened
+  useEffect(() => {
+    if (selectedUser && !(selectedUser in historyCursors)) {
+      loadOlderMessages();
+    }
+  }, [selectedUser, historyCursors, loadOlderMessages]);
+
   const handleConnect = () => {
     connectToServer(serverIp);
   };
@@ -77,39 +141,20 @@ function App() {
   };
 
   const handleFileUpload = async (file: File) => {
-    const reader = new FileReader();
-
-    return new Promise<void>((resolve, reject) => {
-      reader.onload = () => {
-        const base64Data = reader.result as string;
-        const base64Content = base64Data.split(',')[1];
-
-        const message: Message = {
-          id: Date.now().toString(),
-          sender: 'You',
-          content: base64Content,
-          type: 'file',
-          timestamp: Date.now(),
-          fileName: file.name,
-        };
-
-        setMessages([...messages, message]);
-
-        sendMessage({
-          type: 'file',
-          content: base64Content,
-          filename: file.name,
-          fileSize: file.size,
-          mimeType: file.type,
-          target: selectedUser || undefined,
-        });
+    const message: Message = {
+      id: Date.now().toString(),
+      sender: 'You',
+      content: '',
+      type: 'file',
+      timestamp: Date.now(),
+      fileName: file.name,
+      fileUrl: URL.createObjectURL(file),
+    };
 
-        resolve();
-      };
+    setMessages((prev) => [...prev, message]);
 
-      reader.onerror = () => reject(reader.error);
-      reader.readAsDataURL(file);
-    });
+    // Sent in binary chunks; other clients get a reference they can download from the server
+    await sendFile(file, { target: selectedUser || undefined });
   };
 
   // This is the main screen when you are not connected
@@ -181,6 +226,9 @@ function App() {
               onSendMessage={handleSendMessage}
               onFileUpload={handleFileUpload}
               selectedUser={selectedUser}
+              onLoadOlder={loadOlderMessages}
+              hasOlder={historyCursors[selectedUser] !== null}
+              loadingOlder={loadingHistory}
             />
           ) : (
             <div className="no-chat-selected">
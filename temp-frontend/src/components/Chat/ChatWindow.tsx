@@ -2,7 +2,6 @@ import React, { useState, useRef, useEffect } from 'react';
 import { useDropzone } from 'react-dropzone';
 import { toast } from 'react-toastify';
 
-import { useWebSocket } from '../../contexts/WebSocketContext';
 import { usePeer } from '../../contexts/PeerContext';
 
 import MessageBubble from './MessageBubble';
@@ -18,19 +17,32 @@ interface Message {
   timestamp: number;
   fileUrl?: string;
   fileName?: string;
+  savedFilename?: string;
+  mimeType?: string;
 }
 
 interface ChatWindowProps {
   messages: Message[];
   onSendMessage: (text: string) => void;
-  onFileUpload: (file: File) => void;
+  onFileUpload: (file: File) => Promise<void>;
   selectedUser: string | null;
+  onLoadOlder?: () => void;
+  hasOlder?: boolean;
+  loadingOlder?: boolean;
 }
 
-const ChatWindow: React.FC<ChatWindowProps> = ({ messages, onSendMessage, onFileUpload, selectedUser }) => {
-  const { sendMessage } = useWebSocket();
+// Older history is requested once the list is scrolled this close to the top
+const LOAD_OLDER_THRESHOLD = 80;
+
+const ChatWindow: React.FC<ChatWindowProps> = ({
+  messages, onSendMessage, onFileUpload, selectedUser, onLoadOlder, hasOlder = false, loadingOlder = false,
+}) => {
   const [inputMessage, setInputMessage] = useState('');
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const messagesListRef = useRef<HTMLDivElement>(null);
+  const lastMessageIdRef = useRef<string | null>(null);
+  // Scroll height before an older page was prepended, to keep the view where it was
+  const heightBeforeLoadRef = useRef<number | null>(null);
 
   const { getRootProps, getInputProps, isDragActive } = useDropzone({
     onDrop: (acceptedFiles) => {
@@ -44,9 +56,27 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ messages, onSendMessage, onFile
   };
 
   useEffect(() => {
-    scrollToBottom();
+    const list = messagesListRef.current;
+    const lastId = messages.length ? messages[messages.length - 1].id : null;
+    if (list && heightBeforeLoadRef.current !== null && lastId === lastMessageIdRef.current) {
+      // Older messages were prepended: stay on the message that was at the top
+      list.scrollTop += list.scrollHeight - heightBeforeLoadRef.current;
+    } else if (lastId !== lastMessageIdRef.current) {
+      scrollToBottom();
+    }
+    heightBeforeLoadRef.current = null;
+    lastMessageIdRef.current = lastId;
   }, [messages]);
 
+  const handleScroll = () => {
+    const list = messagesListRef.current;
+    if (!list || !onLoadOlder || !hasOlder || loadingOlder) return;
+    if (list.scrollTop < LOAD_OLDER_THRESHOLD) {
+      heightBeforeLoadRef.current = list.scrollHeight;
+      onLoadOlder();
+    }
+  };
+
   const handleSendMessage = () => {
     if (!inputMessage.trim()) return;
 
@@ -57,29 +87,7 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ messages, onSendMessage, onFile
   const handleFileUpload = async (files: File[]) => {
     for (const file of files) {
       try {
-        const reader = new FileReader();
-        const filePromise = new Promise((resolve, reject) => {
-          reader.onload = () => resolve(reader.result);
-          reader.onerror = () => reject(reader.error);
-        });
-
-        reader.readAsDataURL(file);
-        const base64Data = await filePromise;
-        const base64Content = (base64Data as string).split(',')[1];
-
-        // Fixed: Provide the proper type!
-        const fileMessage: Message = {
-          id: Date.now().toString(),
-          sender: 'You',
-          content: base64Content,
-          type: 'file',                      // Fix here: 'file' is a literal, not a string variable!
-          timestamp: Date.now(),
-          fileUrl: '',                       // set this only if you have a URL
-          fileName: file.name
-        };
-
         await onFileUpload(file);
-        sendMessage(fileMessage);
         toast.success(`File ${file.name} sent successfully!`);
       } catch (error) {
         console.error('Error sending file:', error);
@@ -185,7 +193,8 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ messages, onSendMessage, onFile
               </button>
             </div>
           </div>
-          <div className="chat-messages">
+          <div className="chat-messages" ref={messagesListRef} onScroll={handleScroll}>
+            {loadingOlder && <div className="history-loading">Loading older messages...</div>}
             {messages.map((message) => (
               <MessageBubble key={message.id} message={message} />
             ))}
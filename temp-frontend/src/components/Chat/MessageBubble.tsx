@@ -1,4 +1,5 @@
-import React from 'react';
+import React, { useState } from 'react';
+import { useWebSocket } from '../../contexts/WebSocketContext';
 import './MessageBubble.css';
 
 interface Message {
@@ -9,6 +10,8 @@ interface Message {
   timestamp: number;
   fileUrl?: string;
   fileName?: string;
+  savedFilename?: string;
+  mimeType?: string;
 }
 
 interface MessageBubbleProps {
@@ -16,12 +19,34 @@ interface MessageBubbleProps {
 }
 
 const MessageBubble: React.FC<MessageBubbleProps> = ({ message }) => {
+  const { fetchFile } = useWebSocket();
+  const [isDownloading, setIsDownloading] = useState(false);
   const isMe = message.sender === 'You';
   const formattedTime = new Date(message.timestamp).toLocaleTimeString([], {
     hour: '2-digit',
     minute: '2-digit',
   });
 
+  // Received files are fetched from the server only when asked for
+  const handleDownload = async (e: React.MouseEvent) => {
+    e.stopPropagation();
+    if (!message.savedFilename || isDownloading) return;
+    setIsDownloading(true);
+    try {
+      const file = await fetchFile(message.savedFilename, message.mimeType);
+      const url = URL.createObjectURL(file);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = message.fileName || message.savedFilename;
+      link.click();
+      setTimeout(() => URL.revokeObjectURL(url), 1000);
+    } catch (error) {
+      console.error('Error downloading file:', error);
+    } finally {
+      setIsDownloading(false);
+    }
+  };
+
   const renderContent = () => {
     if (message.type === 'file') {
       return (
@@ -38,6 +63,11 @@ const MessageBubble: React.FC<MessageBubbleProps> = ({ message }) => {
               Download
             </a>
           )}
+          {!message.fileUrl && message.savedFilename && (
+            <button className="download-link" onClick={handleDownload} disabled={isDownloading}>
+              {isDownloading ? 'Downloading...' : 'Download'}
+            </button>
+          )}
         </div>
       );
     }
@@ -14,7 +14,8 @@ type PeerInfo = {
 };
 
 type MessageData = {
-  type: 'text' | 'file' | 'discovery' | 'peer_list' | 'ice-candidate' | 'offer' | 'answer' | 'call-rejected';
+  type: 'text' | 'file' | 'discovery' | 'peer_list' | 'peer_delta' | 'ice-candidate' | 'offer' | 'answer' | 'call-rejected'
+    | 'file_start' | 'file_end' | 'file_saved' | 'file_error' | 'file_get' | 'history';
   content?: string;
   filename?: string;
   fileSize?: number;
@@ -23,6 +24,9 @@ type MessageData = {
   username?: string;
   peer?: string;
   peers?: PeerInfo[];
+  version?: number;
+  joined?: PeerInfo[];
+  left?: string[];
   candidate?: any;
   offer?: RTCSessionDescriptionInit;
   answer?: RTCSessionDescriptionInit;
@@ -32,6 +36,56 @@ type MessageData = {
   [key: string]: any;
 };
 
+// Files travel as binary frames: 16-byte transfer id, 8-byte big-endian offset, then the bytes
+const FILE_CHUNK_SIZE = 256 * 1024;
+const FILE_CHUNK_HEADER_SIZE = 24;
+// Stop queueing chunks while this much is still waiting to go out
+const MAX_BUFFERED_BYTES = 4 * 1024 * 1024;
+
+const CRC_TABLE = (() => {
+  const table = new Uint32Array(256);
+  for (let n = 0; n < 256; n++) {
+    let c = n;
+    for (let k = 0; k < 8; k++) {
+      c = c & 1 ? 0xEDB88320 ^ (c >>> 1) : c >>> 1;
+    }
+    table[n] = c >>> 0;
+  }
+  return table;
+})();
+
+// Incremental CRC-32 (same as zlib.crc32); crypto.subtle is unavailable on plain-http LAN pages
+const crc32 = (data: Uint8Array, previous = 0): number => {
+  let crc = (previous ^ 0xFFFFFFFF) >>> 0;
+  for (let i = 0; i < data.length; i++) {
+    crc = CRC_TABLE[(crc ^ data[i]) & 0xFF] ^ (crc >>> 8);
+  }
+  return (crc ^ 0xFFFFFFFF) >>> 0;
+};
+
+const newTransferId = (): string =>
+  Array.from(crypto.getRandomValues(new Uint8Array(16)))
+    .map(b => b.toString(16).padStart(2, '0'))
+    .join('');
+
+const transferIdOf = (frame: ArrayBuffer): string =>
+  Array.from(new Uint8Array(frame, 0, 16))
+    .map(b => b.toString(16).padStart(2, '0'))
+    .join('');
+
+type PendingUpload = {
+  resolve: (saved: MessageData) => void;
+  reject: (error: Error) => void;
+};
+
+type PendingDownload = {
+  chunks: ArrayBuffer[];
+  mimeType?: string;
+  size?: number;  // From the server's file_start
+  resolve: (file: Blob) => void;
+  reject: (error: Error) => void;
+};
+
 // Add new functions to the context type
 interface WebSocketContextType {
   socket: WebSocket | null;
@@ -43,6 +97,8 @@ interface WebSocketContextType {
   connectToServer: (ip: string) => void;
   disconnect: () => void;
   onMessage: (handler: (data: MessageData) => void) => void;
+  sendFile: (file: File, extra?: Partial<MessageData>) => Promise<MessageData>;
+  fetchFile: (savedFilename: string, mimeType?: string) => Promise<Blob>;
 }
 
 const WebSocketContext = createContext<WebSocketContextType>({
@@ -55,6 +111,8 @@ const WebSocketContext = createContext<WebSocketContextType>({
   connectToServer: () => {},
   disconnect: () => {},
   onMessage: () => {},
+  sendFile: () => Promise.reject(new Error('WebSocket is not connected.')),
+  fetchFile: () => Promise.reject(new Error('WebSocket is not connected.')),
 });
 
 export const useWebSocket = () => useContext(WebSocketContext);
@@ -70,16 +128,70 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({ children }
   const [connectionError, setConnectionError] = useState<string | null>(null);
   const [availablePeers, setAvailablePeers] = useState<PeerInfo[]>([]);
   const messageHandlersRef = useRef<Array<(data: MessageData) => void>>([]);
+  // Version of the peer list we hold; deltas must follow it without a gap
+  const peerVersionRef = useRef<number | null>(null);
+  const uploadsRef = useRef<Map<string, PendingUpload>>(new Map());
+  const downloadsRef = useRef<Map<string, PendingDownload>>(new Map());
 
   const onMessage = useCallback((handler: (data: MessageData) => void) => {
     messageHandlersRef.current.push(handler);
   }, []);
 
   const handleMessage = useCallback((event: MessageEvent) => {
+    if (event.data instanceof ArrayBuffer) {
+      const download = downloadsRef.current.get(transferIdOf(event.data));
+      if (download) {
+        download.chunks.push(event.data.slice(FILE_CHUNK_HEADER_SIZE));
+      }
+      return;
+    }
     try {
       const message: MessageData = JSON.parse(event.data);
-      if (message.type === 'peer_list' && message.peers) {
+      const transferId: string | undefined = message.upload_id;
+      if (message.type === 'file_saved' && transferId) {
+        uploadsRef.current.get(transferId)?.resolve(message);
+        uploadsRef.current.delete(transferId);
+      } else if (message.type === 'file_error' && transferId) {
+        const error = new Error(message.error || 'File transfer failed');
+        uploadsRef.current.get(transferId)?.reject(error);
+        uploadsRef.current.delete(transferId);
+        downloadsRef.current.get(transferId)?.reject(error);
+        downloadsRef.current.delete(transferId);
+      } else if (message.type === 'file_start' && transferId) {
+        // Opens the reply to our file_get; never a chat message
+        const download = downloadsRef.current.get(transferId);
+        if (download) {
+          download.size = message.size;
+        }
+      } else if (message.type === 'file_end' && transferId) {
+        const download = downloadsRef.current.get(transferId);
+        if (download) {
+          downloadsRef.current.delete(transferId);
+          const file = new Blob(download.chunks, { type: download.mimeType });
+          if (download.size !== undefined && file.size !== download.size) {
+            download.reject(new Error(`Download incomplete: got ${file.size} of ${download.size} bytes`));
+          } else {
+            download.resolve(file);
+          }
+        }
+      } else if (message.type === 'peer_list' && message.peers) {
+        peerVersionRef.current = message.version ?? null;
         setAvailablePeers(message.peers);
+      } else if (message.type === 'peer_delta') {
+        const version = peerVersionRef.current;
+        if (version === null || message.version === undefined || message.version > version + 1) {
+          // Missed an update: ask for a full snapshot instead of guessing
+          (event.target as WebSocket).send(JSON.stringify({ type: 'peer_list' }));
+        } else if (message.version === version + 1) {
+          peerVersionRef.current = message.version;
+          const left = new Set(message.left || []);
+          const joined = message.joined || [];
+          const joinedIps = new Set(joined.map(peer => peer.ip));
+          setAvailablePeers(prev => [
+            ...prev.filter(peer => !left.has(peer.ip) && !joinedIps.has(peer.ip)),
+            ...joined,
+          ]);
+        }
       } else {
         // Call all registered message handlers
         messageHandlersRef.current.forEach(handler => handler(message));
@@ -106,6 +218,8 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({ children }
     console.log(`Attempting to connect to ${url}...`);
 
     const newSocket = new WebSocket(url);
+    newSocket.binaryType = 'arraybuffer';
+    peerVersionRef.current = null;
 
     const timeoutId = setTimeout(() => {
         if (newSocket.readyState !== WebSocket.OPEN) {
@@ -134,6 +248,11 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({ children }
 
     newSocket.onclose = () => {
       console.log('WebSocket disconnected');
+      const closed = new Error('Connection closed');
+      uploadsRef.current.forEach(upload => upload.reject(closed));
+      uploadsRef.current.clear();
+      downloadsRef.current.forEach(download => download.reject(closed));
+      downloadsRef.current.clear();
       setIsConnected(false);
       setIsConnecting(false);
       setSocket(null);
@@ -157,6 +276,58 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({ children }
     }
   }, [socket, isConnected]);
 
+  // Upload a file as file_start, binary chunks and file_end with a CRC-32; resolves with the server's file_saved
+  const sendFile = useCallback(async (file: File, extra: Partial<MessageData> = {}) => {
+    if (!socket || !isConnected) {
+      throw new Error('Cannot send file: WebSocket is not connected.');
+    }
+    const transferId = newTransferId();
+    const idBytes = new Uint8Array(transferId.match(/../g)!.map(byte => parseInt(byte, 16)));
+    const saved = new Promise<MessageData>((resolve, reject) => {
+      uploadsRef.current.set(transferId, { resolve, reject });
+    });
+    socket.send(JSON.stringify({
+      ...extra,
+      type: 'file_start',
+      upload_id: transferId,
+      fileName: file.name,
+      size: file.size,
+      mimeType: file.type,
+    }));
+    let crc = 0;
+    for (let offset = 0; offset < file.size && uploadsRef.current.has(transferId); offset += FILE_CHUNK_SIZE) {
+      const data = new Uint8Array(await file.slice(offset, offset + FILE_CHUNK_SIZE).arrayBuffer());
+      crc = crc32(data, crc);
+      const frame = new Uint8Array(FILE_CHUNK_HEADER_SIZE + data.length);
+      frame.set(idBytes, 0);
+      const view = new DataView(frame.buffer);
+      view.setUint32(16, Math.floor(offset / 0x100000000));
+      view.setUint32(20, offset >>> 0);
+      frame.set(data, FILE_CHUNK_HEADER_SIZE);
+      while (socket.bufferedAmount > MAX_BUFFERED_BYTES) {
+        await new Promise(resolve => setTimeout(resolve, 20));
+      }
+      socket.send(frame);
+    }
+    if (uploadsRef.current.has(transferId)) {
+      socket.send(JSON.stringify({ type: 'file_end', upload_id: transferId, crc32: crc }));
+    }
+    return saved;
+  }, [socket, isConnected]);
+
+  // Download a file the server stored, by the savedFilename its file message carried
+  const fetchFile = useCallback((savedFilename: string, mimeType?: string) => {
+    if (!socket || !isConnected) {
+      return Promise.reject(new Error('Cannot fetch file: WebSocket is not connected.'));
+    }
+    const transferId = newTransferId();
+    const file = new Promise<Blob>((resolve, reject) => {
+      downloadsRef.current.set(transferId, { chunks: [], mimeType, resolve, reject });
+    });
+    socket.send(JSON.stringify({ type: 'file_get', request_id: transferId, savedFilename }));
+    return file;
+  }, [socket, isConnected]);
+
   const value = {
     socket,
     isConnected,
@@ -167,6 +338,8 @@ export const WebSocketProvider: React.FC<WebSocketProviderProps> = ({ children }
     connectToServer,
     disconnect,
     onMessage,
+    sendFile,
+    fetchFile,
   };
 
   return (